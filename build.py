@@ -0,0 +1,46 @@
+"""
+Builds the optional compiled codec extension (dynamic_protobuf/_codec.c).
+
+The extension is optional, if it can not be compiled the pure Python encoder and decoder are used instead.
+For development, the extension can be built in place with: python build.py
+"""
+from setuptools import Extension
+from setuptools.command.build_ext import build_ext
+from setuptools.errors import CCompilerError, ExecError, PlatformError
+
+extensions = [
+    Extension('dynamic_protobuf._codec', sources=['dynamic_protobuf/_codec.c']),
+]
+
+
+class OptionalBuildExt(build_ext):
+
+    def run(self):
+        try:
+            super().run()
+        except PlatformError as error:
+            print(f'WARNING: Could not build the compiled codec extension, falling back to pure Python: {error}')
+
+    def build_extension(self, extension):
+        try:
+            super().build_extension(extension)
+        except (CCompilerError, ExecError, PlatformError, ValueError) as error:
+            print(f'WARNING: Could not build {extension.name}, falling back to pure Python: {error}')
+
+
+def build(setup_kwargs: dict):
+    setup_kwargs.update(
+        ext_modules=extensions,
+        cmdclass={'build_ext': OptionalBuildExt},
+    )
+
+
+if __name__ == '__main__':
+    from setuptools import setup
+
+    setup(
+        name='py-dynamic-protobuf-codec',
+        ext_modules=extensions,
+        cmdclass={'build_ext': OptionalBuildExt},
+        script_args=['build_ext', '--inplace'],
+    )
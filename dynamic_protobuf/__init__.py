@@ -2,3 +2,12 @@ from decoder import decode, DecoderFieldDefinition
 from encoder import encode
 from constants import WireType
 from parser import parse
+from imports import ImportCache
+from resolvers import ImportResolver, DirectoryResolver, ArchiveResolver, RemoteResolver
+from parallel import parallel_decode, CodecPool
+from schema_cache import SchemaCache
+from registry import SchemaRegistry
+from schema_set import parse_files, SchemaSet
+from type_registry import TypeRegistry
+from packing import PackingBackend, register_packing_backend, set_packing_backend
+from message_cache import EncodingCache, DecodeCache
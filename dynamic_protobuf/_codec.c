@@ -0,0 +1,1094 @@
+/*
+ * Compiled implementation of the wire format layer.
+ *
+ * This module implements the same proto_dict <-> bytes contract as the pure Python encoder.encode and
+ * decoder.decode functions, including their fallbacks (length delimited values that can not be decoded as a
+ * sub-message are returned as a string or a hexadecimal string) and their float rounding.
+ * The pure Python implementation remains the reference, this module is only a faster drop-in replacement.
+ */
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <math.h>
+#include <stdint.h>
+#include <string.h>
+
+/* A mask for getting only the most significant bit (continuation bit). */
+#define MOST_SIGNIFICANT_BIT_MASK 0x80
+
+/* A mask for getting only the value bits. */
+#define VALUE_MASK 0x7F
+
+/* A mask for getting only the wire type bits. */
+#define WIRE_TYPE_MASK 0x07
+
+#define WIRE_TYPE_VARINT 0
+#define WIRE_TYPE_FIXED64 1
+#define WIRE_TYPE_LENGTH_DELIMITED 2
+#define WIRE_TYPE_FIXED32 5
+
+/* The values of DecoderFieldType.REPEATED_PACKED, DecoderFieldType.MAP and DecoderFieldType.BYTES. */
+#define DECODER_FIELD_TYPE_REPEATED_PACKED 3
+#define DECODER_FIELD_TYPE_MAP 4
+#define DECODER_FIELD_TYPE_BYTES 5
+
+/* Returned by packed_wire_type for map and bytes field definitions, of which the values are returned as raw bytes. */
+#define RAW_BYTES_FIELD -3
+
+/* The number of decimals to round to for 32-bit and 64-bit floats to get rid of floating point error. */
+#define SEVEN_DECIMALS 10000000.0
+#define FIFTEEN_DECIMALS 1000000000000000.0
+
+static PyObject *struct_error = NULL;
+
+
+/* ---------------------------------------------------------------------------------------------------------------- */
+/* Output buffer                                                                                                    */
+/* ---------------------------------------------------------------------------------------------------------------- */
+
+typedef struct {
+    unsigned char *data;
+    Py_ssize_t length;
+    Py_ssize_t capacity;
+} output_buffer;
+
+static int
+output_reserve(output_buffer *output, Py_ssize_t extra)
+{
+    if (output->length + extra <= output->capacity) {
+        return 0;
+    }
+    Py_ssize_t capacity = output->capacity ? output->capacity : 64;
+    while (capacity < output->length + extra) {
+        capacity *= 2;
+    }
+    unsigned char *data = PyMem_Realloc(output->data, capacity);
+    if (!data) {
+        PyErr_NoMemory();
+        return -1;
+    }
+    output->data = data;
+    output->capacity = capacity;
+    return 0;
+}
+
+static int
+output_write(output_buffer *output, const void *data, Py_ssize_t length)
+{
+    if (output_reserve(output, length) < 0) {
+        return -1;
+    }
+    memcpy(output->data + output->length, data, length);
+    output->length += length;
+    return 0;
+}
+
+static int
+output_write_varint(output_buffer *output, uint64_t value)
+{
+    if (output_reserve(output, 10) < 0) {
+        return -1;
+    }
+    while (value >> 7) {
+        output->data[output->length++] = (unsigned char)((value & VALUE_MASK) | MOST_SIGNIFICANT_BIT_MASK);
+        value >>= 7;
+    }
+    output->data[output->length++] = (unsigned char)value;
+    return 0;
+}
+
+static void
+output_free(output_buffer *output)
+{
+    PyMem_Free(output->data);
+    output->data = NULL;
+    output->length = output->capacity = 0;
+}
+
+static PyObject *decode_buffer(const unsigned char *buffer, Py_ssize_t length, PyObject *definition);
+static int encode_dict(PyObject *proto_dict, int determine_wire_types, int deterministic, output_buffer *output);
+
+
+/* ---------------------------------------------------------------------------------------------------------------- */
+/* Decoding                                                                                                         */
+/* ---------------------------------------------------------------------------------------------------------------- */
+
+/*
+ * Reads a varint starting at *index and moves *index to the first byte after the varint.
+ * Varints that do not fit in 64 bits are returned as Python integers through big_value, like the pure Python
+ * decoder does, in which case the return value is 0.
+ */
+static int
+read_varint(const unsigned char *buffer, Py_ssize_t length, Py_ssize_t *index, uint64_t *value,
+            PyObject **big_value)
+{
+    Py_ssize_t start = *index;
+    Py_ssize_t next_index = start;
+    uint64_t result = 0;
+    int shift = 0;
+    unsigned char byte;
+
+    *big_value = NULL;
+    do {
+        if (next_index >= length) {
+            PyErr_SetString(PyExc_IndexError, "index out of range");
+            return -1;
+        }
+        byte = buffer[next_index++];
+        if (shift < 64) {
+            result |= (uint64_t)(byte & VALUE_MASK) << shift;
+        }
+        shift += 7;
+    } while (byte & MOST_SIGNIFICANT_BIT_MASK);
+
+    Py_ssize_t byte_count = next_index - start;
+    if (byte_count > 10 || (byte_count == 10 && (buffer[next_index - 1] & VALUE_MASK) > 1)) {
+        // The value does not fit in 64 bits, so it is built as a Python integer, most significant byte first.
+        PyObject *big = PyLong_FromLong(0);
+        PyObject *seven = PyLong_FromLong(7);
+        if (!big || !seven) {
+            Py_XDECREF(big);
+            Py_XDECREF(seven);
+            return -1;
+        }
+        for (Py_ssize_t i = next_index - 1; i >= start; i--) {
+            PyObject *shifted = PyNumber_Lshift(big, seven);
+            Py_DECREF(big);
+            if (!shifted) {
+                Py_DECREF(seven);
+                return -1;
+            }
+            PyObject *part = PyLong_FromLong(buffer[i] & VALUE_MASK);
+            if (!part) {
+                Py_DECREF(shifted);
+                Py_DECREF(seven);
+                return -1;
+            }
+            big = PyNumber_Or(shifted, part);
+            Py_DECREF(shifted);
+            Py_DECREF(part);
+            if (!big) {
+                Py_DECREF(seven);
+                return -1;
+            }
+        }
+        Py_DECREF(seven);
+        *big_value = big;
+    }
+
+    *value = result;
+    *index = next_index;
+    return 0;
+}
+
+static PyObject *
+varint_to_object(uint64_t value, PyObject *big_value)
+{
+    if (big_value) {
+        return big_value;
+    }
+    return PyLong_FromUnsignedLongLong(value);
+}
+
+/* Python's float modulo, the result has the sign of the divisor. */
+static double
+python_float_mod(double dividend, double divisor)
+{
+    double mod = fmod(dividend, divisor);
+    if (mod) {
+        if ((divisor < 0) != (mod < 0)) {
+            mod += divisor;
+        }
+    }
+    else {
+        mod = copysign(0.0, divisor);
+    }
+    return mod;
+}
+
+/* Rounds the float the same way as the pure Python decoder to get rid of floating point errors. */
+static PyObject *
+round_float(double value, double decimals)
+{
+    // If the value is NaN, it does not equal itself.
+    if (value == value) {
+        double remainder = python_float_mod(value * decimals, 10.0);
+        if (isnan(remainder)) {
+            PyErr_SetString(PyExc_ValueError, "cannot convert float NaN to integer");
+            return NULL;
+        }
+        long last_digit = (long)ceil(remainder) - 1;
+        // Adding 0.0 turns -0.0 into 0.0, the pure Python decoder rounds through an integer which has no sign.
+        if (last_digit == 0) {
+            value = (floor(value * decimals) + 0.0) / decimals;
+        }
+        else if (last_digit == 9) {
+            value = (ceil(value * decimals) + 0.0) / decimals;
+        }
+        else if (last_digit != -1) {
+            PyObject *float_value = PyFloat_FromDouble(value);
+            if (float_value) {
+                PyErr_Format(PyExc_Exception, "Unexpected float error: last digit %ld for value %R",
+                             last_digit, float_value);
+                Py_DECREF(float_value);
+            }
+            return NULL;
+        }
+    }
+    return PyFloat_FromDouble(value);
+}
+
+/* Returns the bytes as a string if they are printable, otherwise as a hexadecimal string. */
+static PyObject *
+undecodable_bytes_to_object(const unsigned char *buffer, Py_ssize_t length)
+{
+    // The pure Python decoder checks if the repr of the bytes contains '\x', this is the equivalent check.
+    int printable = 1;
+    for (Py_ssize_t i = 0; i < length; i++) {
+        unsigned char byte = buffer[i];
+        if ((byte < 0x20 && byte != '\t' && byte != '\n' && byte != '\r') || byte >= 0x7F ||
+                (byte == '\\' && i + 1 < length && buffer[i + 1] == 'x')) {
+            printable = 0;
+            break;
+        }
+    }
+    if (printable) {
+        return PyUnicode_DecodeASCII((const char *)buffer, length, NULL);
+    }
+
+    static const char hex_digits[] = "0123456789abcdef";
+    PyObject *hex = PyUnicode_New(length * 2, 127);
+    if (!hex) {
+        return NULL;
+    }
+    Py_UCS1 *hex_data = PyUnicode_1BYTE_DATA(hex);
+    for (Py_ssize_t i = 0; i < length; i++) {
+        hex_data[2 * i] = hex_digits[buffer[i] >> 4];
+        hex_data[2 * i + 1] = hex_digits[buffer[i] & 0x0F];
+    }
+    return hex;
+}
+
+/*
+ * Returns the wire type value of a packed repeated field definition, RAW_BYTES_FIELD for a map or bytes field
+ * definition, -1 if the field definition is none of those and -2 on error.
+ */
+static long
+packed_wire_type(PyObject *field_definition)
+{
+    if (!field_definition || field_definition == Py_None || PyDict_Check(field_definition)) {
+        return -1;
+    }
+
+    PyObject *field_type = PyObject_GetAttrString(field_definition, "type");
+    if (!field_type) {
+        PyErr_Clear();
+        return -1;
+    }
+    PyObject *field_type_value = PyObject_GetAttrString(field_type, "value");
+    Py_DECREF(field_type);
+    if (!field_type_value) {
+        PyErr_Clear();
+        return -1;
+    }
+    long type_value = PyLong_Check(field_type_value) ? PyLong_AsLong(field_type_value) : -1;
+    Py_DECREF(field_type_value);
+    if (type_value == DECODER_FIELD_TYPE_MAP || type_value == DECODER_FIELD_TYPE_BYTES) {
+        return RAW_BYTES_FIELD;
+    }
+    if (type_value != DECODER_FIELD_TYPE_REPEATED_PACKED) {
+        PyErr_Clear();
+        return -1;
+    }
+
+    PyObject *wire_type = PyObject_GetAttrString(field_definition, "wire_type");
+    if (!wire_type) {
+        return -2;
+    }
+    PyObject *wire_type_value = PyObject_GetAttrString(wire_type, "value");
+    Py_DECREF(wire_type);
+    if (!wire_type_value) {
+        return -2;
+    }
+    long wire_type_number = PyLong_AsLong(wire_type_value);
+    Py_DECREF(wire_type_value);
+    if (wire_type_number == -1 && PyErr_Occurred()) {
+        return -2;
+    }
+    return wire_type_number;
+}
+
+static PyObject *parse_value(const unsigned char *buffer, Py_ssize_t length, Py_ssize_t *index, long wire_type,
+                             PyObject *field_definition);
+
+static PyObject *
+parse_packed_repeated(const unsigned char *buffer, Py_ssize_t length, long wire_type)
+{
+    if (wire_type != WIRE_TYPE_VARINT && wire_type != WIRE_TYPE_FIXED64 &&
+            wire_type != WIRE_TYPE_LENGTH_DELIMITED && wire_type != WIRE_TYPE_FIXED32) {
+        PyObject *key = PyLong_FromLong(wire_type);
+        if (key) {
+            PyErr_SetObject(PyExc_KeyError, key);
+            Py_DECREF(key);
+        }
+        return NULL;
+    }
+
+    PyObject *values = PyList_New(0);
+    if (!values) {
+        return NULL;
+    }
+    Py_ssize_t index = 0;
+    while (index < length) {
+        PyObject *value = parse_value(buffer, length, &index, wire_type, NULL);
+        if (!value || PyList_Append(values, value) < 0) {
+            Py_XDECREF(value);
+            Py_DECREF(values);
+            return NULL;
+        }
+        Py_DECREF(value);
+    }
+    return values;
+}
+
+static PyObject *
+parse_length_delimited(const unsigned char *buffer, Py_ssize_t length, Py_ssize_t *index,
+                       PyObject *field_definition)
+{
+    // The first bytes of a length delimited value contain the length of the value as a varint.
+    uint64_t value_length;
+    PyObject *big_length;
+    if (read_varint(buffer, length, index, &value_length, &big_length) < 0) {
+        return NULL;
+    }
+
+    // Like slicing in Python, a length that runs past the end of the buffer is cut off at the end of the buffer.
+    Py_ssize_t start = *index;
+    Py_ssize_t end = length;
+    if (!big_length && value_length <= (uint64_t)(length - start)) {
+        end = start + (Py_ssize_t)value_length;
+    }
+    Py_XDECREF(big_length);
+    *index = end;
+
+    long packed = packed_wire_type(field_definition);
+    if (packed == -2) {
+        return NULL;
+    }
+    if (packed == RAW_BYTES_FIELD) {
+        // Map entries and bytes values are returned as raw bytes, map entries are decoded with the key and value
+        // types of the map.
+        return PyBytes_FromStringAndSize((const char *)buffer + start, end - start);
+    }
+    if (packed >= 0) {
+        return parse_packed_repeated(buffer + start, end - start, packed);
+    }
+
+    // The inside of the length delimited value can be processed as a separate byte blob.
+    PyObject *value = decode_buffer(buffer + start, end - start, field_definition);
+    if (value) {
+        return value;
+    }
+
+    // If the decoding fails, we return the raw bytes as a string or as a hexadecimal value.
+    PyErr_Clear();
+    return undecodable_bytes_to_object(buffer + start, end - start);
+}
+
+static PyObject *
+parse_value(const unsigned char *buffer, Py_ssize_t length, Py_ssize_t *index, long wire_type,
+            PyObject *field_definition)
+{
+    switch (wire_type) {
+        case WIRE_TYPE_VARINT: {
+            uint64_t value;
+            PyObject *big_value;
+            if (read_varint(buffer, length, index, &value, &big_value) < 0) {
+                return NULL;
+            }
+            return varint_to_object(value, big_value);
+        }
+        case WIRE_TYPE_FIXED64: {
+            if (length - *index < 8) {
+                PyErr_SetString(struct_error, "unpack requires a buffer of 8 bytes");
+                return NULL;
+            }
+            double value;
+            memcpy(&value, buffer + *index, 8);
+            *index += 8;
+            return round_float(value, FIFTEEN_DECIMALS);
+        }
+        case WIRE_TYPE_LENGTH_DELIMITED:
+            return parse_length_delimited(buffer, length, index, field_definition);
+        case WIRE_TYPE_FIXED32: {
+            if (length - *index < 4) {
+                PyErr_SetString(struct_error, "unpack requires a buffer of 4 bytes");
+                return NULL;
+            }
+            float value;
+            memcpy(&value, buffer + *index, 4);
+            *index += 4;
+            return round_float((double)value, SEVEN_DECIMALS);
+        }
+        default: {
+            PyObject *key = PyLong_FromLong(wire_type);
+            if (key) {
+                PyErr_SetObject(PyExc_KeyError, key);
+                Py_DECREF(key);
+            }
+            return NULL;
+        }
+    }
+}
+
+static PyObject *
+get_field_definition(PyObject *definition, PyObject *field_number)
+{
+    if (PyDict_CheckExact(definition)) {
+        PyObject *field_definition = PyDict_GetItemWithError(definition, field_number);
+        if (!field_definition) {
+            if (PyErr_Occurred()) {
+                return NULL;
+            }
+            field_definition = Py_None;
+        }
+        Py_INCREF(field_definition);
+        return field_definition;
+    }
+    return PyObject_CallMethod(definition, "get", "O", field_number);
+}
+
+static int
+add_decoded_value(PyObject *decoded_object, PyObject *field_number, PyObject *value)
+{
+    PyObject *field_value = PyDict_GetItemWithError(decoded_object, field_number);
+    if (!field_value) {
+        if (PyErr_Occurred()) {
+            return -1;
+        }
+        return PyDict_SetItem(decoded_object, field_number, value);
+    }
+
+    int truthy = PyObject_IsTrue(field_value);
+    if (truthy < 0) {
+        return -1;
+    }
+    if (!truthy) {
+        return PyDict_SetItem(decoded_object, field_number, value);
+    }
+    if (PyList_Check(field_value)) {
+        return PyList_Append(field_value, value);
+    }
+
+    PyObject *values = PyList_New(2);
+    if (!values) {
+        return -1;
+    }
+    Py_INCREF(field_value);
+    Py_INCREF(value);
+    PyList_SET_ITEM(values, 0, field_value);
+    PyList_SET_ITEM(values, 1, value);
+    int result = PyDict_SetItem(decoded_object, field_number, values);
+    Py_DECREF(values);
+    return result;
+}
+
+static PyObject *
+decode_buffer(const unsigned char *buffer, Py_ssize_t length, PyObject *definition)
+{
+    int has_definition = 0;
+    if (definition && definition != Py_None) {
+        has_definition = PyObject_IsTrue(definition);
+        if (has_definition < 0) {
+            return NULL;
+        }
+    }
+
+    if (Py_EnterRecursiveCall(" while decoding a protobuf message")) {
+        return NULL;
+    }
+
+    PyObject *decoded_object = PyDict_New();
+    if (!decoded_object) {
+        Py_LeaveRecursiveCall();
+        return NULL;
+    }
+
+    Py_ssize_t index = 0;
+    while (index < length) {
+        // The first 3 bits contain the wire type, the remaining bits contain the field number.
+        long wire_type = buffer[index] & WIRE_TYPE_MASK;
+        if (wire_type != WIRE_TYPE_VARINT && wire_type != WIRE_TYPE_FIXED64 &&
+                wire_type != WIRE_TYPE_LENGTH_DELIMITED && wire_type != WIRE_TYPE_FIXED32) {
+            PyObject *key = PyLong_FromLong(wire_type);
+            if (key) {
+                PyErr_SetObject(PyExc_KeyError, key);
+                Py_DECREF(key);
+            }
+            goto error;
+        }
+
+        uint64_t tag;
+        PyObject *big_tag;
+        if (read_varint(buffer, length, &index, &tag, &big_tag) < 0) {
+            goto error;
+        }
+
+        PyObject *field_number;
+        if (big_tag) {
+            PyObject *three = PyLong_FromLong(3);
+            field_number = three ? PyNumber_Rshift(big_tag, three) : NULL;
+            Py_XDECREF(three);
+            Py_DECREF(big_tag);
+        }
+        else {
+            field_number = PyLong_FromUnsignedLongLong(tag >> 3);
+        }
+        if (!field_number) {
+            goto error;
+        }
+
+        // A field number without a value at the end of the message is ignored.
+        if (index >= length) {
+            Py_DECREF(field_number);
+            break;
+        }
+
+        PyObject *field_definition = NULL;
+        if (has_definition) {
+            field_definition = get_field_definition(definition, field_number);
+            if (!field_definition) {
+                Py_DECREF(field_number);
+                goto error;
+            }
+        }
+
+        PyObject *value = parse_value(buffer, length, &index, wire_type, field_definition);
+        Py_XDECREF(field_definition);
+        if (!value) {
+            Py_DECREF(field_number);
+            goto error;
+        }
+
+        int result = add_decoded_value(decoded_object, field_number, value);
+        Py_DECREF(field_number);
+        Py_DECREF(value);
+        if (result < 0) {
+            goto error;
+        }
+    }
+
+    Py_LeaveRecursiveCall();
+    return decoded_object;
+
+error:
+    Py_LeaveRecursiveCall();
+    Py_DECREF(decoded_object);
+    return NULL;
+}
+
+PyDoc_STRVAR(decode_doc,
+"decode(byte_blob, definition=None)\n"
+"--\n"
+"\n"
+"Decode a byte blob into a dictionary.\n"
+"Compiled implementation of decoder.decode, see its documentation for details.");
+
+static PyObject *
+codec_decode(PyObject *module, PyObject *args, PyObject *kwargs)
+{
+    static char *keywords[] = {"byte_blob", "definition", NULL};
+    Py_buffer byte_blob;
+    PyObject *definition = Py_None;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "y*|O:decode", keywords, &byte_blob, &definition)) {
+        return NULL;
+    }
+    PyObject *result = decode_buffer(byte_blob.buf, byte_blob.len, definition);
+    PyBuffer_Release(&byte_blob);
+    return result;
+}
+
+
+/* ---------------------------------------------------------------------------------------------------------------- */
+/* Encoding                                                                                                         */
+/* ---------------------------------------------------------------------------------------------------------------- */
+
+/* Writes an arbitrary Python integer as a varint, following the pure Python encoder for out of range values. */
+static int
+write_varint_object(output_buffer *output, PyObject *int_value)
+{
+    if (!PyLong_Check(int_value)) {
+        PyErr_Format(PyExc_TypeError, "unsupported operand type(s) for >>: '%.100s' and 'int'",
+                     Py_TYPE(int_value)->tp_name);
+        return -1;
+    }
+
+    int overflow;
+    long long signed_value = PyLong_AsLongLongAndOverflow(int_value, &overflow);
+    if (!overflow) {
+        if (signed_value == -1 && PyErr_Occurred()) {
+            return -1;
+        }
+        // Negative values are converted to a positive value by adding 2^64, which is the same as a cast.
+        return output_write_varint(output, (uint64_t)signed_value);
+    }
+    if (overflow > 0) {
+        unsigned long long unsigned_value = PyLong_AsUnsignedLongLong(int_value);
+        if (!PyErr_Occurred()) {
+            return output_write_varint(output, unsigned_value);
+        }
+        PyErr_Clear();
+    }
+
+    // The value does not fit in 64 bits, it is encoded with Python integers exactly like the pure Python encoder.
+    PyObject *value = int_value;
+    Py_INCREF(value);
+    PyObject *seven = PyLong_FromLong(7);
+    PyObject *mask = PyLong_FromLong(VALUE_MASK);
+    PyObject *zero = PyLong_FromLong(0);
+    int result = -1;
+    if (!seven || !mask || !zero) {
+        goto done;
+    }
+    if (overflow < 0) {
+        PyObject *one = PyLong_FromLong(1);
+        PyObject *sixty_four = PyLong_FromLong(64);
+        PyObject *two_to_sixty_four = (one && sixty_four) ? PyNumber_Lshift(one, sixty_four) : NULL;
+        Py_XDECREF(one);
+        Py_XDECREF(sixty_four);
+        if (!two_to_sixty_four) {
+            goto done;
+        }
+        PyObject *adjusted = PyNumber_Add(value, two_to_sixty_four);
+        Py_DECREF(two_to_sixty_four);
+        if (!adjusted) {
+            goto done;
+        }
+        Py_SETREF(value, adjusted);
+    }
+    for (;;) {
+        PyObject *shifted = PyNumber_Rshift(value, seven);
+        if (!shifted) {
+            goto done;
+        }
+        int more = PyObject_RichCompareBool(shifted, zero, Py_GT);
+        PyObject *low_bits = PyNumber_And(value, mask);
+        if (more < 0 || !low_bits) {
+            Py_DECREF(shifted);
+            Py_XDECREF(low_bits);
+            goto done;
+        }
+        unsigned char byte = (unsigned char)PyLong_AsLong(low_bits);
+        Py_DECREF(low_bits);
+        if (more) {
+            byte |= MOST_SIGNIFICANT_BIT_MASK;
+        }
+        if (output_write(output, &byte, 1) < 0) {
+            Py_DECREF(shifted);
+            goto done;
+        }
+        Py_SETREF(value, shifted);
+        if (!more) {
+            break;
+        }
+    }
+    result = 0;
+
+done:
+    Py_DECREF(value);
+    Py_XDECREF(seven);
+    Py_XDECREF(mask);
+    Py_XDECREF(zero);
+    return result;
+}
+
+/* Writes the field number and wire type, followed by nothing else. */
+static int
+write_tag(output_buffer *output, PyObject *field_number, long wire_type)
+{
+    if (PyLong_Check(field_number)) {
+        int overflow;
+        long long number = PyLong_AsLongLongAndOverflow(field_number, &overflow);
+        if (!overflow && number >= 0 && number < ((long long)1 << 60)) {
+            return output_write_varint(output, ((uint64_t)number << 3) | (uint64_t)wire_type);
+        }
+        if (number == -1 && PyErr_Occurred()) {
+            return -1;
+        }
+    }
+
+    PyObject *three = PyLong_FromLong(3);
+    PyObject *wire_type_object = PyLong_FromLong(wire_type);
+    PyObject *shifted = (three && wire_type_object) ? PyNumber_Lshift(field_number, three) : NULL;
+    PyObject *tag = shifted ? PyNumber_Or(shifted, wire_type_object) : NULL;
+    Py_XDECREF(three);
+    Py_XDECREF(wire_type_object);
+    Py_XDECREF(shifted);
+    if (!tag) {
+        return -1;
+    }
+    int result = write_varint_object(output, tag);
+    Py_DECREF(tag);
+    return result;
+}
+
+static int
+write_length_delimited(output_buffer *output, const void *data, Py_ssize_t length)
+{
+    if (output_write_varint(output, (uint64_t)length) < 0) {
+        return -1;
+    }
+    return output_write(output, data, length);
+}
+
+static int
+unpack_pair(PyObject *pair, PyObject **first, PyObject **second)
+{
+    PyObject *sequence = PySequence_Fast(pair, "cannot unpack non-iterable object");
+    if (!sequence) {
+        return -1;
+    }
+    Py_ssize_t size = PySequence_Fast_GET_SIZE(sequence);
+    if (size != 2) {
+        if (size < 2) {
+            PyErr_Format(PyExc_ValueError, "not enough values to unpack (expected 2, got %zd)", size);
+        }
+        else {
+            PyErr_SetString(PyExc_ValueError, "too many values to unpack (expected 2)");
+        }
+        Py_DECREF(sequence);
+        return -1;
+    }
+    *first = PySequence_Fast_GET_ITEM(sequence, 0);
+    *second = PySequence_Fast_GET_ITEM(sequence, 1);
+    Py_INCREF(*first);
+    Py_INCREF(*second);
+    Py_DECREF(sequence);
+    return 0;
+}
+
+static long
+wire_type_number(PyObject *wire_type)
+{
+    PyObject *value = PyObject_GetAttrString(wire_type, "value");
+    if (!value) {
+        return -1;
+    }
+    long number = PyLong_AsLong(value);
+    Py_DECREF(value);
+    return number;
+}
+
+static int
+encode_value(output_buffer *output, PyObject *field_number, PyObject *value, long wire_type,
+             int packed_repeated_value, int determine_wire_types, int deterministic, int include_field_number)
+{
+    // The field number is shifted 3 bits to the left and combined with the wire type, encoded as a varint.
+    if (include_field_number && write_tag(output, field_number, wire_type) < 0) {
+        return -1;
+    }
+
+    switch (wire_type) {
+        case WIRE_TYPE_VARINT:
+            // Booleans are integers, so they are encoded as 0 or 1.
+            return write_varint_object(output, value);
+        case WIRE_TYPE_FIXED32: {
+            // Like struct.pack('f', value), the value is cast to a 32-bit float in native byte order.
+            double double_value = PyFloat_AsDouble(value);
+            if (double_value == -1.0 && PyErr_Occurred()) {
+                PyErr_SetString(struct_error, "required argument is not a float");
+                return -1;
+            }
+            float float_value = (float)double_value;
+            return output_write(output, &float_value, 4);
+        }
+        case WIRE_TYPE_FIXED64: {
+            // Like struct.pack('d', value), the value is written as a 64-bit float in native byte order.
+            double double_value = PyFloat_AsDouble(value);
+            if (double_value == -1.0 && PyErr_Occurred()) {
+                PyErr_SetString(struct_error, "required argument is not a float");
+                return -1;
+            }
+            return output_write(output, &double_value, 8);
+        }
+        case WIRE_TYPE_LENGTH_DELIMITED:
+            break;
+        default:
+            return 0;
+    }
+
+    if (packed_repeated_value) {
+        PyObject *packed_wire_type_object, *packed_list;
+        if (unpack_pair(value, &packed_wire_type_object, &packed_list) < 0) {
+            return -1;
+        }
+        long packed_wire_type = wire_type_number(packed_wire_type_object);
+        Py_DECREF(packed_wire_type_object);
+        if (packed_wire_type == -1 && PyErr_Occurred()) {
+            Py_DECREF(packed_list);
+            return -1;
+        }
+
+        output_buffer packed_output = {NULL, 0, 0};
+        PyObject *iterator = PyObject_GetIter(packed_list);
+        Py_DECREF(packed_list);
+        if (!iterator) {
+            return -1;
+        }
+        PyObject *packed_value;
+        while ((packed_value = PyIter_Next(iterator))) {
+            int result = encode_value(&packed_output, field_number, packed_value, packed_wire_type, 0,
+                                      determine_wire_types, deterministic, 0);
+            Py_DECREF(packed_value);
+            if (result < 0) {
+                break;
+            }
+        }
+        Py_DECREF(iterator);
+        if (PyErr_Occurred()) {
+            output_free(&packed_output);
+            return -1;
+        }
+        int result = write_length_delimited(output, packed_output.data, packed_output.length);
+        output_free(&packed_output);
+        return result;
+    }
+
+    if (PyDict_Check(value)) {
+        output_buffer sub_message_output = {NULL, 0, 0};
+        if (encode_dict(value, determine_wire_types, deterministic, &sub_message_output) < 0) {
+            output_free(&sub_message_output);
+            return -1;
+        }
+        int result = write_length_delimited(output, sub_message_output.data, sub_message_output.length);
+        output_free(&sub_message_output);
+        return result;
+    }
+
+    if (PyUnicode_Check(value)) {
+        Py_ssize_t length;
+        const char *data = PyUnicode_AsUTF8AndSize(value, &length);
+        if (!data) {
+            return -1;
+        }
+        return write_length_delimited(output, data, length);
+    }
+
+    if (PyBytes_Check(value)) {
+        return write_length_delimited(output, PyBytes_AS_STRING(value), PyBytes_GET_SIZE(value));
+    }
+
+    PyObject *bytes_value = PyBytes_FromObject(value);
+    if (!bytes_value) {
+        return -1;
+    }
+    int result = write_length_delimited(output, PyBytes_AS_STRING(bytes_value), PyBytes_GET_SIZE(bytes_value));
+    Py_DECREF(bytes_value);
+    return result;
+}
+
+/* The equivalent of encoder._determine_wire_type, returns -1 if the wire type can not be determined. */
+static long
+determine_wire_type(PyObject *value)
+{
+    PyTypeObject *type = Py_TYPE(value);
+    if (type == &PyFloat_Type) {
+        return WIRE_TYPE_FIXED32;
+    }
+    if (type == &PyLong_Type || type == &PyBool_Type) {
+        return WIRE_TYPE_VARINT;
+    }
+    if (type == &PyDict_Type || type == &PyUnicode_Type || type == &PyBytes_Type || type == &PyList_Type) {
+        return WIRE_TYPE_LENGTH_DELIMITED;
+    }
+    return -1;
+}
+
+static int
+encode_field(output_buffer *output, PyObject *field_number, PyObject *value, int determine_wire_types,
+             int deterministic)
+{
+    long wire_type = -1;
+    int result = -1;
+
+    Py_INCREF(value);
+    if (PyTuple_Check(value)) {
+        PyObject *wire_type_object, *inner_value;
+        if (unpack_pair(value, &wire_type_object, &inner_value) < 0) {
+            Py_DECREF(value);
+            return -1;
+        }
+        Py_SETREF(value, inner_value);
+
+        int truthy = PyObject_IsTrue(wire_type_object);
+        if (truthy > 0) {
+            wire_type = wire_type_number(wire_type_object);
+        }
+        Py_DECREF(wire_type_object);
+        if (truthy < 0 || (wire_type == -1 && PyErr_Occurred())) {
+            goto done;
+        }
+    }
+    else if (determine_wire_types) {
+        wire_type = determine_wire_type(value);
+    }
+
+    if (wire_type < 0) {
+        PyErr_Format(PyExc_ValueError, "Wire type could not be determined for value: %S", value);
+        goto done;
+    }
+
+    int packed_repeated_value = 0;
+    if (PyTuple_Check(value)) {
+        if (PyTuple_GET_SIZE(value) < 2) {
+            PyErr_SetString(PyExc_IndexError, "tuple index out of range");
+            goto done;
+        }
+        packed_repeated_value = PyList_Check(PyTuple_GET_ITEM(value, 1));
+    }
+
+    if (PyList_Check(value)) {
+        // Non-packed repeated values are encoded as separate fields with the same field number.
+        for (Py_ssize_t i = 0; i < PyList_GET_SIZE(value); i++) {
+            PyObject *list_value = PyList_GET_ITEM(value, i);
+            Py_INCREF(list_value);
+            int list_result = encode_value(output, field_number, list_value, wire_type, packed_repeated_value,
+                                           determine_wire_types, deterministic, 1);
+            Py_DECREF(list_value);
+            if (list_result < 0) {
+                goto done;
+            }
+        }
+        result = 0;
+    }
+    else {
+        result = encode_value(output, field_number, value, wire_type, packed_repeated_value, determine_wire_types,
+                              deterministic, 1);
+    }
+
+done:
+    Py_DECREF(value);
+    return result;
+}
+
+static int
+encode_dict(PyObject *proto_dict, int determine_wire_types, int deterministic, output_buffer *output)
+{
+    if (Py_EnterRecursiveCall(" while encoding a protobuf message")) {
+        return -1;
+    }
+
+    int result = 0;
+    if (PyDict_CheckExact(proto_dict) && !deterministic) {
+        Py_ssize_t position = 0;
+        PyObject *field_number, *value;
+        while (PyDict_Next(proto_dict, &position, &field_number, &value)) {
+            Py_INCREF(field_number);
+            Py_INCREF(value);
+            result = encode_field(output, field_number, value, determine_wire_types, 0);
+            Py_DECREF(field_number);
+            Py_DECREF(value);
+            if (result < 0) {
+                break;
+            }
+        }
+    }
+    else {
+        PyObject *items = PyMapping_Items(proto_dict);
+        // Deterministic encoding orders the fields by number, numbers are unique so the values are never compared.
+        if (!items || (deterministic && PyList_Sort(items) < 0)) {
+            Py_XDECREF(items);
+            Py_LeaveRecursiveCall();
+            return -1;
+        }
+        for (Py_ssize_t i = 0; i < PyList_GET_SIZE(items); i++) {
+            PyObject *field_number, *value;
+            if (unpack_pair(PyList_GET_ITEM(items, i), &field_number, &value) < 0) {
+                result = -1;
+                break;
+            }
+            result = encode_field(output, field_number, value, determine_wire_types, deterministic);
+            Py_DECREF(field_number);
+            Py_DECREF(value);
+            if (result < 0) {
+                break;
+            }
+        }
+        Py_DECREF(items);
+    }
+
+    Py_LeaveRecursiveCall();
+    return result;
+}
+
+PyDoc_STRVAR(encode_doc,
+"encode(proto_dict, determine_wire_types=False, deterministic=False)\n"
+"--\n"
+"\n"
+"Encode a proto_dict to bytes.\n"
+"Compiled implementation of encoder.encode, see its documentation for details.");
+
+static PyObject *
+codec_encode(PyObject *module, PyObject *args, PyObject *kwargs)
+{
+    static char *keywords[] = {"proto_dict", "determine_wire_types", "deterministic", NULL};
+    PyObject *proto_dict;
+    int determine_wire_types = 0;
+    int deterministic = 0;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "O|pp:encode", keywords, &proto_dict, &determine_wire_types,
+                                     &deterministic)) {
+        return NULL;
+    }
+
+    output_buffer output = {NULL, 0, 0};
+    if (encode_dict(proto_dict, determine_wire_types, deterministic, &output) < 0) {
+        output_free(&output);
+        return NULL;
+    }
+    PyObject *result = PyBytes_FromStringAndSize((const char *)output.data, output.length);
+    output_free(&output);
+    return result;
+}
+
+
+/* ---------------------------------------------------------------------------------------------------------------- */
+/* Module                                                                                                           */
+/* ---------------------------------------------------------------------------------------------------------------- */
+
+static PyMethodDef codec_methods[] = {
+    {"decode", (PyCFunction)(void (*)(void))codec_decode, METH_VARARGS | METH_KEYWORDS, decode_doc},
+    {"encode", (PyCFunction)(void (*)(void))codec_encode, METH_VARARGS | METH_KEYWORDS, encode_doc},
+    {NULL, NULL, 0, NULL}
+};
+
+static struct PyModuleDef codec_module = {
+    PyModuleDef_HEAD_INIT,
+    "_codec",
+    "Compiled implementation of the protobuf wire format encoder and decoder.",
+    -1,
+    codec_methods
+};
+
+PyMODINIT_FUNC
+PyInit__codec(void)
+{
+    PyObject *struct_module = PyImport_ImportModule("struct");
+    if (!struct_module) {
+        return NULL;
+    }
+    struct_error = PyObject_GetAttrString(struct_module, "error");
+    Py_DECREF(struct_module);
+    if (!struct_error) {
+        return NULL;
+    }
+    PyObject *module = PyModule_Create(&codec_module);
+#ifdef Py_GIL_DISABLED
+    // The codec has no mutable global state, so it can run in parallel on free-threaded Python.
+    if (module && PyUnstable_Module_SetGIL(module, Py_MOD_GIL_NOT_USED) < 0) {
+        Py_DECREF(module);
+        return NULL;
+    }
+#endif
+    return module;
+}
@@ -1,8 +1,5 @@
-import os
-from typing import Any
-
-from dynamic_protobuf import encode, WireType, decode
-from protobuf_instance import ProtobufMessage
+from packing import get_packing_backend, get_packing_backend_name, get_packing_type_url
+from protobuf_instance import ProtobufMessage, ProtobufMessageType
 
 
 class AnyMessage(ProtobufMessage):
@@ -13,84 +10,46 @@ class AnyMessage(ProtobufMessage):
         else:
             self.__dict__.update(**kwargs)
 
-    def _pickle_pack(self, obj) -> bytes:
-        if hasattr(obj, '__dict__') or isinstance(obj, dict):
-            if isinstance(obj, dict):
-                proto_dict = obj
-            else:
-                inner_dict = obj.__dict__
-
-                proto_dict = {
-                    1: (WireType.LENGTH_DELIMITED, [])
-                }
-                import pickle
-                for key, value in sorted(inner_dict.items()):
-                    _type = type(value).__name__
-                    typed_value: bytes = f'{len(_type)}'.encode()
-                    typed_value += _type.encode()
-                    typed_value += pickle.dumps(value)
-                    proto_dict[1][1].append({1: (WireType.LENGTH_DELIMITED, key), 2: (WireType.LENGTH_DELIMITED, typed_value)})
-            packed_value = encode(proto_dict, determine_wire_types=True)
-            return packed_value
-        else:
-            raise ValueError(f'Object of type {type(obj)} is not packable.')
-
-    def _jsonpickle_pack(self, obj) -> bytes:
-        import jsonpickle
-        packed_value = jsonpickle.encode(obj).encode()
-        return packed_value
-
     @classmethod
-    def pack(cls, obj):
-        from constants import PACKING_BACKEND
-        packing_backend = PACKING_BACKEND
-        pack_function = getattr(cls, f'_{packing_backend}_pack')
-        if not pack_function:
-            raise ValueError(f'Packing backend {packing_backend} not supported.')
-
-        packed_value = pack_function(cls, obj)
-        return cls(
-            # type url is only known after rendering the value in the message.
-            type_url=None,
-            value=packed_value
-        )
-
-    def _pickle_unpack(self, clazz):
-        import pickle
-        instance = clazz.__new__(clazz)
-        decoded_map: dict[int: list[dict[int, dict[str, Any]]]] = decode(self.value)
-        for map_entry in decoded_map[1]:
-            key = map_entry[1]
-            typed_value = bytes.fromhex(map_entry[2])
-            length_chars = []
-            for char in typed_value:
-                # find if char is a number between 0 and 9
-                if 48 <= char <= 57:
-                    length_chars.append(char)
-                else:
-                    break
-
-            length = int(bytes(length_chars).decode())
-            _type = typed_value[len(length_chars):len(length_chars) + length].decode()
-            value = typed_value[len(length_chars) + length:]
-            value = pickle.loads(value)
-            setattr(instance, key, value)
-        return instance
-
-    def _jsonpickle_unpack(self, clazz):
-        import jsonpickle
-        instance = jsonpickle.decode(self.value.decode())
-        return instance
-
-    def unpack(self, clazz):
-        from constants import PACKING_BACKEND
-        packing_backend = PACKING_BACKEND
-        unpack_function = getattr(self, f'_{packing_backend}_unpack')
-        if not unpack_function:
-            raise ValueError(f'Packing backend {packing_backend} not supported.')
-
-        instance = unpack_function(clazz)
-        return instance
+    def pack(cls, obj, backend: str | None = None):
+        """
+        Pack a message or another Python object.
+
+        :param obj: The object to pack.
+        :param backend: The name of the packing backend for objects that are not messages, by default the backend of
+            the class of the object or the default backend.
+        :return: The Any message.
+        """
+        if backend is None and isinstance(obj, ProtobufMessage):
+            # Messages are encoded with their own definition, and unpacked by their type URL.
+            from type_registry import get_type_url
+            return cls(type_url=get_type_url(obj.definition), value=obj.encode())
+
+        packing_backend = get_packing_backend(backend, type(obj))
+        return cls(type_url=get_packing_type_url(packing_backend, obj), value=packing_backend.pack(obj))
+
+    def unpack(self, clazz=None, type_registry: 'TypeRegistry | None' = None, backend: str | None = None):
+        """
+        Unpack the packed message or Python object.
+
+        :param clazz: The message class or the class of the object. Without it, messages are unpacked by their type URL.
+        :param type_registry: The registry to find the message class of the type URL in, by default all definitions.
+        :param backend: The name of the packing backend the object was packed with, by default the backend of its
+            type URL, the backend of the class or the default backend.
+        :return: The message or object.
+        """
+        if backend is None:
+            # Objects are unpacked by the backend they were packed with, which may need the class.
+            backend = get_packing_backend_name(self.type_url)
+
+        if backend is None and (clazz is None or isinstance(clazz, ProtobufMessageType)):
+            # Packed messages are decoded with the message class of their type URL, or the given message class.
+            if clazz is None:
+                from type_registry import default_type_registry
+                clazz = (type_registry or default_type_registry).resolve(self.type_url)
+            return clazz.decode(self.value)
+
+        return get_packing_backend(backend, clazz).unpack(self.value, clazz)
 
     @classmethod
     def prepare_decode(cls, value):
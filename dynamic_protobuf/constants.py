@@ -24,4 +24,12 @@ class WireType(Enum):
     FIXED32 = 5
 
 
+# The name of the packing backend of Any messages for objects without a backend for their class, see packing.py.
 PACKING_BACKEND = os.getenv('PY_DYNAMIC_PROTOBUF_ANY_PACKING_BACKEND', 'pickle')
+
+# Set to 1 to use the pure Python encoder and decoder, even if the compiled codec extension is available.
+PURE_PYTHON = os.getenv('PY_DYNAMIC_PROTOBUF_PURE_PYTHON', '0') == '1'
+
+# Set to 1 to fail on imports that are not found locally or in the bundled well-known types,
+# instead of retrieving them from the Github Protobuf repository.
+OFFLINE = os.getenv('PY_DYNAMIC_PROTOBUF_OFFLINE', '0') == '1'
@@ -3,7 +3,7 @@ import struct
 from enum import Enum
 
 from dynamic_protobuf.constants import most_significant_bit_mask, value_mask, wire_type_mask, seven_decimals, \
-    fifteen_decimals, WireType
+    fifteen_decimals, WireType, PURE_PYTHON
 
 
 class DecoderFieldType(Enum):
@@ -12,6 +12,7 @@ class DecoderFieldType(Enum):
     REPEATED = 2
     REPEATED_PACKED = 3
     MAP = 4
+    BYTES = 5
 
 
 class DecoderFieldDefinition:
@@ -43,6 +44,10 @@ class DecoderFieldDefinition:
     def map(cls):
         return cls(DecoderFieldType.MAP)
 
+    @classmethod
+    def bytes(cls):
+        return cls(DecoderFieldType.BYTES)
+
 
 def _get_relevant_bytes(byte_blob: bytes, index: int) -> tuple[list[int], int]:
     # in varint parsing, the most significant bit (continuation bit) indicates
@@ -118,9 +123,15 @@ def _parse_length_delimited(byte_blob: bytes, index: int,
         value = _parse_packed_repeated(byte_blob[index + 1:index + 1 + length], field_definition.wire_type)
         return value, index + 1 + length
 
+    if (field_definition and isinstance(field_definition, DecoderFieldDefinition)
+            and field_definition.type in (DecoderFieldType.MAP, DecoderFieldType.BYTES)):
+        # Map entries and bytes values are returned as raw bytes,
+        # map entries are decoded with the key and value types of the map.
+        return byte_blob[index + 1:index + 1 + length], index + 1 + length
+
     # The inside of the length delimited value can be processed as a separate byte blob.
     try:
-        value = decode(byte_blob[index + 1:index + 1 + length], field_definition)
+        value = python_decode(byte_blob[index + 1:index + 1 + length], field_definition)
     except:
         # If the decoding fails, we return the raw bytes as a hexidecimal value.
         bytes_value = byte_blob[index + 1:index + 1 + length]
@@ -195,6 +206,18 @@ wire_type_table = {
 }
 
 
+def _add_decoded_value(decoded_object: dict, field_number: int, value: int | float | str | list | dict) -> None:
+    # Repeated (non-packed) fields occur multiple times in a message, their values are collected in a list.
+    field_value = decoded_object.get(field_number)
+    if not field_value:
+        decoded_object[field_number] = value
+    else:
+        if isinstance(field_value, list):
+            field_value.append(value)
+        else:
+            decoded_object[field_number] = [field_value, value]
+
+
 def decode(byte_blob: bytes, definition: dict | None = None) -> dict[int, int | float | dict]:
     """
     Decode a byte blob into a dictionary.
@@ -253,15 +276,20 @@ def decode(byte_blob: bytes, definition: dict | None = None) -> dict[int, int |
             else:
                 raise Exception(f'Unsupported wire type {wire_type_function}')
 
-            field_value = decoded_object.get(field_number)
-            if not field_value:
-                decoded_object[field_number] = value
-            else:
-                if isinstance(field_value, list):
-                    field_value.append(value)
-                else:
-                    decoded_object[field_number] = [field_value, value]
+            _add_decoded_value(decoded_object, field_number, value)
             wire_type_function = None
             field_number = None
 
     return decoded_object
+
+
+# The pure Python decoder is always available, the compiled decoder implements the same contract and is used instead
+# when the extension is built, unless PY_DYNAMIC_PROTOBUF_PURE_PYTHON is set.
+python_decode = decode
+try:
+    from dynamic_protobuf._codec import decode as compiled_decode
+except ImportError:
+    compiled_decode = None
+
+if compiled_decode and not PURE_PYTHON:
+    decode = compiled_decode
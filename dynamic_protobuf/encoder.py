@@ -1,5 +1,6 @@
 import struct
-from dynamic_protobuf.constants import most_significant_bit_mask, value_mask, WireType
+from operator import itemgetter
+from dynamic_protobuf.constants import most_significant_bit_mask, value_mask, WireType, PURE_PYTHON
 
 
 def _encode_varint(int_value: int) -> list[int]:
@@ -48,7 +49,8 @@ def _determine_wire_type(value: int | float | dict | bool) -> WireType | None:
 
 
 def _encode_value(encoded_bytes: list[int], field_number: int, value: int | float | dict | bool, wire_type: WireType,
-                  packed_repeated_value: bool, determine_wire_types: bool, include_field_number: bool = True):
+                  packed_repeated_value: bool, determine_wire_types: bool, include_field_number: bool = True,
+                  deterministic: bool = False):
 
     # The first 3 bits contain the wire type, the last 5 bits contain the field number,
     # so we shift the field number 3 bits to the left and add the wire type.
@@ -78,13 +80,15 @@ def _encode_value(encoded_bytes: list[int], field_number: int, value: int | floa
             for packed_value in packed_list:
                 _encode_value(packed_field_bytes, field_number=field_number, value=packed_value,
                               wire_type=packed_wire_type, packed_repeated_value=False,
-                              determine_wire_types=determine_wire_types, include_field_number=False)
+                              determine_wire_types=determine_wire_types, include_field_number=False,
+                              deterministic=deterministic)
             length_delimited_value = _encode_varint(len(packed_field_bytes))
             length_delimited_value.extend(packed_field_bytes)
             encoded_bytes.extend(length_delimited_value)
         else:
             if isinstance(value, dict):
-                encoded_value = encode(value, determine_wire_types=determine_wire_types)
+                encoded_value = python_encode(value, determine_wire_types=determine_wire_types,
+                                              deterministic=deterministic)
             else:
                 if isinstance(value, str):
                     value = bytes(value, 'utf-8')
@@ -96,7 +100,7 @@ def _encode_value(encoded_bytes: list[int], field_number: int, value: int | floa
 
 
 def encode(proto_dict: dict[int, tuple[WireType, int | float | dict | bool] | int | float | dict | bool],
-           determine_wire_types=False) -> bytes:
+           determine_wire_types=False, deterministic=False) -> bytes:
     """
     The proto_dict should be a dictionary with the field number as key and a tuple of wire type and value as
     value. The wire type should be a WireType enum value and the value should be an int, float or dict.
@@ -133,11 +137,16 @@ def encode(proto_dict: dict[int, tuple[WireType, int | float | dict | bool] | in
             }
     }
 
+    The fields are encoded in the order of the dictionary. With deterministic set to True, they are encoded in the
+    order of their field numbers, also in sub-messages, so equal dictionaries are always encoded to the same bytes.
+
     :param proto_dict: The dictionary to encode.
     :param determine_wire_types: Whether to determine the wire types automatically.
+    :param deterministic: Whether to encode the fields in the order of their field numbers.
     """
     encoded_bytes: list[int] = []
-    for field_number, value in proto_dict.items():
+    fields = sorted(proto_dict.items(), key=itemgetter(0)) if deterministic else proto_dict.items()
+    for field_number, value in fields:
         wire_type: WireType | None = None
         if isinstance(value, tuple):
             wire_type, value = value
@@ -156,6 +165,19 @@ def encode(proto_dict: dict[int, tuple[WireType, int | float | dict | bool] | in
 
         for list_value in value:
             _encode_value(encoded_bytes, field_number=field_number, value=list_value, wire_type=wire_type,
-                          packed_repeated_value=packed_repeated_value, determine_wire_types=determine_wire_types)
+                          packed_repeated_value=packed_repeated_value, determine_wire_types=determine_wire_types,
+                          deterministic=deterministic)
 
     return bytes(encoded_bytes)
+
+
+# The pure Python encoder is always available, the compiled encoder implements the same contract and is used instead
+# when the extension is built, unless PY_DYNAMIC_PROTOBUF_PURE_PYTHON is set.
+python_encode = encode
+try:
+    from dynamic_protobuf._codec import encode as compiled_encode
+except ImportError:
+    compiled_encode = None
+
+if compiled_encode and not PURE_PYTHON:
+    encode = compiled_encode
@@ -1,61 +1,210 @@
+import hashlib
+import io
 import os
-
+import tarfile
+import threading
+import zipfile
+
+from resolvers import ImportResolver, archive_separator, get_default_resolvers
+
+# A cached file is the content of the file with the SHA-256 hash of the content.
+CachedFile = tuple[bytes, str]
+
+
+class ImportCache:
+    """
+    A cache of imported files, shared by all importers using it.
+    It holds the content of local files, archives and remote files and the definitions parsed from them,
+    so a file imported by multiple definitions, or in multiple calls to parse, is read and parsed once.
+
+    Local files and archives are read again when their modification time or size changes.
+    A parsed definition is used again as long as the files it imports have not changed.
+    """
+
+    def __init__(self):
+        self._local_files: dict[str, tuple[tuple[int, int], CachedFile]] = {}
+        self._archives: dict[str, tuple[tuple[int, int], dict[str, CachedFile]]] = {}
+        self._remote_files: dict[str, CachedFile] = {}
+        self._definitions: dict[tuple[str, tuple[str, ...]], 'ProtobufDefinition'] = {}
+        self._lock = threading.Lock()
+
+    def read_file(self, path: str) -> CachedFile:
+        """
+        Read a local file, or return the cached content if the file did not change since it was read.
+
+        :param path: The absolute path of the file.
+        :return: The content of the file and its SHA-256 hash.
+        """
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached_file = self._local_files.get(path)
+        if cached_file and cached_file[0] == signature:
+            return cached_file[1]
+
+        with open(path, 'rb') as file:
+            file_content = file.read()
+        cached_file = (file_content, hashlib.sha256(file_content).hexdigest())
+        with self._lock:
+            self._local_files[path] = (signature, cached_file)
+        return cached_file
+
+    def read_archive(self, path: str) -> dict[str, CachedFile]:
+        """
+        Read all files in a zip or tar archive, or return the cached files if the archive did not change since it was read.
+
+        :param path: The absolute path of the archive.
+        :return: The content and SHA-256 hash of the files in the archive, by their path in the archive.
+        """
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached_archive = self._archives.get(path)
+        if cached_archive and cached_archive[0] == signature:
+            return cached_archive[1]
+
+        with open(path, 'rb') as file:
+            archive_content = file.read()
+
+        files = {}
+        if zipfile.is_zipfile(io.BytesIO(archive_content)):
+            with zipfile.ZipFile(io.BytesIO(archive_content)) as archive:
+                for member in archive.infolist():
+                    if not member.is_dir():
+                        files[member.filename] = archive.read(member)
+        else:
+            with tarfile.open(fileobj=io.BytesIO(archive_content)) as archive:
+                for member in archive.getmembers():
+                    if member.isfile():
+                        files[member.name.removeprefix('./')] = archive.extractfile(member).read()
+
+        cached_files = {name: (file_content, hashlib.sha256(file_content).hexdigest())
+                        for name, file_content in files.items()}
+        with self._lock:
+            self._archives[path] = (signature, cached_files)
+        return cached_files
+
+    def get_remote_file(self, url: str) -> CachedFile | None:
+        with self._lock:
+            return self._remote_files.get(url)
+
+    def add_remote_file(self, url: str, file_content: bytes) -> CachedFile:
+        cached_file = (file_content, hashlib.sha256(file_content).hexdigest())
+        with self._lock:
+            self._remote_files[url] = cached_file
+        return cached_file
+
+    def dependencies_unchanged(self, proto_definition: 'ProtobufDefinition') -> bool:
+        """
+        Check whether the files a definition was parsed from are unchanged.
+        Remote files are versioned files, they are not retrieved again to check them.
+
+        :param proto_definition: The parsed definition.
+        :return: True if all local files and files in archives have the same content.
+        """
+        for dependency, content_hash in proto_definition.dependencies.items():
+            if '://' in dependency:
+                continue
+            try:
+                if archive_separator in dependency:
+                    archive_path, member = dependency.split(archive_separator, 1)
+                    cached_file = self.read_archive(archive_path).get(member)
+                else:
+                    cached_file = self.read_file(dependency)
+            except OSError:
+                return False
+
+            if cached_file is None or cached_file[1] != content_hash:
+                return False
+        return True
+
+    def get_definition(self, content_hash: str, resolvers_key: tuple[str, ...]) -> 'ProtobufDefinition | None':
+        """
+        Get the definition parsed from an imported file.
+
+        :param content_hash: The SHA-256 hash of the content of the imported file.
+        :param resolvers_key: The keys of the resolvers the imports of the file are resolved with.
+        :return: The parsed definition, or None if it is not cached or one of its imports changed.
+        """
+        with self._lock:
+            proto_definition = self._definitions.get((content_hash, resolvers_key))
+        if proto_definition is None or not self.dependencies_unchanged(proto_definition):
+            return None
+        return proto_definition
+
+    def add_definition(self, content_hash: str, resolvers_key: tuple[str, ...],
+                       proto_definition: 'ProtobufDefinition') -> None:
+        with self._lock:
+            self._definitions[(content_hash, resolvers_key)] = proto_definition
+
+    def clear(self) -> None:
+        """
+        Remove all files and definitions from the cache.
+        """
+        with self._lock:
+            self._local_files.clear()
+            self._archives.clear()
+            self._remote_files.clear()
+            self._definitions.clear()
+
+
+# The import cache used by parse, unless another import cache is given.
+default_import_cache = ImportCache()
 
 class ProtobufImporter:
 
-    def __init__(self, protobuf_definition: 'ProtobufDefinition', import_path: str | None, import_level: int):
+    def __init__(self, protobuf_definition: 'ProtobufDefinition', import_path: str | None, import_level: int,
+                 registry: 'SchemaRegistry | None' = None, import_cache: ImportCache | None = None,
+                 resolvers: list[ImportResolver] | None = None):
         self.protobuf_definition = protobuf_definition
         self.import_path = import_path
-        self._remote_file_cache: dict[str, bytes] = {}
         self.import_level = import_level
+        self.registry = registry
+        self.import_cache = import_cache if import_cache is not None else default_import_cache
+        self.resolvers = resolvers if resolvers is not None else get_default_resolvers(import_path)
+        self.resolvers_key = tuple(resolver.key for resolver in self.resolvers)
 
     def load_import(self, importable: str, public_import: bool) -> None:
-        if self.import_path:
-            self._load_local_import(importable, public_import)
+        for resolver in self.resolvers:
+            resolved_import = resolver.resolve(importable, self.import_cache)
+            if resolved_import:
+                break
         else:
-            self._load_remote_default_import(importable, public_import)
-
-    def _load_local_import(self, importable: str, public_import: bool) -> None:
-        filename = f'{self.import_path}/{importable}'
-        absolute_path = os.path.abspath(filename)
-        try:
-            file_content: bytes = open(absolute_path, 'rb').read()
-        except FileNotFoundError:
-            print(f'Warning: Could not find file {absolute_path}, '
-                  f'Trying to retrieve from the Github Protobuf repository.')
-            self._load_remote_default_import(importable, public_import)
-            return
+            raise Exception(f'Could not resolve import {importable}')
 
+        location, file_content, content_hash = resolved_import
         if not file_content:
-            raise Exception(f'Could import {absolute_path}')
-
-        file_content_string: str = file_content.decode('utf-8')
-        self._parse_import_content(importable, file_content_string, public_import)
-
-    def _load_remote_default_import(self, importable: str, public_import: bool) -> None:
-        if importable in self._remote_file_cache:
-            file_content: bytes = self._remote_file_cache[importable]
-        else:
-            import urllib.request
-
-            print('WARNING: Remote imports are very slow, '
-                  'consider downloading the protobuf files locally and set the imports_path variable.')
-
-            url = f'https://raw.githubusercontent.com/protocolbuffers/protobuf/master/src/{importable}'
-            file_content: bytes = urllib.request.urlopen(url).read()
+            raise Exception(f'Could import {location}')
 
-        file_content_string: str = file_content.decode('utf-8')
-        self._parse_import_content(importable, file_content_string, public_import)
+        self.protobuf_definition.dependencies[location] = content_hash
+        self._parse_import_content(importable, file_content, content_hash, public_import)
 
-    def _parse_import_content(self, importable: str, file_content: str, public_import: bool) -> None:
+    def _parse_import_content(self, importable: str, file_content: bytes, content_hash: str,
+                              public_import: bool) -> None:
         if not public_import and self.import_level > 0:
             return
 
         from dynamic_protobuf import parse
+
+        if self.registry is not None:
+            # Imported files are shared between all definitions parsed by the same registry.
+            import_protobuf_definition = self.registry.parse(file_content.decode('utf-8'), self.import_path,
+                                                             import_level=self.import_level + 1)
+        else:
+            # Imported files are always parsed with an import level above 0, so the import level is not part of the key.
+            import_protobuf_definition = self.import_cache.get_definition(content_hash, self.resolvers_key)
+            if import_protobuf_definition is None:
+                import_protobuf_definition = parse(file_content.decode('utf-8'), self.import_path,
+                                                   import_level=self.import_level + 1, import_cache=self.import_cache,
+                                                   resolvers=self.resolvers)
+                self.import_cache.add_definition(content_hash, self.resolvers_key, import_protobuf_definition)
+        self.add_imported_definition(importable, import_protobuf_definition)
+
+    def add_imported_definition(self, importable: str, import_protobuf_definition: 'ProtobufDefinition') -> None:
         from protobuf_definition import ProtobufDefinition
 
         import_folder: str = os.path.dirname(importable).replace('/', '.')
-        import_protobuf_definition = parse(file_content, self.import_path, import_level=self.import_level + 1)
+        self.protobuf_definition.dependencies.update(import_protobuf_definition.dependencies)
         for imported_message_name, imported_message in import_protobuf_definition.messages.items():
             imported_message_name_with_path = f'{import_folder}.{imported_message_name}' \
                 if import_folder else imported_message_name
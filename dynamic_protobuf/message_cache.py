@@ -0,0 +1,100 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+from protobuf_instance import FrozenProtobufMessage
+
+
+class EncodingCache:
+    """
+    A bounded cache of frozen messages, so equal messages share one frozen message and its cached encoding.
+    When the cache is full, the least recently used message is removed.
+    """
+
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self._messages: OrderedDict[FrozenProtobufMessage, FrozenProtobufMessage] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, message) -> FrozenProtobufMessage:
+        """
+        Get the frozen message that is equal to a message, the message itself is added when there is none.
+
+        :param message: The message, it is frozen when it is not frozen yet.
+        :return: The frozen message.
+        """
+        if not isinstance(message, FrozenProtobufMessage):
+            message = message.freeze()
+
+        with self._lock:
+            cached_message = self._messages.get(message)
+            if cached_message is not None:
+                self._messages.move_to_end(cached_message)
+                return cached_message
+
+            self._messages[message] = message
+            if len(self._messages) > self.max_size:
+                self._messages.popitem(last=False)
+        return message
+
+    def clear(self) -> None:
+        """
+        Remove all messages from the cache.
+        """
+        with self._lock:
+            self._messages.clear()
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+
+class DecodeCache:
+    """
+    A bounded cache of decoded messages, keyed by the message class and a digest of the encoded message, so messages
+    that are received many times are decoded once. Decoded messages are frozen, so they can be shared.
+    When the cache is full, the least recently used message is removed.
+    """
+
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._messages: OrderedDict[tuple[type, bytes], FrozenProtobufMessage] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def decode(self, message_class, byte_blob: bytes) -> FrozenProtobufMessage:
+        """
+        Decode a message, or get the message decoded from the same bytes before.
+
+        :param message_class: The class of the message.
+        :param byte_blob: The encoded message.
+        :return: The frozen message.
+        """
+        key = (message_class, hashlib.blake2b(byte_blob, digest_size=16).digest())
+        with self._lock:
+            message = self._messages.get(key)
+            if message is not None:
+                self._messages.move_to_end(key)
+                self.hits += 1
+                return message
+            self.misses += 1
+
+        message = message_class.decode(byte_blob).freeze()
+        with self._lock:
+            # Another thread can have decoded the same message in the meantime, the first message is kept.
+            message = self._messages.setdefault(key, message)
+            if len(self._messages) > self.max_size:
+                self._messages.popitem(last=False)
+                self.evictions += 1
+        return message
+
+    def clear(self) -> None:
+        """
+        Remove all messages from the cache, the counters are kept.
+        """
+        with self._lock:
+            self._messages.clear()
+
+    def __len__(self) -> int:
+        return len(self._messages)
@@ -0,0 +1,185 @@
+from abc import ABC, abstractmethod
+
+import constants
+from decoder import _parse_varint
+from encoder import _encode_varint
+
+# The pickle protocol of packed attributes. Packed values are stored and sent to other processes, so the protocol is
+# fixed instead of the highest protocol of the running Python version, which older versions may not be able to load.
+PICKLE_PROTOCOL = 4
+
+
+class PackingBackend(ABC):
+    """
+    Packs Python objects into the value of an Any message, and unpacks them again.
+    Backends are registered by their name with register_packing_backend.
+    """
+
+    name: str = None
+
+    @abstractmethod
+    def pack(self, obj) -> bytes:
+        """
+        Pack an object.
+
+        :param obj: The object to pack.
+        :return: The value of the Any message.
+        """
+
+    @abstractmethod
+    def unpack(self, value: bytes, clazz: type | None):
+        """
+        Unpack an object.
+
+        :param value: The value of the Any message.
+        :param clazz: The class of the packed object, if known.
+        :return: The object.
+        """
+
+
+class PicklePackingBackend(PackingBackend):
+    """
+    Packs the attributes of an object as binary pickles, the object is created again without calling its constructor.
+    """
+
+    name = 'pickle'
+
+    def pack(self, obj) -> bytes:
+        # Every attribute is packed as its name, the name of its type and its pickled value, each prefixed with its
+        # length as a varint, so the value is unpacked without decoding it as a message.
+        if isinstance(obj, dict):
+            attributes = obj
+        elif hasattr(obj, '__dict__'):
+            attributes = obj.__dict__
+        else:
+            raise ValueError(f'Object of type {type(obj)} is not packable.')
+
+        import pickle
+        packed_value = bytearray()
+        for key, value in sorted(attributes.items()):
+            for part in (key.encode('utf-8'), type(value).__name__.encode('utf-8'),
+                         pickle.dumps(value, protocol=PICKLE_PROTOCOL)):
+                packed_value += bytes(_encode_varint(len(part)))
+                packed_value += part
+        return bytes(packed_value)
+
+    def unpack(self, value: bytes, clazz: type | None):
+        if clazz is None:
+            raise ValueError('The pickle packing backend needs the class to unpack.')
+
+        import pickle
+        instance = clazz.__new__(clazz)
+        packed_value = memoryview(value)
+        index = 0
+        while index < len(packed_value):
+            parts = []
+            for _ in range(3):
+                length, index = _parse_varint(packed_value, index, None)
+                parts.append(packed_value[index:index + length])
+                index += length
+            key, _type, attribute_value = parts
+            setattr(instance, str(key, 'utf-8'), pickle.loads(attribute_value))
+        return instance
+
+
+class JsonpicklePackingBackend(PackingBackend):
+    """
+    Packs objects as readable JSON with jsonpickle, which needs to be installed. The JSON includes the class.
+    """
+
+    name = 'jsonpickle'
+
+    def pack(self, obj) -> bytes:
+        import jsonpickle
+        return jsonpickle.encode(obj).encode()
+
+    def unpack(self, value: bytes, clazz: type | None):
+        import jsonpickle
+        return jsonpickle.decode(bytes(value).decode())
+
+
+# Objects packed by a packing backend have a type URL with the name of the backend and the class of the object, like
+# type.py-dynamic-protobuf/packing/pickle/module.Class, so they are not unpacked as messages.
+packing_type_url_prefix = 'type.py-dynamic-protobuf/packing/'
+
+packing_backends: dict[str, PackingBackend] = {}
+
+# The names of the backends used for classes, instead of the default backend.
+class_packing_backends: dict[type, str] = {}
+
+
+def register_packing_backend(backend: PackingBackend, classes: tuple[type, ...] = ()) -> None:
+    """
+    Register a packing backend by its name, replacing a registered backend with the same name.
+
+    :param backend: The backend.
+    :param classes: Classes to pack with the backend by default, including their subclasses.
+    """
+    packing_backends[backend.name] = backend
+    for clazz in classes:
+        class_packing_backends[clazz] = backend.name
+
+
+def set_packing_backend(clazz: type, backend_name: str | None) -> None:
+    """
+    Select the packing backend of a class, including its subclasses.
+
+    :param clazz: The class.
+    :param backend_name: The name of the backend, or None to use the default backend again.
+    """
+    if backend_name is None:
+        class_packing_backends.pop(clazz, None)
+    else:
+        class_packing_backends[clazz] = backend_name
+
+
+def get_packing_backend(backend_name: str | None = None, clazz: type | None = None) -> PackingBackend:
+    """
+    Get a packing backend: the backend with the given name, the backend of the class or the default backend,
+    set by the PY_DYNAMIC_PROTOBUF_ANY_PACKING_BACKEND environment variable.
+
+    :param backend_name: The name of the backend.
+    :param clazz: The class of the object to pack or unpack.
+    :return: The backend.
+    """
+    if backend_name is None:
+        if clazz is not None and class_packing_backends:
+            for base in clazz.__mro__:
+                backend_name = class_packing_backends.get(base)
+                if backend_name is not None:
+                    break
+
+        if backend_name is None:
+            backend_name = constants.PACKING_BACKEND
+
+    backend = packing_backends.get(backend_name)
+    if backend is None:
+        raise ValueError(f'Packing backend {backend_name} not supported.')
+    return backend
+
+
+register_packing_backend(PicklePackingBackend())
+register_packing_backend(JsonpicklePackingBackend())
+
+
+def get_packing_type_url(backend: PackingBackend, obj) -> str:
+    """
+    Get the type URL of an object packed by a packing backend.
+
+    :param backend: The backend the object is packed with.
+    :param obj: The object.
+    :return: The type URL, like type.py-dynamic-protobuf/packing/pickle/module.Class
+    """
+    return f'{packing_type_url_prefix}{backend.name}/{type(obj).__module__}.{type(obj).__qualname__}'
+
+
+def get_packing_backend_name(type_url: str | None) -> str | None:
+    """
+    Get the name of the packing backend from the type URL of a packed object.
+
+    :param type_url: The type URL.
+    :return: The name of the backend, or None if the type URL is not the type URL of a packed object.
+    """
+    if not type_url or not type_url.startswith(packing_type_url_prefix):
+        return None
+    return type_url[len(packing_type_url_prefix):].split('/', 1)[0]
@@ -0,0 +1,535 @@
+import array
+import os
+import pickle
+import sys
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from multiprocessing.shared_memory import SharedMemory
+
+from dynamic_protobuf.constants import most_significant_bit_mask, value_mask, wire_type_mask, WireType
+from decoder import decode, python_decode, _add_decoded_value
+from protobuf_definition import ProtobufDefinition
+
+# A field entry is the location of a single top-level field in the byte blob:
+# (field number, start of the tag, end of the value).
+FieldEntry = tuple[int, int, int]
+
+
+class _ScanError(Exception):
+    pass
+
+
+def _read_varint(byte_blob: bytes | memoryview, index: int) -> tuple[int, int]:
+    value = 0
+    shift = 0
+    while True:
+        if index >= len(byte_blob):
+            raise _ScanError('Varint runs past the end of the byte blob')
+        byte = byte_blob[index]
+        value |= (byte & value_mask) << shift
+        index += 1
+        if not byte & most_significant_bit_mask:
+            return value, index
+        shift += 7
+
+
+# The wire types of the fields that can be skipped by their tag and length.
+_scanned_wire_types = frozenset((WireType.VARINT.value, WireType.FIXED64.value, WireType.FIXED32.value,
+                                 WireType.LENGTH_DELIMITED.value))
+
+
+def _scan_fields(byte_blob: bytes | memoryview) -> list[FieldEntry]:
+    # Only the tags and lengths are read, the values themselves are skipped. This is a lot cheaper than decoding,
+    # so the byte ranges of all top-level fields are known before any of them is decoded.
+    entries = []
+    index = 0
+    length = len(byte_blob)
+    while index < length:
+        tag_start = index
+        wire_type = byte_blob[index] & wire_type_mask
+        tag, index = _read_varint(byte_blob, index)
+        if wire_type not in _scanned_wire_types:
+            raise _ScanError(f'Unsupported wire type {wire_type}')
+
+        # A field number without a value at the end of the message is ignored by the decoder.
+        if index >= length:
+            break
+
+        if wire_type == WireType.VARINT.value:
+            _, index = _read_varint(byte_blob, index)
+        elif wire_type == WireType.FIXED64.value:
+            index += 8
+        elif wire_type == WireType.FIXED32.value:
+            index += 4
+        else:
+            value_length, index = _read_varint(byte_blob, index)
+            index += value_length
+
+        if index > length and wire_type != WireType.LENGTH_DELIMITED.value:
+            raise _ScanError('Fixed size value runs past the end of the byte blob')
+
+        entries.append((tag >> 3, tag_start, min(index, length)))
+    return entries
+
+
+def _split_in_chunks(entries: list[FieldEntry], chunk_size: int) -> list[list[FieldEntry]]:
+    # Consecutive entries are grouped until they cover at least chunk_size bytes, so every chunk is a single
+    # contiguous range of the byte blob.
+    chunks = []
+    chunk = []
+    chunk_start = None
+    for entry in entries:
+        if chunk_start is None:
+            chunk_start = entry[1]
+        chunk.append(entry)
+        if entry[2] - chunk_start >= chunk_size:
+            chunks.append(chunk)
+            chunk = []
+            chunk_start = None
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def _decode_entries(byte_range: bytes | memoryview, offset: int, entries: list[FieldEntry],
+                    definition: dict | None) -> list[int | float | str | list | dict]:
+    # Every entry is decoded on its own, so the values can be merged in their original order afterwards,
+    # exactly like the decoder would have merged them.
+    if isinstance(byte_range, memoryview) and decode is python_decode:
+        # The pure Python decoder needs bytes to fall back to strings for values that are not sub-messages.
+        byte_range = bytes(byte_range)
+
+    values = []
+    for field_number, start, end in entries:
+        decoded_entry = decode(byte_range[start - offset:end - offset], definition)
+        values.append(decoded_entry[field_number])
+    return values
+
+
+def default_executor(max_workers: int | None) -> tuple[Executor, bool]:
+    """
+    Create the executor to run work on multiple cores with: a process pool, or a thread pool on free-threaded Python,
+    where threads run in parallel and do not need to copy their arguments.
+
+    :param max_workers: The maximum number of workers.
+    :return: The executor, and whether its workers share memory with the current process.
+    """
+    is_gil_enabled = getattr(sys, '_is_gil_enabled', lambda: True)
+    if not is_gil_enabled():
+        return ThreadPoolExecutor(max_workers=max_workers), True
+    return ProcessPoolExecutor(max_workers=max_workers), False
+
+
+def parallel_decode(byte_blob: bytes,
+                    definition: dict | None = None,
+                    executor: Executor | None = None,
+                    max_workers: int | None = None,
+                    chunk_size: int = 4 * 1024 * 1024,
+                    min_parallel_size: int = 1024 * 1024) -> dict[int, int | float | dict]:
+    """
+    Decode a byte blob into a dictionary, decoding the top-level fields on multiple cores.
+    The result is the same as the result of decode, this is meant for large messages, for example messages with a
+    repeated field containing many sub-messages.
+
+    A fast scan of the tags finds the byte ranges of all top-level fields, the ranges are split in chunks of roughly
+    chunk_size bytes which are decoded in parallel and the values are merged in their original order.
+
+    If no executor is given, a process pool is started for the call, or a thread pool on free-threaded Python.
+    Pass an executor to reuse it over multiple calls. A ThreadPoolExecutor does not copy the byte blob,
+    a ProcessPoolExecutor sends a copy of every chunk to the workers.
+
+    :param byte_blob: The byte blob to decode.
+    :param definition: The Protobuf definition to use for decoding.
+    :param executor: The executor to decode the chunks on.
+    :param max_workers: The number of workers of the default executor, the number of CPUs if not given.
+    :param chunk_size: The minimal number of bytes decoded by a single task.
+    :param min_parallel_size: Byte blobs smaller than this are decoded without parallelism.
+    :return: A dictionary containing the decoded values.
+    """
+    if len(byte_blob) < min_parallel_size:
+        return decode(byte_blob, definition)
+
+    try:
+        entries = _scan_fields(byte_blob)
+    except _ScanError:
+        # Invalid messages are decoded serially, so the decoder raises the same error as it normally would.
+        return decode(byte_blob, definition)
+
+    chunks = _split_in_chunks(entries, chunk_size)
+    if len(chunks) <= 1:
+        return decode(byte_blob, definition)
+
+    owns_executor = executor is None
+    if owns_executor:
+        executor, shares_memory = default_executor(max_workers or os.cpu_count())
+    else:
+        shares_memory = isinstance(executor, ThreadPoolExecutor)
+
+    view = memoryview(byte_blob)
+    try:
+        futures = []
+        for chunk in chunks:
+            offset = chunk[0][1]
+            byte_range = view[offset:chunk[-1][2]]
+            if not shares_memory:
+                byte_range = bytes(byte_range)
+            futures.append(executor.submit(_decode_entries, byte_range, offset, chunk, definition))
+
+        decoded_object = {}
+        for chunk, future in zip(chunks, futures):
+            for (field_number, _, _), value in zip(chunk, future.result()):
+                _add_decoded_value(decoded_object, field_number, value)
+        return decoded_object
+    finally:
+        if owns_executor:
+            executor.shutdown()
+
+
+# The definition of a codec pool worker process, loaded once when the worker starts.
+_worker_definition = None
+_worker_message_classes: dict = {}
+
+
+def _initialize_codec_worker(compiled_definition: bytes) -> None:
+    global _worker_definition
+    from schema_cache import load_definition
+    _worker_definition = load_definition(compiled_definition)
+    _worker_message_classes.clear()
+
+
+def _get_worker_message_class(message_name: str):
+    message_class = _worker_message_classes.get(message_name)
+    if message_class is None:
+        from protobuf_instance import ProtobufMessageType
+        message_class = _worker_definition[message_name]
+        if not isinstance(message_class, ProtobufMessageType):
+            raise Exception(f'No message with name {message_name}')
+        _worker_message_classes[message_name] = message_class
+    return message_class
+
+
+def _message_to_row(message) -> dict:
+    # Message classes only exist in the worker, so messages are returned as their values by field name,
+    # which can be rendered by the message class again.
+    from protobuf_instance import ProtobufMessage
+
+    row = {}
+    for field_name, field_value in message.__dict__.items():
+        if isinstance(field_value, ProtobufMessage):
+            field_value = _message_to_row(field_value)
+        elif isinstance(field_value, dict):
+            field_value = {key: _message_to_row(value) if isinstance(value, ProtobufMessage) else value
+                           for key, value in field_value.items()}
+        row[field_name] = field_value
+    return row
+
+
+def _decode_batch(byte_blobs: list[bytes], definition: dict | None) -> list[dict]:
+    return [decode(byte_blob, definition) for byte_blob in byte_blobs]
+
+
+def _decode_message_batch(byte_blobs: list[bytes], message_name: str) -> list[dict]:
+    message_class = _get_worker_message_class(message_name)
+    return [_message_to_row(message_class.decode(byte_blob)) for byte_blob in byte_blobs]
+
+
+def _decode_column_batch(byte_blobs: list[bytes], message_name: str) -> dict[str, list]:
+    message_class = _get_worker_message_class(message_name)
+    columns = {field_name: [] for field_name in message_class.definition.fields_by_name}
+    for byte_blob in byte_blobs:
+        row = _message_to_row(message_class.decode(byte_blob))
+        for field_name, column in columns.items():
+            column.append(row.get(field_name))
+    return columns
+
+
+def _encode_batch(values: list[dict], message_name: str | None) -> list[bytes]:
+    if message_name is None:
+        from encoder import encode
+        return [encode(proto_dict, determine_wire_types=True) for proto_dict in values]
+
+    message_class = _get_worker_message_class(message_name)
+    return [message_class(**row).encode() for row in values]
+
+
+# The kinds of columns that are written to shared memory as arrays, by the type of their values.
+_column_array_kinds = {int: 'q', float: 'd', bool: 'b'}
+
+
+def _get_column_kind(column: list) -> str:
+    value_types = {type(value) for value in column if value is not None}
+    if len(value_types) != 1:
+        return 'pickle' if value_types else 'b'
+
+    value_type = value_types.pop()
+    if value_type is str:
+        return 's'
+    if value_type is bytes:
+        return 'y'
+    kind = _column_array_kinds.get(value_type, 'pickle')
+    if kind == 'q' and not all(-(1 << 63) <= value < (1 << 63) for value in column if value is not None):
+        return 'pickle'
+    return kind
+
+
+def _write_shared_columns(columns: dict[str, list]) -> tuple[str | None, list[tuple]]:
+    # Every column is written as its kind, a byte per value whether the value is set and the data of the values:
+    # an array for numbers and booleans, the values and their offsets for strings and bytes,
+    # or the pickled column for other values.
+    parts = []
+    layout = []
+    size = 0
+
+    def add_parts(*added_parts: bytes) -> tuple[int, int]:
+        nonlocal size
+        start = size
+        for part in added_parts:
+            parts.append(part)
+            size += len(part)
+        return start, size
+
+    for field_name, column in columns.items():
+        kind = _get_column_kind(column)
+        presence = add_parts(bytes(value is not None for value in column))
+        offsets = None
+        if kind in _column_array_kinds.values():
+            data = add_parts(array.array(kind, [0 if value is None else value for value in column]).tobytes())
+        elif kind in ('s', 'y'):
+            values = [b'' if value is None else value.encode('utf-8') if kind == 's' else value for value in column]
+            value_offsets = array.array('q', [0])
+            for value in values:
+                value_offsets.append(value_offsets[-1] + len(value))
+            data = add_parts(*values)
+            offsets = add_parts(value_offsets.tobytes())
+        else:
+            data = add_parts(pickle.dumps(column, protocol=pickle.HIGHEST_PROTOCOL))
+        layout.append((field_name, kind, presence, data, offsets))
+
+    if not size:
+        return None, layout
+
+    segment = SharedMemory(create=True, size=size)
+    try:
+        index = 0
+        for part in parts:
+            segment.buf[index:index + len(part)] = part
+            index += len(part)
+    except BaseException:
+        segment.unlink()
+        raise
+    finally:
+        segment.close()
+    return segment.name, layout
+
+
+def _unlink_shared_columns(segment_name: str | None) -> None:
+    # Removes the segment of columns that are not read.
+    if segment_name is None:
+        return
+    segment = SharedMemory(segment_name)
+    segment.close()
+    segment.unlink()
+
+
+def _read_shared_columns(segment_name: str | None, layout: list[tuple]) -> dict[str, list]:
+    if segment_name is None:
+        return {field_name: [] for field_name, *_ in layout}
+
+    segment = SharedMemory(segment_name)
+    buffer = segment.buf
+    try:
+        columns = {}
+        for field_name, kind, (presence_start, presence_end), (data_start, data_end), offsets in layout:
+            presence = bytes(buffer[presence_start:presence_end])
+            if kind == 'pickle':
+                columns[field_name] = pickle.loads(buffer[data_start:data_end])
+                continue
+
+            if kind in ('s', 'y'):
+                value_offsets = array.array('q')
+                value_offsets.frombytes(buffer[offsets[0]:offsets[1]])
+                # The values are copied from the segment once, as strings or bytes.
+                value_ranges = zip(value_offsets, value_offsets[1:])
+                if kind == 's':
+                    values = [str(buffer[data_start + start:data_start + end], 'utf-8') for start, end in value_ranges]
+                else:
+                    values = [bytes(buffer[data_start + start:data_start + end]) for start, end in value_ranges]
+            else:
+                values = array.array(kind)
+                values.frombytes(buffer[data_start:data_end])
+                values = [bool(value) for value in values] if kind == 'b' else values.tolist()
+            columns[field_name] = [value if is_set else None for value, is_set in zip(values, presence)]
+        return columns
+    finally:
+        del buffer
+        segment.close()
+        segment.unlink()
+
+
+def _run_shared_batch(function, segment_name: str, offsets: list[int], argument):
+    # The messages are read from the shared memory segment of the input, only their offsets are sent to the worker.
+    segment = SharedMemory(segment_name)
+    byte_blobs = [segment.buf[start:end] for start, end in zip(offsets, offsets[1:])]
+    try:
+        if decode is python_decode:
+            # The pure Python decoder needs bytes to fall back to strings for values that are not sub-messages.
+            byte_blobs = [bytes(byte_blob) for byte_blob in byte_blobs]
+        result = function(byte_blobs, argument)
+        if function is _decode_column_batch:
+            # Columns are returned in shared memory as well, only the name of the segment and the layout are sent back.
+            result = _write_shared_columns(result)
+        return result
+    finally:
+        for byte_blob in byte_blobs:
+            if isinstance(byte_blob, memoryview):
+                byte_blob.release()
+        segment.close()
+
+
+class CodecPool:
+    """
+    A pool of worker processes that decode and encode batches of messages with a shared definition.
+
+    Every worker loads the definition once when it starts, from its compiled representation, so only the encoded
+    messages are sent to the workers and only the decoded values are sent back. Messages are sent in batches of
+    batch_size to keep the overhead per message low. Results are in the order of the given messages.
+
+    Decoded messages are returned as proto dicts, like decode returns them, as rows of values by field name, which
+    the message classes render again, or as columns of values by field name.
+
+    With shared_memory, the messages to decode are written to a shared memory segment once, and the workers decode
+    them from the segment, so only their offsets are sent to the workers. Columns are returned in shared memory as
+    well. This avoids copying large messages through pipes.
+    """
+
+    def __init__(self,
+                 definition: ProtobufDefinition | bytes,
+                 max_workers: int | None = None,
+                 batch_size: int = 1024,
+                 mp_context=None,
+                 shared_memory: bool = False):
+        """
+        :param definition: The definition to decode and encode with, parsed or as its compiled representation.
+        :param max_workers: The number of worker processes, the number of CPUs if not given.
+        :param batch_size: The number of messages sent to a worker at once.
+        :param mp_context: The multiprocessing context to start the workers with.
+        :param shared_memory: Whether to send the messages to decode and the decoded columns through shared memory.
+        """
+        if not isinstance(definition, bytes):
+            from schema_cache import dump_definition
+            definition = dump_definition(definition)
+
+        self.batch_size = batch_size
+        self.shared_memory = shared_memory
+        self._executor = ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(), mp_context=mp_context,
+                                             initializer=_initialize_codec_worker, initargs=(definition,))
+
+    def _map(self, function, values: list, argument) -> list:
+        values = list(values)
+        batches = [values[start:start + self.batch_size] for start in range(0, len(values), self.batch_size)]
+        return list(self._executor.map(function, batches, [argument] * len(batches)))
+
+    def _map_decode(self, function, byte_blobs: list[bytes], argument) -> list:
+        if not self.shared_memory:
+            return self._map(function, byte_blobs, argument)
+
+        byte_blobs = list(byte_blobs)
+        offsets = [0]
+        for byte_blob in byte_blobs:
+            offsets.append(offsets[-1] + len(byte_blob))
+        if not offsets[-1]:
+            return self._map(function, byte_blobs, argument)
+
+        segment = SharedMemory(create=True, size=offsets[-1])
+        try:
+            for byte_blob, start, end in zip(byte_blobs, offsets, offsets[1:]):
+                segment.buf[start:end] = byte_blob
+
+            batch_offsets = [offsets[start:start + self.batch_size + 1]
+                             for start in range(0, len(byte_blobs), self.batch_size)]
+            futures = [self._executor.submit(_run_shared_batch, function, segment.name, batch, argument)
+                       for batch in batch_offsets]
+            try:
+                return [future.result() for future in futures]
+            except BaseException:
+                # The results of the other batches are not returned, so the column segments they created are removed.
+                wait(futures)
+                if function is _decode_column_batch:
+                    for future in futures:
+                        if not future.cancelled() and future.exception() is None:
+                            _unlink_shared_columns(future.result()[0])
+                raise
+        finally:
+            segment.close()
+            segment.unlink()
+
+    def decode(self, byte_blobs: list[bytes], definition: dict | None = None) -> list[dict]:
+        """
+        Decode messages into proto dicts, like decode.
+
+        :param byte_blobs: The messages to decode.
+        :param definition: The Protobuf definition to use for decoding.
+        :return: The proto dicts, in the order of the messages.
+        """
+        return [proto_dict for batch in self._map_decode(_decode_batch, byte_blobs, definition) for proto_dict in batch]
+
+    def decode_messages(self, byte_blobs: list[bytes], message_name: str) -> list[dict]:
+        """
+        Decode messages of a message type into rows, the values of the fields that are set by field name.
+        Nested messages are rows themselves, message_class(**row) renders the message again.
+
+        :param byte_blobs: The messages to decode.
+        :param message_name: The name of the message type in the definition.
+        :return: The rows, in the order of the messages.
+        """
+        return [row for batch in self._map_decode(_decode_message_batch, byte_blobs, message_name) for row in batch]
+
+    def decode_columns(self, byte_blobs: list[bytes], message_name: str) -> dict[str, list]:
+        """
+        Decode messages of a message type into columns: for every field, the values of all messages, in the order of
+        the messages. Fields that are not set in a message have None as value.
+
+        :param byte_blobs: The messages to decode.
+        :param message_name: The name of the message type in the definition.
+        :return: The columns by field name.
+        """
+        columns = None
+        batches = self._map_decode(_decode_column_batch, byte_blobs, message_name)
+        for index, batch_columns in enumerate(batches):
+            try:
+                if self.shared_memory and isinstance(batch_columns, tuple):
+                    batch_columns = _read_shared_columns(*batch_columns)
+            except BaseException:
+                # The segments of the batches that are not read yet are removed as well.
+                for unread_batch_columns in batches[index + 1:]:
+                    if isinstance(unread_batch_columns, tuple):
+                        _unlink_shared_columns(unread_batch_columns[0])
+                raise
+
+            if columns is None:
+                columns = batch_columns
+            else:
+                for field_name, column in columns.items():
+                    column.extend(batch_columns[field_name])
+        return columns if columns is not None else {}
+
+    def encode(self, values: list[dict], message_name: str | None = None) -> list[bytes]:
+        """
+        Encode proto dicts, like encode with determine_wire_types, or rows of a message type.
+
+        :param values: The proto dicts, or the rows if a message name is given.
+        :param message_name: The name of the message type in the definition to render the rows with.
+        :return: The encoded messages, in the order of the values.
+        """
+        return [byte_blob for batch in self._map(_encode_batch, values, message_name) for byte_blob in batch]
+
+    def close(self) -> None:
+        """
+        Stop the worker processes.
+        """
+        self._executor.shutdown()
+
+    def __enter__(self) -> 'CodecPool':
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
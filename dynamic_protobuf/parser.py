@@ -1,54 +1,92 @@
+import copy
 import re
 
-from imports import ProtobufImporter
+from imports import ProtobufImporter, ImportCache
+from resolvers import ImportResolver
 from protobuf_definition import ProtobufEnumDefinition, ProtobufDefinition, ProtobufMessageDefinition, \
-    ProtobufField, ProtobufServiceDefinition, ProtobufMethodDefinition
-from protobuf_instance import ProtobufMessageType, ProtobufEnumType
-
-syntax_regex = re.compile(r'syntax = "([^"]+)"')
-message_regex = re.compile(r'message ([a-zA-Z]+) {([^}]+)}')
-field_regex = re.compile(r'(optional|required|repeated)?(?: )?([a-zA-Z0-9.]+|(?:map<[a-zA-Z0-9, ]+>)) ([a-zA-Z_0-9]+) = ([0-9]+) ?(\[[a-zA-Z]* ?= ?(?:[a-zA-Z0-9-_.,"\']*)\])?;(?:(?: |\n)\/\/ ?([a-zA-Z-0-9 _+-]*))?')
-enum_regex = re.compile(r'([a-zA-Z0-9_]+) ?= ?([0-9]+);')
-line_regex = re.compile(r'([;{}])')
-equals_regex = re.compile(r'([a-zA-Z0-9\"\']?=[a-zA-Z0-9\"\']?)')
-rpc_regex = re.compile(r'rpc ([a-zA-Z0-9_]+) ?\(([a-zA-Z0-9_]+)\) ?returns ?\(([a-zA-Z0-9_]+)\) ?;')
-
-
-def find_syntax_scope(definition_lines: list[str], line_index) -> tuple[list[str], int]:
-    return [definition_lines[0]], line_index + 1
-
-
-def parse_syntax(proto_definition: ProtobufDefinition, scope: list[str]):
-    statement = scope[0]
-    statements = [statement for statement in statement.split(' ') if statement]
-    value = statements[2].replace('"', '').replace(';', '')
-    proto_definition.syntax = value
+    ProtobufField, ProtobufServiceDefinition, ProtobufMethodDefinition, ProtobufScope
+from protobuf_instance import ProtobufMessageClasses, ProtobufEnumClasses
+from type_registry import default_type_registry
+
+# The tokenizer matches a single token at the current position, all alternatives are tried in order.
+token_regex = re.compile(r'''
+    (?P<whitespace>\s+)
+  | (?P<line_comment>//[^\n]*)
+  | (?P<block_comment>/\*.*?\*/)
+  | (?P<string>"(?:[^"\\\n]|\\.)*"|'(?:[^'\\\n]|\\.)*')
+  | (?P<number>-?(?:0[xX][0-9a-fA-F]+|(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][+-]?[0-9]+)?))
+  | (?P<identifier>\.?[a-zA-Z_][a-zA-Z0-9_]*(?:\.[a-zA-Z_][a-zA-Z0-9_]*)*)
+  | (?P<symbol>[;{}\[\]()<>=,:-])
+''', re.VERBOSE | re.DOTALL)
+octal_regex = re.compile(r'-?0[0-7]+')
+
+# A token is the kind of token, its text and the line it starts on.
+Token = tuple[str, str, int]
+
+comment_kinds = ('line_comment', 'block_comment')
+labels = ('optional', 'required', 'repeated')
+integer_types = ('int32', 'int64', 'uint32', 'uint64', 'sint32', 'sint64', 'fixed32', 'fixed64', 'sfixed32',
+                 'sfixed64')
+
+
+def tokenize(definition: str) -> list[Token]:
+    tokens = []
+    line = 1
+    position = 0
+    length = len(definition)
+    match_token = token_regex.match
+    while position < length:
+        match = match_token(definition, position)
+        if not match:
+            raise Exception(f'Unexpected character {definition[position]!r} on line {line}')
+
+        kind = match.lastgroup
+        text = match.group()
+        if kind != 'whitespace':
+            tokens.append((kind, text, line))
+        # Only whitespace and multiline comments can span multiple lines.
+        if kind == 'whitespace' or kind == 'block_comment':
+            line += text.count('\n')
+        position = match.end()
+    return tokens
+
+
+def _parse_integer(value: str) -> int:
+    # Integers with a leading zero are octal in Protobuf.
+    if octal_regex.fullmatch(value):
+        return int(value, 8)
+    return int(value, 0)
+
+
+def _get_comment_text(comment: Token) -> str:
+    kind, text, _ = comment
+    if kind == 'line_comment':
+        text = text[2:].rstrip()
+        return text[1:] if text.startswith(' ') else text
+
+    # Multiline comments are joined to a single line, without the leading asterisks of the lines.
+    comment_lines = [comment_line.strip().lstrip('*').strip() for comment_line in text[2:-2].split('\n')]
+    return ' '.join([comment_line for comment_line in comment_lines if comment_line])
 
 
 def parse_options(proto_definition: ProtobufDefinition,
                   field: ProtobufField,
                   _type: str,
-                  options_string: str) -> dict[str, bool | int | float]:
+                  found_options: list[tuple[str, str]]) -> dict[str, bool | int | float | str]:
     options = {}
 
-    if options_string.startswith('[') and options_string.endswith(']'):
-        options_string = options_string[1:-1]
-
-    for option in options_string.split(','):
-        key, value = option.split('=')
-        key = key.strip()
-        value = value.strip()
+    for key, value in found_options:
         if key == 'default':
             if _type == 'float':
                 value = float(value)
-            elif _type == 'int32' or _type == 'int64':
-                value = int(value)
+            elif _type in integer_types:
+                value = _parse_integer(value)
             elif _type == 'bool':
                 value = value == 'true'
             elif _type == 'string':
-                value = value.replace('"', '')
+                value = value[1:-1]
             elif _type == 'bytes':
-                value = value.replace('"', '').encode('utf-8')
+                value = value[1:-1].encode('utf-8')
             else:
                 message = proto_definition.messages.get(_type)
                 if message:
@@ -57,496 +95,570 @@ def parse_options(proto_definition: ProtobufDefinition,
 
                 enum = proto_definition.enums.get(_type)
                 if enum:
-                    options[key] = enum
+                    options[key] = enum.values_by_name.get(value)
                     continue
 
                 proto_definition.unknown_options[field] = (key, _type, value)
                 continue
         elif key == 'packed':
             value = value == 'true'
+        elif value == 'true' or value == 'false':
+            value = value == 'true'
+        elif value.startswith('"') or value.startswith("'"):
+            value = value[1:-1]
         else:
-            if '.' in value:
-                value = float(value)
-            elif value == 'true' or value == 'false':
-                value = value == 'true'
-            else:
-                value = int(value)
+            try:
+                value = float(value) if '.' in value else _parse_integer(value)
+            except ValueError:
+                # Identifiers, like enum values, are kept as they are.
+                pass
 
         options[key] = value
     return options
 
 
-def find_oneof_scope(definition_lines: list[str], line_index) -> tuple[list[str], int]:
-    scope = []
-    level = 0
-    for line in [line.strip() for line in definition_lines]:
-        if not line:
-            continue
-        if line.startswith('oneof') and line.endswith('{'):
-            level += 1
-        if line.startswith('}'):
-            level -= 1
-            if level == 0:
-                scope.append(line)
-                break
-        scope.append(line)
-    return scope, line_index + len(scope)
-
-
-def parse_oneof(proto_message: ProtobufMessageDefinition, proto_definition: ProtobufDefinition, scope: list[str]):
-    oneof_name = scope[0].split(' ')[1]
-    if oneof_name.endswith('{'):
-        oneof_name = oneof_name[:-1]
-
-    field_lines = []
-
-    new_line_index = 0
-    message_body = scope[1:]
-    multiline_comment = ""
-    for line_index, line in enumerate(message_body):
-        if line_index < new_line_index:
-            continue
-
-        uncompact_equals = equals_regex.findall(line)
-        if uncompact_equals:
-            for uncompact_equal in uncompact_equals:
-                if len(uncompact_equal) == 3:
-                    # No space on either side of the equals sign
-                    line = line.replace(uncompact_equal, uncompact_equal.replace('=', ' = '))
-                    message_body[line_index] = line
-                elif len(uncompact_equal) == 2:
-                    # Space on one side of the equals sign
-                    if uncompact_equal.startswith('='):
-                        line = line.replace(uncompact_equal, uncompact_equal.replace('=', ' ='))
-                    else:
-                        line = line.replace(uncompact_equal, uncompact_equal.replace('=', '= '))
-                    message_body[line_index] = line
-
-        if line.startswith('message'):
-            sub_scope, new_line_index = find_message_scope(message_body[line_index:], line_index)
-            parse_message(proto_definition, sub_scope)
-        elif line.startswith('oneof'):
-            sub_scope, new_line_index = find_oneof_scope(message_body[line_index:], line_index)
-            parse_message(proto_definition, sub_scope)
-        elif line.startswith('reserved'):
-            parse_reserved(proto_message, line)
-        elif line.startswith('/*'):
-            multiline_comment += line[2:]
-            if line.endswith('*/'):
-                multiline_comment = multiline_comment[:-2]
-                proto_message.comments.append(multiline_comment.strip())
-                multiline_comment = ""
-
-        elif line.startswith('*'):
-            multiline_comment += line[1:]
-            if line.endswith('*/'):
-                multiline_comment = multiline_comment[:-2]
-                proto_message.comments.append(multiline_comment.strip())
-                multiline_comment = ""
-        else:
-            field_lines.append(line)
-
-    found_fields = field_regex.findall('\n'.join(field_lines))
-    parsed_fields = []
-    for found_field in found_fields:
-        label, _type, name, number, option, comment = found_field
-        if not comment:
-            comment = None
-
-        field = ProtobufField(proto_message, label, _type, name, number, comment)
-        proto_message.add_field(field)
-
-        proto_message.oneof_fields[name] = oneof_name
-        parsed_fields.append(field)
-
-        options = {}
-        if option:
-            options = parse_options(proto_definition, field, _type, option)
-        field.options = options
+class ProtobufParser:
+    """
+    A recursive descent parser for .proto files.
+    The definition is tokenized once and every statement is parsed from the tokens in a single pass.
+    """
+
+    def __init__(self, proto_definition: ProtobufDefinition, definition: str, load_imports: bool = True):
+        self.proto_definition = proto_definition
+        self.tokens = tokenize(definition)
+        self.index = 0
+        self.load_imports = load_imports
+
+        # The names of the messages the parser is in, for nested messages and enums.
+        self.scopes: list[str] = []
+
+    def _skip_comments(self) -> None:
+        tokens = self.tokens
+        while self.index < len(tokens) and tokens[self.index][0] in comment_kinds:
+            self.index += 1
+
+    def _peek(self) -> str | None:
+        self._skip_comments()
+        if self.index < len(self.tokens):
+            return self.tokens[self.index][1]
+        return None
+
+    def _next(self) -> Token:
+        self._skip_comments()
+        if self.index >= len(self.tokens):
+            raise Exception('Unexpected end of definition')
+        token = self.tokens[self.index]
+        self.index += 1
+        return token
+
+    def _next_comment(self) -> Token | None:
+        if self.index < len(self.tokens) and self.tokens[self.index][0] in comment_kinds:
+            token = self.tokens[self.index]
+            self.index += 1
+            return token
+        return None
+
+    def _expect(self, expected_value: str) -> Token:
+        token = self._next()
+        if token[1] != expected_value:
+            raise Exception(f'Expected "{expected_value}" but found "{token[1]}" on line {token[2]}')
+        return token
+
+    def _expect_kind(self, expected_kind: str) -> str:
+        kind, value, line = self._next()
+        if kind != expected_kind:
+            raise Exception(f'Expected {expected_kind} but found "{value}" on line {line}')
+        return value
+
+    def _skip_statement(self) -> None:
+        # Skips everything up to the end of the statement, including option values between curly braces.
+        level = 0
+        while True:
+            value = self._next()[1]
+            if value == '{':
+                level += 1
+            elif value == '}':
+                level -= 1
+            elif value == ';' and level == 0:
+                return
+
+    def _skip_block(self) -> None:
+        self._expect('{')
+        level = 1
+        while level:
+            value = self._next()[1]
+            if value == '{':
+                level += 1
+            elif value == '}':
+                level -= 1
+
+    def parse(self) -> None:
+        while True:
+            comment = self._next_comment()
+            if comment:
+                self.proto_definition.comments.append(_get_comment_text(comment))
+                continue
 
-    proto_message.oneofs[oneof_name] = parsed_fields
+            if self.index >= len(self.tokens):
+                return
 
+            kind, keyword, _ = self._next()
+            if keyword == ';':
+                continue
 
-def find_message_scope(definition_lines: list[str], line_index) -> tuple[list[str], int]:
-    scope = []
-    level = 0
-    for line in [line.strip() for line in definition_lines]:
-        if not line:
-            continue
-        if (line.startswith('message') or line.startswith('oneof')) and line.endswith('{'):
-            level += 1
-        if line.startswith('}'):
-            level -= 1
-            if level == 0:
-                scope.append(line)
-                break
-        scope.append(line)
-    return scope, line_index + len(scope)
-
-
-def parse_reserved(proto_message: ProtobufMessageDefinition, line: str):
-    line = line.replace('reserved', '')[:-1]
-    reserved_field_number_entries = [entry.strip() for entry in line.split(',')]
-    for entry in reserved_field_number_entries:
-        if entry.isdigit():
-            proto_message.reserved_field_numbers.add(int(entry))
-        elif 'to' in entry:
-            start, end = entry.split('to')
-            start = start.strip()
-            end = end.strip()
-            for number in range(int(start), int(end) + 1):
-                proto_message.reserved_field_numbers.add(number)
+            parse_function = self.statements.get(keyword) if kind == 'identifier' else None
+            if not parse_function:
+                raise Exception(f'Unknown statement: {keyword}')
+            parse_function(self)
+
+    def parse_syntax(self) -> None:
+        self._expect('=')
+        self.proto_definition.syntax = self._expect_kind('string')[1:-1]
+        self._expect(';')
+
+    def parse_package(self) -> None:
+        self.proto_definition.package = self._expect_kind('identifier')
+        self._expect(';')
+
+    def parse_import(self) -> None:
+        kind, importable, line = self._next()
+        public_import = False
+        if importable in ('public', 'weak') and self._peek() != ';':
+            public_import = importable == 'public'
+            kind, importable, line = self._next()
+
+        if kind == 'string':
+            importable = importable[1:-1]
+        elif kind != 'identifier':
+            raise Exception(f'Expected import but found "{importable}" on line {line}')
+        self._expect(';')
+
+        self.proto_definition.imports.append((importable, public_import))
+        if self.load_imports:
+            self.proto_definition.importer.load_import(importable, public_import)
+
+    def parse_extensions(self) -> None:
+        extensions = []
+        while self._peek() != ';':
+            extensions.append(self._next()[1])
+        self._next()
+        self.proto_definition.extensions = ' '.join(extensions)
+
+    def parse_option(self) -> None:
+        # Options are ignored
+        self._skip_statement()
+
+    def _parse_option_name(self) -> str:
+        kind, value, line = self._next()
+        if value != '(':
+            return value
+
+        # Custom options are wrapped in parentheses and can be followed by a sub-field, like (my_option).value
+        name = f'({self._expect_kind("identifier")})'
+        self._expect(')')
+        if (self._peek() or '').startswith('.'):
+            name += self._next()[1]
+        return name
+
+    def _parse_constant(self) -> str:
+        kind, value, line = self._next()
+        if value == '-':
+            # Negative identifiers, like -inf
+            return f'-{self._expect_kind("identifier")}'
+        if value == '{':
+            # Aggregate values are kept as text.
+            self.index -= 1
+            start_index = self.index
+            self._skip_block()
+            return ' '.join([token[1] for token in self.tokens[start_index:self.index]
+                             if token[0] not in comment_kinds])
+        if kind not in ('string', 'number', 'identifier'):
+            raise Exception(f'Expected value but found "{value}" on line {line}')
+        return value
+
+    def _parse_option_list(self) -> list[tuple[str, str]]:
+        self._expect('[')
+        found_options = []
+        while True:
+            key = self._parse_option_name()
+            self._expect('=')
+            found_options.append((key, self._parse_constant()))
+
+            kind, value, line = self._next()
+            if value == ']':
+                return found_options
+            if value != ',':
+                raise Exception(f'Expected "," or "]" but found "{value}" on line {line}')
+
+    def _parse_field(self, proto_message: ProtobufMessageDefinition, token: Token) -> ProtobufField:
+        kind, value, line = token
+
+        label = ''
+        if value in labels:
+            label = value
+            kind, value, line = self._next()
+
+        if value == 'map' and self._peek() == '<':
+            self._next()
+            key_type = self._expect_kind('identifier')
+            self._expect(',')
+            value_type = self._expect_kind('identifier')
+            self._expect('>')
+            _type = f'map<{key_type}, {value_type}>'
+        elif kind == 'identifier':
+            _type = value
         else:
-            raise Exception(f'Unknown reserved entry: {entry}')
+            raise Exception(f'Expected field type but found "{value}" on line {line}')
 
+        name = self._expect_kind('identifier')
+        self._expect('=')
+        number = _parse_integer(self._expect_kind('number'))
 
-def parse_message(proto_definition: ProtobufDefinition, scope: list[str]):
-    message_name = scope[0].split(' ')[1]
-    if message_name.endswith('{'):
-        message_name = message_name[:-1]
+        found_options = []
+        if self._peek() == '[':
+            found_options = self._parse_option_list()
+        end_line = self._expect(';')[2]
 
-    proto_message = ProtobufMessageDefinition(proto_definition, message_name)
-    proto_definition.messages[message_name] = proto_message
-
-    field_lines = []
-
-    new_line_index = 0
-    message_body = scope[1:]
-    multiline_comment = ""
-    for line_index, line in enumerate(message_body):
-        if line_index < new_line_index:
-            continue
-
-        uncompact_equals = equals_regex.findall(line)
-        if uncompact_equals:
-            for uncompact_equal in uncompact_equals:
-                if len(uncompact_equal) == 3:
-                    # No space on either side of the equals sign
-                    line = line.replace(uncompact_equal, uncompact_equal.replace('=', ' = '))
-                    message_body[line_index] = line
-                elif len(uncompact_equal) == 2:
-                    # Space on one side of the equals sign
-                    if uncompact_equal.startswith('='):
-                        line = line.replace(uncompact_equal, uncompact_equal.replace('=', ' ='))
-                    else:
-                        line = line.replace(uncompact_equal, uncompact_equal.replace('=', '= '))
-                    message_body[line_index] = line
-
-        if line.startswith('message'):
-            sub_scope, new_line_index = find_message_scope(message_body[line_index:], line_index)
-            parse_message(proto_definition, sub_scope)
-        elif line.startswith('oneof'):
-            sub_scope, new_line_index = find_oneof_scope(message_body[line_index:], line_index)
-            parse_oneof(proto_message, proto_definition, sub_scope)
-        elif line.startswith('reserved'):
-            parse_reserved(proto_message, line)
-        elif line.startswith('/*'):
-            multiline_comment += line[2:]
-            if line.endswith('*/'):
-                multiline_comment = multiline_comment[:-2]
-                proto_message.comments.append(multiline_comment.strip())
-                multiline_comment = ""
-
-        elif line.startswith('*'):
-            multiline_comment += line[1:]
-            if line.endswith('*/'):
-                multiline_comment = multiline_comment[:-2]
-                proto_message.comments.append(multiline_comment.strip())
-                multiline_comment = ""
-        else:
-            field_lines.append(line)
-
-    found_fields = field_regex.findall('\n'.join(field_lines))
-    for found_field in found_fields:
-        label, _type, name, number, option, comment = found_field
-        if not comment:
-            comment = None
+        # A comment on the same line, after the field, belongs to the field.
+        comment = None
+        if (self.index < len(self.tokens) and self.tokens[self.index][0] == 'line_comment'
+                and self.tokens[self.index][2] == end_line):
+            comment = _get_comment_text(self._next_comment())
 
         field = ProtobufField(proto_message, label, _type, name, number, comment)
         proto_message.add_field(field)
+        if field in self.proto_definition.unknown_references:
+            self.proto_definition.reference_scopes[field] = '.'.join(self.scopes)
 
         options = {}
-        if option:
-            options = parse_options(proto_definition, field, _type, option)
+        if found_options:
+            options = parse_options(self.proto_definition, field, _type, found_options)
         field.options = options
+        return field
+
+    def _parse_reserved(self, proto_message: ProtobufMessageDefinition) -> None:
+        while True:
+            kind, value, line = self._next()
+            if kind == 'number':
+                start = _parse_integer(value)
+                end = start
+                if self._peek() == 'to':
+                    self._next()
+                    end_value = self._next()[1]
+                    try:
+                        end = _parse_integer(end_value)
+                    except ValueError:
+                        raise Exception(f'Unknown reserved entry: {value} to {end_value}')
+
+                for number in range(start, end + 1):
+                    proto_message.reserved_field_numbers.add(number)
+            elif kind != 'string':
+                # Reserved field names are not tracked, only reserved field numbers.
+                raise Exception(f'Unknown reserved entry: {value}')
+
+            kind, value, line = self._next()
+            if value == ';':
+                return
+            if value != ',':
+                raise Exception(f'Expected "," or ";" but found "{value}" on line {line}')
+
+    def _parse_oneof(self, proto_message: ProtobufMessageDefinition) -> None:
+        oneof_name = self._expect_kind('identifier')
+        self._expect('{')
+
+        parsed_fields = []
+        while True:
+            comment = self._next_comment()
+            if comment:
+                if comment[0] == 'block_comment':
+                    proto_message.comments.append(_get_comment_text(comment))
+                continue
 
-
-def find_enum_scope(definition_lines: list[str], line_index) -> tuple[list[str], int]:
-    scope = []
-    level = 0
-    for line in [line.strip() for line in definition_lines]:
-        if not line:
-            continue
-        if line.startswith('enum') and line.endswith('{'):
-            level += 1
-        if line.startswith('}'):
-            level -= 1
-            if level == 0:
-                scope.append(line)
+            token = self._next()
+            value = token[1]
+            if value == '}':
                 break
-        scope.append(line)
-    return scope, line_index + len(scope) + 1
-
-
-def parse_enum(proto_definition: ProtobufDefinition, scope: list[str]):
-    enum_name = scope[0].split(' ')[1]
-
-    proto_enum = ProtobufEnumDefinition(proto_definition, enum_name)
-    proto_definition.enums[enum_name] = proto_enum
-
-    found_values = enum_regex.findall('\n'.join(scope))
-    for found_value in found_values:
-        proto_enum.values_by_name[found_value[0]] = int(found_value[1])
-        proto_enum.values_by_number[int(found_value[1])] = found_value[0]
-
-
-def parse_single_line_comment(proto_definition: ProtobufDefinition, scope: list[str]):
-    comment = scope[0][3:]
-    proto_definition.comments.append(comment)
-
-
-def parse_import(proto_definition: ProtobufDefinition, scope: list[str]):
-    import_line = scope[0]
-    importable = import_line.replace('import', '', 1).replace(';', '').replace('"', '').strip()
-    public_import = False
-    if importable.startswith('public '):
-        importable = importable[7:]
-        public_import = True
-    proto_definition.importer.load_import(importable, public_import)
-
-
-def parse_extensions(proto_definition: ProtobufDefinition, scope: list[str]):
-    extensions = scope[0].replace('extensions', '').replace(';', '').strip()
-    if extensions.startswith('max'):
-        extensions = extensions[3:]
-    proto_definition.extensions = extensions
-
-
-def parse_extend(proto_definition: ProtobufDefinition, scope: list[str]):
-    message_name = scope[0].split(' ')[1]
-    if message_name.endswith('{'):
-        message_name = message_name[:-1]
-
-    proto_message = proto_definition.messages.get(message_name)
-
-    field_lines = []
-
-    new_line_index = 0
-    message_body = scope[1:]
-    multiline_comment = ""
-    for line_index, line in enumerate(message_body):
-        if line_index < new_line_index:
-            continue
-
-        uncompact_equals = equals_regex.findall(line)
-        if uncompact_equals:
-            for uncompact_equal in uncompact_equals:
-                if len(uncompact_equal) == 3:
-                    # No space on either side of the equals sign
-                    line = line.replace(uncompact_equal, uncompact_equal.replace('=', ' = '))
-                    message_body[line_index] = line
-                elif len(uncompact_equal) == 2:
-                    # Space on one side of the equals sign
-                    if uncompact_equal.startswith('='):
-                        line = line.replace(uncompact_equal, uncompact_equal.replace('=', ' ='))
-                    else:
-                        line = line.replace(uncompact_equal, uncompact_equal.replace('=', '= '))
-                    message_body[line_index] = line
-
-        if line.startswith('message'):
-            sub_scope, new_line_index = find_message_scope(message_body[line_index:], line_index)
-            parse_message(proto_definition, sub_scope)
-        elif line.startswith('oneof'):
-            sub_scope, new_line_index = find_oneof_scope(message_body[line_index:], line_index)
-            parse_oneof(proto_message, proto_definition, sub_scope)
-        elif line.startswith('reserved'):
-            parse_reserved(proto_message, line)
-        elif line.startswith('/*'):
-            multiline_comment += line[2:]
-            if line.endswith('*/'):
-                multiline_comment = multiline_comment[:-2]
-                proto_message.comments.append(multiline_comment.strip())
-                multiline_comment = ""
-
-        elif line.startswith('*'):
-            multiline_comment += line[1:]
-            if line.endswith('*/'):
-                multiline_comment = multiline_comment[:-2]
-                proto_message.comments.append(multiline_comment.strip())
-                multiline_comment = ""
-        else:
-            field_lines.append(line)
-
-    found_fields = field_regex.findall('\n'.join(field_lines))
-    for found_field in found_fields:
-        label, _type, name, number, option, comment = found_field
-        if not comment:
-            comment = None
-
-        field = ProtobufField(proto_message, label, _type, name, number, comment)
-        proto_message.add_field(field)
-
-        options = {}
-        if option:
-            options = parse_options(proto_definition, field, _type, option)
-        field.options = options
-
+            elif value == ';':
+                continue
+            elif value == 'option':
+                self._skip_statement()
+            else:
+                field = self._parse_field(proto_message, token)
+                proto_message.oneof_fields[field.name] = oneof_name
+                parsed_fields.append(field)
+
+        proto_message.oneofs[oneof_name] = parsed_fields
+
+    def parse_message(self) -> None:
+        message_name = self._expect_kind('identifier')
+
+        proto_message = ProtobufMessageDefinition(self.proto_definition, message_name)
+        proto_message.scope = '.'.join(self.scopes)
+        # Nested messages with the same name replace each other here, their classes are looked up by declaration.
+        self.proto_definition.messages[message_name] = proto_message
+        self.proto_definition.declarations.append(proto_message)
+
+        self._expect('{')
+        self.scopes.append(message_name)
+        while True:
+            comment = self._next_comment()
+            if comment:
+                # Single line comments between the fields are not kept, they usually describe the next field.
+                if comment[0] == 'block_comment':
+                    proto_message.comments.append(_get_comment_text(comment))
+                continue
 
-def find_service_scope(definition_lines: list[str], line_index) -> tuple[list[str], int]:
-    scope = []
-    level = 0
-    for line in [line.strip() for line in definition_lines]:
-        if not line:
-            continue
-        if line.endswith('{'):
-            level += 1
-        if line.startswith('}'):
-            level -= 1
-            if level == 0:
-                scope.append(line)
+            token = self._next()
+            value = token[1]
+            if value == '}':
+                self.scopes.pop()
+                return
+            elif value == ';':
+                continue
+            elif value == 'message':
+                self.parse_message()
+            elif value == 'enum':
+                self.parse_enum()
+            elif value == 'oneof':
+                self._parse_oneof(proto_message)
+            elif value == 'reserved':
+                self._parse_reserved(proto_message)
+            elif value == 'extend':
+                self.parse_extend()
+            elif value == 'option' or value == 'extensions':
+                self._skip_statement()
+            else:
+                self._parse_field(proto_message, token)
+
+    def parse_enum(self) -> None:
+        enum_name = self._expect_kind('identifier')
+
+        proto_enum = ProtobufEnumDefinition(self.proto_definition, enum_name)
+        proto_enum.scope = '.'.join(self.scopes)
+        self.proto_definition.enums[enum_name] = proto_enum
+        self.proto_definition.declarations.append(proto_enum)
+
+        self._expect('{')
+        while True:
+            kind, value, line = self._next()
+            if value == '}':
+                return
+            elif value == ';':
+                continue
+            elif value == 'option' or value == 'reserved':
+                self._skip_statement()
+            elif kind == 'identifier':
+                self._expect('=')
+                number = _parse_integer(self._expect_kind('number'))
+                if self._peek() == '[':
+                    self._parse_option_list()
+                self._expect(';')
+
+                proto_enum.values_by_name[value] = number
+                proto_enum.values_by_number[number] = value
+            else:
+                raise Exception(f'Expected enum value but found "{value}" on line {line}')
+
+    def parse_extend(self) -> None:
+        message_name = self._expect_kind('identifier')
+
+        # The extended message can be imported, the fields are added to it when the definition is linked.
+        proto_message = self.proto_definition.pending_extensions.get(message_name)
+        if not proto_message:
+            proto_message = ProtobufMessageDefinition(self.proto_definition, message_name)
+            self.proto_definition.pending_extensions[message_name] = proto_message
+
+        self._expect('{')
+        while True:
+            token = self._next()
+            value = token[1]
+            if value == '}':
+                return
+            elif value == ';':
+                continue
+            self._parse_field(proto_message, token)
+
+    def _parse_method_type(self) -> str:
+        self._expect('(')
+        method_type = self._expect_kind('identifier')
+        if method_type == 'stream' and self._peek() != ')':
+            method_type = self._expect_kind('identifier')
+        self._expect(')')
+        return method_type
+
+    def parse_service(self) -> None:
+        service_name = self._expect_kind('identifier')
+        protobuf_service = ProtobufServiceDefinition(self.proto_definition, service_name)
+
+        self._expect('{')
+        while True:
+            kind, value, line = self._next()
+            if value == '}':
                 break
-        scope.append(line)
-    return scope, line_index + len(scope)
-
-
-def parse_service(proto_definition: ProtobufDefinition, scope: list[str]):
-    service_name = scope[0].split(' ')[1]
-    if service_name.endswith('{'):
-        service_name = service_name[:-1]
-
-    protobuf_service = ProtobufServiceDefinition(proto_definition, service_name)
-
-    found_methods = rpc_regex.findall('\n'.join(scope))
-    for found_method in found_methods:
-        method_name, request_type, response_type = found_method
-        method_definition = ProtobufMethodDefinition(proto_definition, method_name, request_type, response_type)
-        protobuf_service.methods[method_name] = method_definition
-
-    proto_definition.services[service_name] = protobuf_service
-
-
-def parse_package(proto_definition: ProtobufDefinition, scope: list[str]):
-    package_name = scope[0].split(' ')[1]
-    if package_name.endswith(';'):
-        package_name = package_name[:-1]
-    proto_definition.package = package_name
-
-
-def single_line_scope(definition_lines: list[str], line_index) -> tuple[list[str], int]:
-    return [definition_lines[0]], line_index + 1
+            elif value == ';':
+                continue
+            elif value == 'option':
+                self._skip_statement()
+            elif value == 'rpc':
+                method_name = self._expect_kind('identifier')
+                request_type = self._parse_method_type()
+                self._expect('returns')
+                response_type = self._parse_method_type()
+                if self._peek() == '{':
+                    # Method options are ignored
+                    self._skip_block()
+                else:
+                    self._expect(';')
+
+                method_definition = ProtobufMethodDefinition(self.proto_definition, method_name, request_type,
+                                                             response_type)
+                protobuf_service.methods[method_name] = method_definition
+            else:
+                raise Exception(f'Unknown statement in service {service_name}: {value} on line {line}')
+
+        self.proto_definition.services[service_name] = protobuf_service
+
+    statements = {
+        'syntax': parse_syntax,
+        'package': parse_package,
+        'import': parse_import,
+        'option': parse_option,
+        'message': parse_message,
+        'enum': parse_enum,
+        'extend': parse_extend,
+        'extensions': parse_extensions,
+        'service': parse_service,
+    }
+
+
+def _parse_definition(definition: str, imports_path: str | None, import_level: int,
+                      registry: 'SchemaRegistry | None', import_cache: ImportCache | None,
+                      resolvers: list[ImportResolver] | None) -> ProtobufDefinition:
+    proto_definition = ProtobufDefinition()
+    proto_definition.importer = ProtobufImporter(proto_definition, imports_path, import_level, registry, import_cache,
+                                                 resolvers)
 
+    ProtobufParser(proto_definition, definition).parse()
 
-keywords = {
-    'syntax': (find_syntax_scope, parse_syntax),
-    'message': (find_message_scope, parse_message),
-    'enum': (find_enum_scope, parse_enum),
-    'import': (single_line_scope, parse_import),
-    '//': (single_line_scope, parse_single_line_comment),
-    'extensions': (single_line_scope, parse_extensions),
-    'extend': (find_message_scope, parse_extend),
-    'service': (find_service_scope, parse_service),
-    'package': (single_line_scope, parse_package),
+    return proto_definition
 
-    # Options are ignored
-    'option': (single_line_scope, lambda proto_definition, scope: None),
-}
 
+def parse_unlinked(definition: str) -> ProtobufDefinition:
+    """
+    Parse a definition without loading its imports.
+    The imports are listed in the imports of the definition, references to imported messages are resolved by link.
 
-def _parse_definition(definition: str, imports_path: str | None, import_level: int) -> ProtobufDefinition:
+    :param definition: The source of the definition.
+    :return: The parsed definition, without message classes.
+    """
     proto_definition = ProtobufDefinition()
-    proto_definition.importer = ProtobufImporter(proto_definition, imports_path, import_level)
-
-    new_line_index = 0
-
-    lines = []
-    definition_lines = definition.split('\n')
-    for line_index, line in enumerate(definition_lines):
-        if line.startswith('//'):
-            lines.append(line)
-            continue
-
-        capture_groups = line_regex.split(line)
-        if len(capture_groups) % 2 == 1:
-            capture_groups.append('')
-        # Combine in groups of 2
-        sub_lines = [capture_groups[i] + capture_groups[i + 1] for i in range(0, len(capture_groups), 2)]
-        lines.extend(sub_lines)
-
-    lines = [line for line in lines if line]
+    ProtobufParser(proto_definition, definition, load_imports=False).parse()
+    return proto_definition
 
-    for line_index, line in enumerate(lines):
-        if not line:
-            continue
 
-        if line_index < new_line_index:
-            continue
+def build_message_classes(proto_definition: ProtobufDefinition):
+    """
+    Prepare the message and enum classes of a definition, the classes are created when they are first used.
 
-        uncompact_equals = equals_regex.findall(line)
-        if uncompact_equals:
-            for uncompact_equal in uncompact_equals:
-                if len(uncompact_equal) == 3:
-                    # No space on either side of the equals sign
-                    line = line.replace(uncompact_equal, uncompact_equal.replace('=', ' = '))
-                    lines[line_index] = line
-                elif len(uncompact_equal) == 2:
-                    # Space on one side of the equals sign
-                    if uncompact_equal.startswith('='):
-                        line = line.replace(uncompact_equal, uncompact_equal.replace('=', ' ='))
-                    else:
-                        line = line.replace(uncompact_equal, uncompact_equal.replace('=', '= '))
-                    lines[line_index] = line
-
-        statements = [statement for statement in line.split(' ') if statement]
-        if statements:
-            keyword = statements[0]
-            try:
-                scope_function, parse_function = keywords.get(keyword)
-            except TypeError:
-                raise Exception(f'Unknown statement: {keyword}')
+    :param proto_definition: The linked definition.
+    """
+    proto_definition.message_classes = ProtobufMessageClasses(proto_definition)
+    proto_definition.enum_classes = ProtobufEnumClasses(proto_definition)
+    proto_definition.symbols = None
 
-            scope, new_line_index = scope_function(lines[line_index:], line_index)
-            parse_function(proto_definition, scope)
 
+def parse(definition: str, imports_path: str | None = None, import_level: int = 0,
+          registry: 'SchemaRegistry | None' = None, import_cache: ImportCache | None = None,
+          resolvers: list[ImportResolver] | None = None) -> ProtobufDefinition:
+    proto_definition = _parse_definition(definition, imports_path, import_level, registry, import_cache, resolvers)
+    link(proto_definition)
     return proto_definition
 
 
-def build_message_classes(proto_definition: ProtobufDefinition):
-    for message_name, message_definition in proto_definition.messages.items():
-        if isinstance(message_definition, ProtobufDefinition):
-            build_message_classes(message_definition)
-            proto_definition.message_classes[message_name] = message_definition
-            for sub_message_class_name, sub_message_class_definition in message_definition.message_classes.items():
-                proto_definition.message_classes[sub_message_class_name] = sub_message_class_definition
-        else:
-            proto_definition.message_classes[message_name] = ProtobufMessageType(message_name,
-                                                                                 message_definition=message_definition)
-
-    for enum_name, enum_definition in proto_definition.enums.items():
-        proto_definition.enum_classes[enum_name] = ProtobufEnumType(enum_name, enum_definition=enum_definition)
-
-
-def parse(definition: str, imports_path: str | None = None, import_level: int = 0) -> ProtobufDefinition:
-    proto_definition = _parse_definition(definition, imports_path, import_level)
+def build_scope_tree(proto_definition: ProtobufDefinition) -> ProtobufScope:
+    """
+    Build the tree of the packages and messages of a definition and its imports, to resolve references with.
+
+    :param proto_definition: The parsed definition, with the imported messages added.
+    :return: The root of the tree.
+    """
+    def get_path(symbol: ProtobufMessageDefinition | ProtobufEnumDefinition) -> list[str]:
+        path = symbol.definition.package.split('.') if symbol.definition.package else []
+        if symbol.scope:
+            path.extend(symbol.scope.split('.'))
+        path.append(symbol.name)
+        return path
+
+    scope_tree = ProtobufScope()
+    imported_definitions = {}
+    imported_messages = []
+    for message in proto_definition.messages.values():
+        if isinstance(message, ProtobufMessageDefinition) and message.definition is not proto_definition:
+            imported_definitions[id(message.definition)] = message.definition
+            imported_messages.append(message)
+
+    # The declarations of the imported files first, so the extended copies of imported messages replace them.
+    for imported_definition in imported_definitions.values():
+        for declaration in imported_definition.declarations:
+            scope_tree.add(get_path(declaration), declaration)
+    for message in imported_messages:
+        scope_tree.add(get_path(message), message)
+    for declaration in proto_definition.declarations:
+        scope_tree.add(get_path(declaration), declaration)
+    return scope_tree
+
+
+def link(proto_definition: ProtobufDefinition) -> None:
+    """
+    Resolve the references of a parsed definition and build its message classes.
+    The imported messages should be added to the definition before it is linked.
+
+    :param proto_definition: The parsed definition.
+    """
+    for message_name, extension in proto_definition.pending_extensions.items():
+        proto_message = proto_definition.messages.get(message_name)
+        if not proto_message:
+            raise Exception(f'Unknown message to extend: {message_name}')
+
+        if proto_message.definition is not proto_definition:
+            # Imported messages can be shared with other definitions, so only a copy of the message is extended.
+            extended_message = copy.copy(proto_message)
+            extended_message.fields_by_name = dict(proto_message.fields_by_name)
+            extended_message.fields_by_number = dict(proto_message.fields_by_number)
+            for name, message in proto_definition.messages.items():
+                if message is proto_message:
+                    proto_definition.messages[name] = extended_message
+            proto_message = extended_message
+
+        for field in extension.fields_by_number.values():
+            field.message = proto_message
+            proto_message.add_field(field)
+    proto_definition.pending_extensions.clear()
+
+    scope_tree = build_scope_tree(proto_definition)
+    package_scope = proto_definition.package.split('.') if proto_definition.package else []
+
+    def resolve(type_name: str, field: ProtobufField | None = None):
+        scope = package_scope
+        reference_scope = proto_definition.reference_scopes.get(field)
+        if reference_scope:
+            scope = package_scope + reference_scope.split('.')
+
+        symbol = scope_tree.resolve(type_name, scope)
+        if symbol is None:
+            # Imported messages are also known by the path of the imported file, like folder.Message
+            symbol = proto_definition.messages.get(type_name) or proto_definition.enums.get(type_name)
+        return symbol
 
     to_be_removed_unknown_references = []
     for unknown_field, unknown_message_name in proto_definition.unknown_references.items():
-        message_type = proto_definition.messages.get(unknown_message_name)
+        message_type = resolve(unknown_message_name, unknown_field)
         if message_type:
             if isinstance(unknown_field.type, tuple):
                 unknown_field.type = (unknown_field.type[0], message_type)
             else:
                 unknown_field.type = message_type
             to_be_removed_unknown_references.append(unknown_field)
-            continue
-
-        enum_type = proto_definition.enums.get(unknown_message_name)
-        if enum_type:
-            if isinstance(unknown_field.type, tuple):
-                unknown_field.type = (unknown_field.type[0], enum_type)
-            else:
-                unknown_field.type = enum_type
-            to_be_removed_unknown_references.append(unknown_field)
-            continue
 
     for unknown_field in to_be_removed_unknown_references:
         del proto_definition.unknown_references[unknown_field]
@@ -556,13 +668,12 @@ def parse(definition: str, imports_path: str | None = None, import_level: int =
 
     to_be_removed_unknown_options = []
     for unknown_field, (unknown_option_key, unknown_option_type, unknown_option_value) in proto_definition.unknown_options.items():
-        message_type = proto_definition.messages.get(unknown_option_type)
-        if message_type:
+        option_type = resolve(unknown_option_type, unknown_field)
+        if isinstance(option_type, ProtobufMessageDefinition):
             raise Exception('Not sure what to do here...')
 
-        enum_type = proto_definition.enums.get(unknown_option_type)
-        if enum_type:
-            value = enum_type.values_by_name.get(unknown_option_value)
+        if isinstance(option_type, ProtobufEnumDefinition):
+            value = option_type.values_by_name.get(unknown_option_value)
             unknown_field.options[unknown_option_key] = value
             to_be_removed_unknown_options.append(unknown_field)
             continue
@@ -572,17 +683,17 @@ def parse(definition: str, imports_path: str | None = None, import_level: int =
 
     if proto_definition.unknown_options:
         raise Exception(f'Unknown options: {proto_definition.unknown_options}')
+    proto_definition.reference_scopes.clear()
 
     for service_name, service in proto_definition.services.items():
         for method_name, method in service.methods.items():
-            message_type = proto_definition.messages.get(method.input_type)
-            if message_type:
+            message_type = resolve(method.input_type) if isinstance(method.input_type, str) else None
+            if isinstance(message_type, ProtobufMessageDefinition):
                 method.input_type = message_type
 
-            message_type = proto_definition.messages.get(method.output_type)
-            if message_type:
+            message_type = resolve(method.output_type) if isinstance(method.output_type, str) else None
+            if isinstance(message_type, ProtobufMessageDefinition):
                 method.output_type = message_type
 
     build_message_classes(proto_definition)
-
-    return proto_definition
+    default_type_registry.add(proto_definition)
@@ -1,5 +1,6 @@
-from any import AnyMessage
-from protobuf_definition_types import ProtobufLabel, ProtobufType, default_value_table
+from protobuf_definition_types import ProtobufLabel, ProtobufType, default_value_table, no_default, \
+    protobuf_type_wire_type_table
+from protobuf_map import create_map_type
 
 
 class ProtobufEnumDefinition:
@@ -10,6 +11,9 @@ class ProtobufEnumDefinition:
         self.definition = definition
         self.name = name
         self.values_by_name: dict[str, int] = {}
+
+        # The names of the messages the enum is nested in, separated by dots.
+        self.scope = ''
         self.values_by_number: dict[int, str] = {}
 
 
@@ -100,6 +104,12 @@ class ProtobufMessageDefinition:
         self.fields_by_name = {}
         self.fields_by_number = {}
 
+        # The names of the messages the message is nested in, separated by dots.
+        self.scope = ''
+
+        self._render_plan: dict[str, tuple] | None = None
+        self._decoder_definition: dict | None = None
+
         self.oneofs: dict[str, list[ProtobufField]] = {}
         self.oneof_fields: dict[ProtobufField, str] = {}
 
@@ -110,52 +120,105 @@ class ProtobufMessageDefinition:
     def add_field(self, field: ProtobufField):
         self.fields_by_name[field.name] = field
         self.fields_by_number[field.number] = field
+        self._render_plan = None
+        self._decoder_definition = None
+
+    def _get_render_plan(self) -> dict[str, tuple]:
+        # Per field: the declaration index, the field, whether strings are encoded, the default value to skip,
+        # the map type of map fields and the other fields of its oneof.
+        if self._render_plan is None:
+            render_plan = {}
+            for index, (field_name, field) in enumerate(self.fields_by_name.items()):
+                default_value = field.options['default'] if field.options.get('default') else no_default
+                oneof = self.oneof_fields.get(field_name)
+                oneof_siblings = tuple(oneof_field.name for oneof_field in self.oneofs[oneof]
+                                       if oneof_field.name != field_name) if oneof else ()
+                render_plan[field_name] = (index, field, field.type == ProtobufType.BYTES, default_value,
+                                           create_map_type(field) if isinstance(field.type, tuple) else None,
+                                           oneof_siblings)
+            self._render_plan = render_plan
+        return self._render_plan
+
+    def get_decoder_definition(self) -> dict:
+        """
+        Get the definition to decode the message with: the map, bytes and message fields, with the definitions
+        of the nested messages, so the entries of maps are decoded by their map type and bytes values stay bytes.
+        """
+        decoder_definition = self._decoder_definition
+        if decoder_definition is None:
+            building: dict[ProtobufMessageDefinition, dict] = {}
+            decoder_definition = self._build_decoder_definition(building)
+
+            # The definitions are only set when they are complete, so other threads never decode with a partial one.
+            for message_definition, message_decoder_definition in building.items():
+                message_definition._decoder_definition = message_decoder_definition
+        return decoder_definition
+
+    def _build_decoder_definition(self, building: dict) -> dict:
+        if self._decoder_definition is not None:
+            return self._decoder_definition
+        if self in building:
+            # Recursive messages refer to the definition that is being built.
+            return building[self]
+
+        from dynamic_protobuf import DecoderFieldDefinition, WireType
+
+        decoder_definition = building[self] = {}
+        for field_number, field in self.fields_by_number.items():
+            if isinstance(field.type, tuple):
+                decoder_definition[field_number] = DecoderFieldDefinition.map()
+            elif field.options.get('packed'):
+                # The values of packed fields are not prefixed with their wire type, so it comes from the field type.
+                wire_type = WireType.VARINT if isinstance(field.type, ProtobufEnumDefinition) \
+                    else protobuf_type_wire_type_table[field.type]
+                decoder_definition[field_number] = DecoderFieldDefinition.repeated_packed(wire_type)
+            elif field.type == ProtobufType.BYTES:
+                decoder_definition[field_number] = DecoderFieldDefinition.bytes()
+            elif isinstance(field.type, ProtobufMessageDefinition):
+                decoder_definition[field_number] = field.type._build_decoder_definition(building)
+        return decoder_definition
 
     def render(self, **kwargs):
+        render_plan = self._render_plan or self._get_render_plan()
+
+        # Only the given fields are rendered, in the order they are declared, so the last field of a oneof wins.
+        field_names = [field_name for field_name in kwargs if field_name in render_plan]
+        if len(field_names) > 1:
+            field_names.sort(key=lambda name: render_plan[name][0])
+
         message_instance = {}
-        for field_name, field in self.fields_by_name.items():
-            if field_name not in kwargs:
-                continue
+        for field_name in field_names:
+            _, field, encode_string, default_value, map_type, oneof_siblings = render_plan[field_name]
             field_value = kwargs[field_name]
 
-            if field.type == ProtobufType.BYTES and isinstance(field_value, str):
+            if encode_string and isinstance(field_value, str):
                 field_value = field_value.encode()
 
-            if field.options.get('default') and field_value == self.get_default_value(field):
+            if default_value is not no_default and field_value == default_value:
                 continue
 
             if isinstance(field_value, dict):
-                if isinstance(field.type, tuple):
-                    # Map
-                    from protobuf_instance import ProtobufMap
-                    field_type = ProtobufMap
-                    field_type.definition = field.type
-                    field_value = field_type(field_value)
+                if map_type is not None:
+                    field_value = map_type(field_value)
                 else:
-                    field_value_dict = field.type.render(**field_value)
-                    field_value = self.definition.message_classes[field.type.name](**field_value_dict)
-
-            if isinstance(field_value, AnyMessage):
-                type_url_value = self.name
-                if self.definition.package:
-                    type_url_value = f'{self.definition.package}.{type_url_value}'
-                field_value.type_url = f'type.googleapis.com/{type_url_value}'
+                    field_value = self.definition.message_classes[field.type](**field_value)
 
-            if field.type == ProtobufType.BYTES and isinstance(field_value, str):
-                field_value = field_value.encode()
-
-            oneof = self.definition[self.name].definition.oneof_fields.get(field_name)
-            if oneof:
-                oneof_fields = self.definition[self.name].definition.oneofs[oneof]
-                for oneof_field in oneof_fields:
-                    if message_instance.get(oneof_field.name):
-                        del message_instance[oneof_field.name]
+            for oneof_sibling in oneof_siblings:
+                if message_instance.get(oneof_sibling):
+                    del message_instance[oneof_sibling]
 
             message_instance[field_name] = field_value
         return message_instance
 
     def get_fully_qualified_name(self):
-        return f'{self.definition.package}.{self.name}'
+        return '.'.join(part for part in (self.definition.package, self.scope, self.name) if part)
+
+    def __getstate__(self):
+        # The render plan and decoder definition are built again when they are first used after loading.
+        state = self.__dict__.copy()
+        state['_render_plan'] = None
+        state['_decoder_definition'] = None
+        return state
 
     def get_default_value(self, field: ProtobufField):
         if field.options.get('default'):
@@ -163,7 +226,10 @@ class ProtobufMessageDefinition:
 
         if field.type in default_value_table:
             return default_value_table[field.type]
-        return self.definition.message_classes[field.type.name]()
+        if isinstance(field.type, tuple):
+            render_plan = self._render_plan or self._get_render_plan()
+            return render_plan[field.name][4]()
+        return self.definition.message_classes[field.type]()
 
     def __repr__(self):
         opening_curly_brace = '{'
@@ -194,6 +260,65 @@ class ProtobufServiceDefinition:
         self.methods: dict[str, ProtobufMethodDefinition] = {}
 
 
+class ProtobufScope:
+    """
+    A node in the tree of the packages and messages of a definition, by the parts of their names.
+    References to messages and enums are resolved by walking the tree, like protoc resolves them.
+    """
+
+    def __init__(self):
+        self.children: dict[str, ProtobufScope] = {}
+        self.symbol: ProtobufMessageDefinition | ProtobufEnumDefinition | None = None
+
+    def add(self, path: list[str], symbol: ProtobufMessageDefinition | ProtobufEnumDefinition) -> None:
+        node = self
+        for part in path:
+            child = node.children.get(part)
+            if child is None:
+                child = node.children[part] = ProtobufScope()
+            node = child
+        node.symbol = symbol
+
+    def find(self, path: list[str]) -> 'ProtobufScope | None':
+        node = self
+        for part in path:
+            node = node.children.get(part)
+            if node is None:
+                return None
+        return node
+
+    def resolve(self, type_name: str, scope: list[str]) -> ProtobufMessageDefinition | ProtobufEnumDefinition | None:
+        """
+        Resolve a reference to a message or enum.
+        Names starting with a dot are fully-qualified, other names are searched from the innermost scope outwards.
+
+        :param type_name: The referenced name, like Nested, Outer.Nested or .package.Outer.Nested
+        :param scope: The parts of the package and the messages the reference is in.
+        :return: The message or enum, or None if the name can not be resolved.
+        """
+        if type_name.startswith('.'):
+            node = self.find(type_name[1:].split('.'))
+            return node.symbol if node else None
+
+        # The scopes the reference is in, from the outermost to the innermost.
+        scopes = [self]
+        for part in scope:
+            node = scopes[-1].children.get(part)
+            if node is None:
+                break
+            scopes.append(node)
+
+        first_part, *other_parts = type_name.split('.')
+        for node in reversed(scopes):
+            node = node.children.get(first_part)
+            if node is None:
+                continue
+            node = node.find(other_parts)
+            if node is not None and node.symbol is not None:
+                return node.symbol
+        return None
+
+
 class ProtobufDefinition:
 
     def __init__(self):
@@ -204,12 +329,11 @@ class ProtobufDefinition:
         self.package: str = None
 
         self.messages: dict[str, ProtobufMessageDefinition] = {}
-        from protobuf_instance import ProtobufMessageType
-        self.message_classes: dict[str, ProtobufMessageType] = {}
-
         self.enums: dict[str, ProtobufEnumDefinition] = {}
-        from protobuf_instance import ProtobufEnumType
-        self.enum_classes: dict[str, ProtobufEnumType] = {}
+
+        from protobuf_instance import ProtobufMessageClasses, ProtobufEnumClasses
+        self.message_classes = ProtobufMessageClasses(self)
+        self.enum_classes = ProtobufEnumClasses(self)
 
         self.comments: list[str] = []
 
@@ -218,36 +342,97 @@ class ProtobufDefinition:
         self.unknown_references = {}
         self.unknown_options = {}
 
+        # The scopes of the unknown references, the names of the messages the fields are in, separated by dots.
+        self.reference_scopes: dict[ProtobufField, str] = {}
+
+        # The messages and enums declared in the definition, including nested messages and enums with the same name.
+        self.declarations: list[ProtobufMessageDefinition | ProtobufEnumDefinition] = []
+
+        # The files this definition was parsed from, with the SHA-256 hash of their content.
+        self.dependencies: dict[str, str] = {}
+
+        # The imports of the definition, with whether they are public imports.
+        self.imports: list[tuple[str, bool]] = []
+
+        # Extensions of messages that are not known yet, because the imports were not loaded while parsing.
+        self.pending_extensions: dict[str, ProtobufMessageDefinition] = {}
+
+        # The index of the names of the messages and enums, built when it is first used.
+        self.symbols: dict[str, tuple[str, object]] | None = None
+
     def __repr__(self):
         return f'syntax = "{self.syntax}";\n\n' + '\n\n'.join([repr(message) for message in self.messages.values()])
 
+    def __getstate__(self):
+        # The importer and the message and enum classes are created at runtime, they are created again after loading.
+        state = self.__dict__.copy()
+        state['importer'] = None
+        state['message_classes'] = None
+        state['enum_classes'] = None
+        state['symbols'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+        from protobuf_instance import ProtobufMessageClasses, ProtobufEnumClasses
+        self.message_classes = ProtobufMessageClasses(self)
+        self.enum_classes = ProtobufEnumClasses(self)
+
+    def get_symbols(self) -> dict[str, tuple[str, object]]:
+        """
+        Get the index of the names that can be looked up in the definition.
+        Every name refers to the kind of the symbol and its key: ('message', key) for messages and parts of an import path,
+        ('enum', key) for enums and ('definition', '') for the parts of dotted message names, which refer to the definition
+        itself. The index contains the names of the messages and enums, and the names of the messages and enums declared
+        in the definition itself relative to the messages they are nested in, relative to the package and fully-qualified.
+        Those names are keyed by their declaration, so nested messages and enums with the same name can all be looked up.
+
+        :return: The symbols by name.
+        """
+        if self.symbols is None:
+            symbols = {}
+            for message_name in self.messages:
+                symbols[message_name] = ('message', message_name)
+            for message_name in self.messages:
+                if '.' in message_name:
+                    for part in message_name.split('.'):
+                        symbols.setdefault(part, ('definition', ''))
+            for enum_name in self.enums:
+                symbols.setdefault(enum_name, ('enum', enum_name))
+
+            for declaration in self.declarations:
+                kind = 'message' if isinstance(declaration, ProtobufMessageDefinition) else 'enum'
+                relative_name = f'{declaration.scope}.{declaration.name}' if declaration.scope else declaration.name
+                symbols.setdefault(relative_name, (kind, declaration))
+                if self.package:
+                    symbols.setdefault(f'{self.package}.{relative_name}', (kind, declaration))
+            self.symbols = symbols
+        return self.symbols
+
+    def _get_symbol_class(self, kind: str, key):
+        if kind == 'message':
+            return self.message_classes[key]
+        if kind == 'enum':
+            return self.enum_classes[key]
+        return self
+
     def __getattr__(self, item):
+        if item.startswith('__') or item == 'symbols':
+            raise AttributeError(item)
+
         if item == 'get':
             return self.__getitem__
 
-        message = self.messages.get(item)
-        if message:
-            return self.message_classes[item]
-
-        for message_name in self.messages:
-            if '.' in message_name:
-                parts = message_name.split('.')
-                for part in parts:
-                    if part == item:
-                        return self
-
-        enum = self.enums.get(item)
-        if enum:
-            return self.enum_classes[item]
+        symbol = self.get_symbols().get(item)
+        if symbol:
+            return self._get_symbol_class(*symbol)
 
         return ValueError(f'No message or enum with name {item}')
 
     def __getitem__(self, item):
-        message = self.messages.get(item)
-        if message:
-            return self.message_classes[item]
-        enum = self.enums.get(item)
-        if enum:
-            return self.enum_classes[item]
+        symbol = self.get_symbols().get(item)
+        if symbol and symbol[0] != 'definition':
+            return self._get_symbol_class(*symbol)
 
         return ValueError(f'No message or enum with name {item}')
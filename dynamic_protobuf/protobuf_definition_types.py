@@ -25,6 +25,9 @@ class ProtobufType(Enum):
     BYTES = 'bytes'
 
 
+# Marks the fields without a default value in the render plans of messages.
+no_default = object()
+
 default_value_table = {
     ProtobufType.FLOAT: 0.0,
     ProtobufType.INT32: 0,
@@ -1,5 +1,9 @@
+import hashlib
+from abc import ABCMeta, abstractmethod
+
 from dynamic_protobuf import WireType, encode, decode
-from protobuf_definition_types import protobuf_type_wire_type_table, ProtobufLabel
+from protobuf_definition_types import protobuf_type_wire_type_table, ProtobufLabel, no_default
+from protobuf_map import ProtobufMap
 
 
 class ProtobufEnumType(type):
@@ -37,42 +41,132 @@ class ProtobufMessageType(type):
             return self.definition.enums[item]
 
 
-class ProtobufMap:
-    definition = None
-
-    def __init__(self, dictionary):
-        self.dictionary = {}
-        for key, value in dictionary.items():
-            if isinstance(value, dict):
-                value_type = self.definition[1].definition.message_classes.get(self.definition[1].name)
-                value = value_type(**value)
-            self.dictionary[key] = value
-
-    def _get_proto_dict(self):
-        proto_dict = {}
-        for key, value in self.dictionary.items():
-            if isinstance(value, ProtobufMessage):
-                value = value._get_proto_dict()
-            proto_dict[key] = value
-        return proto_dict
-
-    def __repr__(self):
-        return repr(self.dictionary)
-
-    def __eq__(self, other):
-        return self.dictionary == other.dictionary
-
-    @classmethod
-    def _proto_dict_numbers_to_names(cls, proto_dict):
-        key_definition, value_definition = cls.definition
+class ProtobufClasses(dict, metaclass=ABCMeta):
+    """
+    The classes of a definition, by name. A class is created when it is first used, by the _create method of the
+    subclass.
+    """
+
+    def __init__(self, proto_definition):
+        # Dictionaries are created without the check for abstract methods, so it is done here.
+        if type(self).__abstractmethods__:
+            raise TypeError(f'Can\'t instantiate abstract class {type(self).__name__} without an implementation for '
+                            f'abstract methods {", ".join(sorted(type(self).__abstractmethods__))}')
+        super().__init__()
+        self.proto_definition = proto_definition
+
+    @abstractmethod
+    def _create(self, name: str):
+        """
+        Create the class of a name.
+
+        :param name: The name of the class.
+        :return: The class.
+        """
+
+    def __missing__(self, name: str):
+        # Threads that create the same class at the same time all get the class that was stored first.
+        return self.setdefault(name, self._create(name))
+
+    def __contains__(self, name) -> bool:
+        try:
+            self[name]
+        except KeyError:
+            return False
+        return True
 
-        proto_dict_with_names = {}
-        for key, value in proto_dict.items():
-            from protobuf_definition import ProtobufMessageDefinition
-            if isinstance(value_definition, ProtobufMessageDefinition):
-                value = value_definition.definition.message_classes[value_definition.name]._proto_dict_numbers_to_names(value)
-            proto_dict_with_names[key] = value
-        return proto_dict_with_names
+    def get(self, name: str, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+
+class ProtobufMessageClasses(ProtobufClasses):
+    """
+    The message classes of a definition, by name or by message definition. A class is created when it is first used.
+
+    The lookup table of the names is computed on first use as well. Parts of an import path (like google.protobuf)
+    are definitions themselves, the classes of their messages are also available by their name in the parent definition.
+
+    Nested messages with the same name are only available by the last one of their name, so references to messages
+    look up their classes by message definition: every message definition has one class.
+    """
+
+    def __init__(self, proto_definition):
+        super().__init__(proto_definition)
+        self._message_definitions: dict | None = None
+
+    def get_message_definitions(self) -> dict:
+        """
+        Get the lookup table of the classes: the definition of the message, the part itself for parts of an import path,
+        or the message classes of the part for the messages of a part.
+        """
+        if self._message_definitions is None:
+            from protobuf_definition import ProtobufDefinition
+
+            message_definitions = {}
+            for message_name, message_definition in self.proto_definition.messages.items():
+                if isinstance(message_definition, ProtobufDefinition):
+                    message_definitions[message_name] = message_definition
+                    for sub_message_name in message_definition.message_classes.get_message_definitions():
+                        message_definitions[sub_message_name] = message_definition.message_classes
+                else:
+                    message_definitions[message_name] = message_definition
+            self._message_definitions = message_definitions
+        return self._message_definitions
+
+    def _get_declaring_classes(self, message_definition) -> 'ProtobufMessageClasses | None':
+        # Imported messages have the class of the definition they are declared in, so all definitions that import
+        # them share it. Extended copies of imported messages are not declared there and get a class of their own.
+        owner = message_definition.definition
+        if owner is not self.proto_definition and \
+                any(declaration is message_definition for declaration in owner.declarations):
+            return owner.message_classes
+        return None
+
+    def _create(self, name):
+        from protobuf_definition import ProtobufDefinition, ProtobufMessageDefinition
+
+        if isinstance(name, ProtobufMessageDefinition):
+            declaring_classes = self._get_declaring_classes(name)
+            if declaring_classes is not None:
+                return declaring_classes[name]
+
+            # The class of the name is used when the name refers to the message definition, otherwise the message is
+            # hidden by another message with the same name and gets a class of its own.
+            message_class = self.get(name.name)
+            if isinstance(message_class, ProtobufMessageType) and message_class.definition is name:
+                return message_class
+            return ProtobufMessageType(name.name, message_definition=name)
+
+        message_definition = self.get_message_definitions()[name]
+        if isinstance(message_definition, ProtobufMessageClasses):
+            return message_definition[name]
+        if isinstance(message_definition, ProtobufDefinition):
+            return message_definition
+        declaring_classes = self._get_declaring_classes(message_definition)
+        if declaring_classes is not None:
+            return declaring_classes[message_definition]
+        return ProtobufMessageType(name, message_definition=message_definition)
+
+
+class ProtobufEnumClasses(ProtobufClasses):
+    """
+    The enum classes of a definition, by name or by enum definition. A class is created when it is first used.
+    """
+
+    def _create(self, name):
+        from protobuf_definition import ProtobufEnumDefinition
+
+        if isinstance(name, ProtobufEnumDefinition):
+            # Like message classes, an enum hidden by another enum with the same name gets a class of its own.
+            enum_class = self.get(name.name)
+            if enum_class is not None and enum_class.definition is name:
+                return enum_class
+            return ProtobufEnumType(name.name, enum_definition=name)
+
+        return ProtobufEnumType(name, enum_definition=self.proto_definition.enums[name])
 
 
 class ProtobufEnum:
@@ -105,9 +199,9 @@ class ProtobufMessage:
     def __init__(self, **kwargs):
         self.__dict__.update(self.definition.render(**kwargs))
 
-    def _get_proto_dict(self):
+    def _get_proto_dict(self, deterministic: bool = False):
         proto_dict = {}
-        message_definition = self.definition.definition.messages.get(self.definition.name)
+        message_definition = self.definition
         for field_number, field in self.definition.fields_by_number.items():
             field_value = getattr(self, field.name, None)
             if field_value and isinstance(field_value, ProtobufMessage):
@@ -128,14 +222,15 @@ class ProtobufMessage:
                 field_wire_type = WireType.LENGTH_DELIMITED
 
             if not field_value:
-                if field.label == ProtobufLabel.REQUIRED:
+                # Empty maps are not encoded, like empty repeated fields.
+                if field.label == ProtobufLabel.REQUIRED and not isinstance(field.type, tuple):
                     default_value = message_definition.get_default_value(field)
                     proto_dict[field_number] = (field_wire_type, default_value)
 
                 continue
 
             if isinstance(field_value, ProtobufMessage) or isinstance(field_value, ProtobufMap):
-                field_value = field_value._get_proto_dict()
+                field_value = field_value._get_proto_dict(deterministic)
 
             if field.options.get('packed'):
                 proto_dict[field_number] = (field_wire_type, (original_wire_type, field_value))
@@ -143,47 +238,127 @@ class ProtobufMessage:
                 proto_dict[field_number] = (field_wire_type, field_value)
         return proto_dict
 
-    def encode(self):
-        proto_dict = self._get_proto_dict()
-        return encode(proto_dict, determine_wire_types=True)
+    def encode(self, deterministic: bool = False) -> bytes:
+        """
+        Encode the message.
+
+        :param deterministic: Whether to encode the fields in the order of their field numbers and the entries of maps
+            in the order of their keys, so equal messages are always encoded to the same bytes.
+        :return: The encoded message.
+        """
+        proto_dict = self._get_proto_dict(deterministic)
+        return encode(proto_dict, determine_wire_types=True, deterministic=deterministic)
+
+    def fingerprint(self) -> bytes:
+        """
+        Get a hash of the deterministic encoding of the message, equal messages have the same fingerprint.
+
+        :return: The 16 byte BLAKE2b digest.
+        """
+        return hashlib.blake2b(self.encode(deterministic=True), digest_size=16).digest()
+
+    def freeze(self, encoding_cache: 'EncodingCache | None' = None) -> 'FrozenProtobufMessage':
+        """
+        Get a copy of the message that can not be changed, which encodes itself only once.
+        Sub-messages, maps and repeated fields are frozen as well.
+
+        :param encoding_cache: A cache of frozen messages. If it contains an equal message, that message is returned,
+            so equal messages share their encoding.
+        :return: The frozen message.
+        """
+        frozen_class = type(self).__dict__.get('_frozen_class')
+        if frozen_class is None:
+            frozen_class = type.__new__(type(type(self)), type(self).__name__, (FrozenProtobufMessage, type(self)), {})
+            type(self)._frozen_class = frozen_class
+
+        frozen_message = frozen_class.__new__(frozen_class)
+        for field_name, field_value in self.__dict__.items():
+            frozen_message.__dict__[field_name] = freeze_value(field_value)
+        object.__setattr__(frozen_message, '_encodings', {})
+        object.__setattr__(frozen_message, '_hash', None)
+
+        if encoding_cache is not None:
+            return encoding_cache.get(frozen_message)
+        return frozen_message
 
     @classmethod
     def _proto_dict_numbers_to_names(cls, proto_dict):
-        numbers_to_names = {field.number: field.name for field in cls.definition.fields_by_number.values()}
+        fields_by_number = cls.definition.fields_by_number
+        render_plan = cls.definition._render_plan or cls.definition._get_render_plan()
         proto_dict_with_names = {}
-        fully_qualified_name = cls.definition.get_fully_qualified_name()
         for field_number, field_value in proto_dict.items():
-            field_name = numbers_to_names[field_number]
-            if isinstance(field_value, dict):
-                if isinstance(cls.definition.fields_by_name[field_name].type, tuple):
-                    map_type = ProtobufMap
-                    map_type.definition = cls.definition.fields_by_name[field_name].type
-                    field_value = ProtobufMap._proto_dict_numbers_to_names(field_value)
-                else:
-                    if fully_qualified_name != 'google.protobuf.Any':
-                        # Stop recursion for AnyMessage as these values are processed later
-                        field_type = cls.definition.fields_by_name[field_name].type.name
-                        field_value = cls.definition.definition.message_classes[field_type]._proto_dict_numbers_to_names(field_value)
-
-            if fully_qualified_name == 'google.protobuf.Any' and field_name == 'value':
-                from constants import PACKING_BACKEND
-                if PACKING_BACKEND == 'pickle':
-                    from any import AnyMessage
-
-                    # Convert hex to bytes
-                    for map_entry in field_value[1]:
-                        map_entry[2] = bytes.fromhex(map_entry[2])
-                    # # re-pack the value
-                    field_value = AnyMessage.pack(field_value).value
+            field = fields_by_number[field_number]
+            field_name = field.name
+            _, _, is_bytes, _, map_type, _ = render_plan[field_name]
+            if map_type is not None:
+                field_value = map_type._proto_dict_numbers_to_names(field_value)
+            elif isinstance(field_value, dict) and not is_bytes:
+                field_type = cls.definition.definition.message_classes[field.type]
+                field_value = field_type._proto_dict_numbers_to_names(field_value)
 
             proto_dict_with_names[field_name] = field_value
         return proto_dict_with_names
 
     @classmethod
-    def decode(cls, byte_blob: bytes, definition: dict | None = None):
+    def _from_proto_dict(cls, proto_dict):
+        """
+        Build a message from a decoded proto dict, with the same result as rendering the values by field name,
+        but without converting the proto dict to keyword arguments first. Nested messages are built the same way.
+        """
+        message_definition = cls.definition
+        render_plan = message_definition._render_plan or message_definition._get_render_plan()
+        fields_by_number = message_definition.fields_by_number
+
+        field_numbers = proto_dict
+        if message_definition.oneofs:
+            # Like render, the fields are set in the order they are declared, so the last field of a oneof wins.
+            field_numbers = sorted(proto_dict, key=lambda number: render_plan[fields_by_number[number].name][0])
+
+        message = cls.__new__(cls)
+        message_instance = message.__dict__
+        for field_number in field_numbers:
+            field = fields_by_number[field_number]
+            field_name = field.name
+            _, _, encode_string, default_value, map_type, oneof_siblings = render_plan[field_name]
+            field_value = proto_dict[field_number]
+
+            if map_type is not None:
+                field_value = map_type._from_decoded(field_value)
+            elif isinstance(field_value, dict) and not encode_string:
+                field_type = message_definition.definition.message_classes[field.type]
+                field_value = field_type._from_proto_dict(field_value)
+            else:
+                if encode_string and isinstance(field_value, str):
+                    field_value = field_value.encode()
+
+                if default_value is not no_default and field_value == default_value:
+                    continue
+
+            for oneof_sibling in oneof_siblings:
+                if message_instance.get(oneof_sibling):
+                    del message_instance[oneof_sibling]
+
+            message_instance[field_name] = field_value
+        return message
+
+    @classmethod
+    def decode(cls, byte_blob: bytes, definition: dict | None = None, decode_cache: 'DecodeCache | None' = None):
+        """
+        Decode a message.
+
+        :param byte_blob: The encoded message.
+        :param definition: The decoder definition, by default the decoder definition of the message.
+        :param decode_cache: A cache of decoded messages. With a cache, the message is frozen, and messages decoded
+            from the same bytes before are returned from the cache.
+        :return: The message.
+        """
+        if decode_cache is not None:
+            return decode_cache.decode(cls, byte_blob)
+
+        if definition is None:
+            definition = cls.definition.get_decoder_definition()
         proto_dict = decode(byte_blob, definition)
-        proto_dict_with_names = cls._proto_dict_numbers_to_names(proto_dict)
-        return cls(**proto_dict_with_names)
+        return cls._from_proto_dict(proto_dict)
 
     def __repr__(self):
         representation = {}
@@ -215,4 +390,79 @@ class ProtobufMessage:
         if self.__dict__.get(item):
             return self.__dict__[item]
 
-        return self.definition.get_default_value(self.definition.fields_by_name[item])
\ No newline at end of file
+        return self.definition.get_default_value(self.definition.fields_by_name[item])
+
+class FrozenList(list):
+    """
+    The value of a repeated field of a frozen message. The list can not be changed, and can be hashed.
+    """
+
+    def _raise_frozen(self, *args, **kwargs):
+        raise Exception('Repeated field is frozen and can not be changed')
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _raise_frozen
+    append = extend = insert = pop = remove = clear = sort = reverse = _raise_frozen
+
+    def __hash__(self):
+        return hash(tuple(self))
+
+
+class FrozenProtobufMessage(ProtobufMessage):
+    """
+    A message that can not be changed, created by ProtobufMessage.freeze.
+
+    The encodings and the fingerprint are computed once, and frozen sub-messages are encoded with their own cached
+    encoding. Frozen messages can be hashed, so they can be used as dictionary keys.
+    """
+
+    __slots__ = ('_encodings', '_hash')
+
+    def __setattr__(self, name, value):
+        raise Exception(f'Message {type(self).__name__} is frozen and can not be changed')
+
+    def __delattr__(self, name):
+        raise Exception(f'Message {type(self).__name__} is frozen and can not be changed')
+
+    def _get_proto_dict(self, deterministic: bool = False):
+        # The encoding is used as the value of the field in the message this message is a sub-message of.
+        return self.encode(deterministic)
+
+    def encode(self, deterministic: bool = False) -> bytes:
+        encoded_message = self._encodings.get(deterministic)
+        if encoded_message is None:
+            proto_dict = super()._get_proto_dict(deterministic)
+            encoded_message = self._encodings[deterministic] = encode(proto_dict, determine_wire_types=True,
+                                                                      deterministic=deterministic)
+        return encoded_message
+
+    def fingerprint(self) -> bytes:
+        fingerprint = self._encodings.get('fingerprint')
+        if fingerprint is None:
+            fingerprint = self._encodings['fingerprint'] = super().fingerprint()
+        return fingerprint
+
+    def freeze(self, encoding_cache: 'EncodingCache | None' = None) -> 'FrozenProtobufMessage':
+        if encoding_cache is not None:
+            return encoding_cache.get(self)
+        return self
+
+    def __hash__(self):
+        # Unset fields and fields without a value are left out, like when encoding, so equal messages have equal hashes.
+        if self._hash is None:
+            object.__setattr__(self, '_hash', hash((self.definition.get_fully_qualified_name(), tuple(sorted(
+                (field_name, field_value) for field_name, field_value in self.__dict__.items() if field_value)))))
+        return self._hash
+
+
+def freeze_value(field_value):
+    """
+    Get the frozen value of a field: frozen messages and maps, repeated fields as frozen lists.
+
+    :param field_value: The value of the field.
+    :return: The frozen value.
+    """
+    if isinstance(field_value, (ProtobufMessage, ProtobufMap)):
+        return field_value.freeze()
+    if isinstance(field_value, list):
+        return FrozenList(freeze_value(value) for value in field_value)
+    return field_value
@@ -0,0 +1,245 @@
+import struct
+from functools import partial
+from operator import itemgetter
+from typing import Callable
+
+from dynamic_protobuf import WireType
+from decoder import _parse_32_bit, _parse_64_bit
+from encoder import _encode_varint
+from protobuf_definition_types import ProtobufType, protobuf_type_wire_type_table, default_value_table
+
+# The codec of the key or value of a map entry: the tag of the entry field, the function that encodes a value
+# (including the length of length delimited values), the function that decodes a value from an entry at an index
+# and the value of an entry without the field.
+MapEntryCodec = tuple[int, Callable[[object], bytes], Callable[[bytes, int], tuple[object, int]], Callable[[], object]]
+
+
+def _encode_length(length: int) -> bytes:
+    return bytes((length,)) if length < 0x80 else bytes(_encode_varint(length))
+
+
+def _encode_varint_value(value: int | bool) -> bytes:
+    value = int(value)
+    if 0 <= value < 0x80:
+        return bytes((value,))
+    return bytes(_encode_varint(value))
+
+
+def _encode_32_bit(value: float) -> bytes:
+    return struct.pack('f', value)
+
+
+def _encode_64_bit(value: float) -> bytes:
+    return struct.pack('d', value)
+
+
+def _encode_string(value: str | bytes) -> bytes:
+    if isinstance(value, str):
+        value = value.encode('utf-8')
+    return _encode_length(len(value)) + value
+
+
+def _decode_varint(entry: bytes, index: int) -> tuple[int, int]:
+    value = 0
+    shift = 0
+    while True:
+        byte = entry[index]
+        index += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, index
+        shift += 7
+
+
+def _decode_bytes(entry: bytes, index: int) -> tuple[bytes, int]:
+    length, index = _decode_varint(entry, index)
+    return entry[index:index + length], index + length
+
+
+def _decode_string(entry: bytes, index: int) -> tuple[str, int]:
+    value, index = _decode_bytes(entry, index)
+    return value.decode('utf-8'), index
+
+
+def _decode_bool(entry: bytes, index: int) -> tuple[bool, int]:
+    value, index = _decode_varint(entry, index)
+    return bool(value), index
+
+
+def _get_entry_codec(field_number: int, field_type) -> MapEntryCodec:
+    from protobuf_definition import ProtobufEnumDefinition, ProtobufMessageDefinition
+
+    if isinstance(field_type, ProtobufMessageDefinition):
+        def get_message_class():
+            return field_type.definition.message_classes[field_type]
+
+        def encode_message(value, deterministic: bool = False) -> bytes:
+            if isinstance(value, dict):
+                value = get_message_class()(**value)
+            return _encode_string(value.encode(deterministic))
+
+        def decode_message(entry: bytes, index: int):
+            value, index = _decode_bytes(entry, index)
+            return get_message_class().decode(value), index
+
+        return (field_number << 3 | WireType.LENGTH_DELIMITED.value, encode_message, decode_message,
+                lambda: get_message_class()())
+
+    if isinstance(field_type, ProtobufEnumDefinition):
+        return field_number << 3 | WireType.VARINT.value, _encode_varint_value, _decode_varint, lambda: 0
+
+    wire_type = protobuf_type_wire_type_table[field_type]
+    default_value = default_value_table[field_type]
+    if field_type == ProtobufType.STRING:
+        encode_value, decode_value = _encode_string, _decode_string
+    elif field_type == ProtobufType.BYTES:
+        encode_value, decode_value = _encode_string, _decode_bytes
+    elif field_type == ProtobufType.BOOL:
+        encode_value, decode_value = _encode_varint_value, _decode_bool
+    elif wire_type == WireType.FIXED32:
+        encode_value, decode_value = _encode_32_bit, lambda entry, index: _parse_32_bit(entry, index, None)
+    elif wire_type == WireType.FIXED64:
+        encode_value, decode_value = _encode_64_bit, lambda entry, index: _parse_64_bit(entry, index, None)
+    else:
+        encode_value, decode_value = _encode_varint_value, _decode_varint
+    return field_number << 3 | wire_type.value, encode_value, decode_value, lambda: default_value
+
+
+class ProtobufMap(dict):
+    """
+    The value of a map field. The entries are stored in the map itself.
+
+    Every map field has its own subclass, created by create_map_type, with the codecs of its key and value type.
+    Entries are encoded as key/value messages with the key as field 1 and the value as field 2, like the standard
+    Protobuf encoding of maps, and are decoded directly with the codecs.
+    """
+
+    definition = None
+    key_codec: MapEntryCodec = None
+    value_codec: MapEntryCodec = None
+    message_values = False
+
+    def __init__(self, dictionary: dict | None = None):
+        super().__init__()
+        if not dictionary:
+            return
+
+        value_definition = self.definition[1]
+        for key, value in dictionary.items():
+            if isinstance(value, dict):
+                value = value_definition.definition.message_classes[value_definition](**value)
+            self[key] = value
+
+    @property
+    def dictionary(self) -> dict:
+        return self
+
+    def _get_proto_dict(self, deterministic: bool = False) -> list[bytes]:
+        # The entries are encoded as a repeated length delimited field.
+        key_tag, encode_key, _, _ = self.key_codec
+        value_tag, encode_value, _, _ = self.value_codec
+        key_tag, value_tag = bytes((key_tag,)), bytes((value_tag,))
+        items = self.items()
+        if deterministic:
+            # The entries are ordered by key, message values are encoded deterministically as well.
+            items = sorted(items, key=itemgetter(0))
+            if self.message_values:
+                encode_value = partial(encode_value, deterministic=True)
+        return [b''.join((key_tag, encode_key(key), value_tag, encode_value(value))) for key, value in items]
+
+    @classmethod
+    def _from_decoded(cls, decoded_value) -> 'ProtobufMap':
+        """
+        Build a map from the decoded value of the field: the raw entries when the message was decoded with the
+        definition of the map, or the entries as decoded without it.
+        """
+        if not isinstance(decoded_value, list):
+            decoded_value = [decoded_value]
+
+        key_tag, _, decode_key, get_key_default = cls.key_codec
+        value_tag, _, decode_value, get_value_default = cls.value_codec
+
+        map_instance = cls()
+        no_value = object()
+        for entry in decoded_value:
+            if isinstance(entry, bytes):
+                key = value = no_value
+                index = 0
+                entry_length = len(entry)
+                while index < entry_length:
+                    tag = entry[index]
+                    if tag == key_tag:
+                        key, index = decode_key(entry, index + 1)
+                    elif tag == value_tag:
+                        value, index = decode_value(entry, index + 1)
+                    else:
+                        raise Exception(f'Unexpected tag {tag} in map entry of {cls.__name__}')
+            else:
+                key = entry.get(1, no_value)
+                value = entry.get(2, no_value)
+                if isinstance(value, dict):
+                    value_definition = cls.definition[1]
+                    value = value_definition.definition.message_classes[value_definition]._from_proto_dict(value)
+
+            if key is no_value:
+                key = get_key_default()
+            if value is no_value:
+                value = get_value_default()
+            dict.__setitem__(map_instance, key, value)
+        return map_instance
+
+    @classmethod
+    def _proto_dict_numbers_to_names(cls, decoded_value) -> 'ProtobufMap':
+        return cls._from_decoded(decoded_value)
+
+    def freeze(self) -> 'FrozenProtobufMap':
+        """
+        Get a copy of the map that can not be changed, with frozen message values.
+
+        :return: The frozen map.
+        """
+        from protobuf_instance import freeze_value
+
+        frozen_type = type(self).__dict__.get('_frozen_type')
+        if frozen_type is None:
+            frozen_type = type(self)._frozen_type = type(type(self).__name__, (FrozenProtobufMap, type(self)), {})
+
+        frozen_map = frozen_type()
+        dict.update(frozen_map, ((key, freeze_value(value)) for key, value in self.items()))
+        return frozen_map
+
+
+class FrozenProtobufMap(ProtobufMap):
+    """
+    The value of a map field of a frozen message. The map can not be changed, and can be hashed.
+    """
+
+    def _raise_frozen(self, *args, **kwargs):
+        raise Exception(f'Map {type(self).__name__} is frozen and can not be changed')
+
+    __setitem__ = __delitem__ = __ior__ = _raise_frozen
+    clear = pop = popitem = setdefault = update = _raise_frozen
+
+    def __hash__(self):
+        return hash(frozenset(self.items()))
+
+    def freeze(self) -> 'FrozenProtobufMap':
+        return self
+
+
+def create_map_type(field) -> type[ProtobufMap]:
+    """
+    Create the map type of a map field, with the codecs of its key and value type.
+
+    :param field: The map field.
+    :return: The subclass of ProtobufMap for the field.
+    """
+    from protobuf_definition import ProtobufMessageDefinition
+
+    key_type, value_type = field.type
+    return type(f'{field.name}_map', (ProtobufMap,), {
+        'definition': field.type,
+        'key_codec': _get_entry_codec(1, key_type),
+        'value_codec': _get_entry_codec(2, value_type),
+        'message_values': isinstance(value_type, ProtobufMessageDefinition),
+    })
@@ -0,0 +1,107 @@
+import hashlib
+import os
+import threading
+
+from parser import parse
+from protobuf_definition import ProtobufDefinition
+
+# A registry entry is keyed by the hash of the source, the imports path and whether the definition is imported.
+RegistryKey = tuple[str, str | None, bool]
+
+
+class SchemaRegistry:
+    """
+    An in-process registry of parsed definitions, so the same source is only parsed once.
+
+    Definitions are keyed by a hash of their source and the imports path. Imports are parsed through the registry as
+    well, so a file imported by multiple definitions is parsed once and its messages are shared between them.
+    Entries stay in the registry until they are evicted.
+    """
+
+    def __init__(self):
+        self._definitions: dict[RegistryKey, ProtobufDefinition] = {}
+        self._files: dict[str, RegistryKey] = {}
+
+        # Reentrant, because imports are parsed through the registry while the importing definition is being parsed.
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _get_key(definition: str, imports_path: str | None, import_level: int) -> RegistryKey:
+        # Only definitions that are not imported load their non-public imports, all imported definitions are parsed the
+        # same, so a file imported at different import levels is parsed once.
+        content_hash = hashlib.sha256(definition.encode('utf-8')).hexdigest()
+        return content_hash, os.path.abspath(imports_path) if imports_path else None, import_level > 0
+
+    def parse(self, definition: str, imports_path: str | None = None, import_level: int = 0) -> ProtobufDefinition:
+        """
+        Parse a definition, or return the registered definition if the same source was parsed before.
+
+        :param definition: The source of the definition.
+        :param imports_path: The path to resolve imports from.
+        :param import_level: The import level of the definition, 0 for definitions that are not imported.
+        :return: The parsed definition.
+        """
+        key = self._get_key(definition, imports_path, import_level)
+        with self._lock:
+            proto_definition = self._definitions.get(key)
+            if proto_definition is None:
+                proto_definition = parse(definition, imports_path, import_level, registry=self)
+                self._definitions[key] = proto_definition
+            return proto_definition
+
+    def parse_file(self, path: str, imports_path: str | None = None) -> ProtobufDefinition:
+        """
+        Parse a .proto file, or return the registered definition if the file did not change since it was parsed.
+
+        :param path: The path of the .proto file.
+        :param imports_path: The path to resolve imports from, the directory of the file if not given.
+        :return: The parsed definition.
+        """
+        with open(path, encoding='utf-8') as file:
+            definition = file.read()
+
+        if imports_path is None:
+            imports_path = os.path.dirname(os.path.abspath(path))
+
+        with self._lock:
+            proto_definition = self.parse(definition, imports_path)
+            self._files[os.path.abspath(path)] = self._get_key(definition, imports_path, 0)
+            return proto_definition
+
+    def evict(self, definition: str, imports_path: str | None = None, import_level: int = 0) -> bool:
+        """
+        Remove a definition from the registry, so it is parsed again the next time.
+        Definitions it imported stay registered, they may be shared with other definitions.
+
+        :param definition: The source of the definition.
+        :param imports_path: The path imports were resolved from.
+        :param import_level: The import level of the definition.
+        :return: True if the definition was registered.
+        """
+        key = self._get_key(definition, imports_path, import_level)
+        with self._lock:
+            return self._definitions.pop(key, None) is not None
+
+    def evict_file(self, path: str) -> bool:
+        """
+        Remove the definition parsed from a .proto file from the registry.
+
+        :param path: The path of the .proto file.
+        :return: True if the file was registered.
+        """
+        with self._lock:
+            key = self._files.pop(os.path.abspath(path), None)
+            if key is None:
+                return False
+            return self._definitions.pop(key, None) is not None
+
+    def clear(self) -> None:
+        """
+        Remove all definitions from the registry.
+        """
+        with self._lock:
+            self._definitions.clear()
+            self._files.clear()
+
+    def __len__(self) -> int:
+        return len(self._definitions)
@@ -0,0 +1,177 @@
+import hashlib
+import os
+import tempfile
+from abc import ABC, abstractmethod
+
+# A resolved import is the location of the imported file, its content and the SHA-256 hash of the content.
+ResolvedImport = tuple[str, bytes, str]
+
+# Separates the path of an archive from the path of a file in the archive, in the location of a resolved import.
+archive_separator = '!/'
+
+# The well-known types of google/protobuf that are shipped with the package.
+bundled_imports_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'well_known_types')
+
+default_remote_url = 'https://raw.githubusercontent.com/protocolbuffers/protobuf/master/src/'
+
+
+class ImportResolver(ABC):
+    """
+    Resolves an import to the content of the imported file.
+    Importers try their resolvers in order, until one of them resolves the import.
+
+    The key identifies the files a resolver resolves to,
+    imported definitions are only shared between importers with the same resolvers.
+    """
+
+    key: str = None
+
+    @abstractmethod
+    def resolve(self, importable: str, import_cache: 'ImportCache') -> ResolvedImport | None:
+        """
+        Resolve an import.
+
+        :param importable: The import, like google/protobuf/timestamp.proto
+        :param import_cache: The import cache to read files through.
+        :return: The location, content and hash of the imported file, or None if the resolver can not resolve it.
+        """
+
+
+class DirectoryResolver(ImportResolver):
+    """
+    Resolves imports relative to a directory.
+    """
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        self.key = f'directory:{self.root}'
+
+    def resolve(self, importable: str, import_cache: 'ImportCache') -> ResolvedImport | None:
+        path = os.path.join(self.root, importable)
+        try:
+            file_content, content_hash = import_cache.read_file(path)
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        return path, file_content, content_hash
+
+
+class ArchiveResolver(ImportResolver):
+    """
+    Resolves imports relative to a directory in a zip or tar archive.
+    The archive is read once, and again when it changes.
+    """
+
+    def __init__(self, archive_path: str, root: str = ''):
+        self.archive_path = os.path.abspath(archive_path)
+        self.root = root.strip('/')
+        self.key = f'archive:{self.archive_path}{archive_separator}{self.root}'
+
+    def resolve(self, importable: str, import_cache: 'ImportCache') -> ResolvedImport | None:
+        member = f'{self.root}/{importable}' if self.root else importable
+        cached_file = import_cache.read_archive(self.archive_path).get(member)
+        if cached_file is None:
+            return None
+        file_content, content_hash = cached_file
+        return f'{self.archive_path}{archive_separator}{member}', file_content, content_hash
+
+
+class RemoteResolver(ImportResolver):
+    """
+    Resolves imports relative to a URL, by default the Github Protobuf repository.
+
+    Retrieved files are kept in the import cache. If a cache directory is given, they are also stored on disk,
+    keyed by the URL and validated by the hash of their content, so they are only retrieved once.
+    With PY_DYNAMIC_PROTOBUF_OFFLINE set, files that are not in the cache directory raise an error instead.
+    """
+
+    def __init__(self, base_url: str = default_remote_url, cache_dir: str | None = None):
+        self.base_url = base_url if base_url.endswith('/') else f'{base_url}/'
+        self.cache_dir = cache_dir
+        self.key = f'remote:{self.base_url}'
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _get_cache_path(self, url: str) -> str:
+        return os.path.join(self.cache_dir, hashlib.sha256(url.encode('utf-8')).hexdigest())
+
+    def _read_cached_file(self, url: str) -> bytes | None:
+        cache_path = self._get_cache_path(url)
+        try:
+            with open(f'{cache_path}.proto', 'rb') as cached_file:
+                file_content = cached_file.read()
+            with open(f'{cache_path}.sha256') as hash_file:
+                content_hash = hash_file.read().strip()
+        except FileNotFoundError:
+            return None
+
+        if hashlib.sha256(file_content).hexdigest() != content_hash:
+            print(f'Warning: Cached file {cache_path}.proto for {url} is corrupt, retrieving it again.')
+            return None
+        return file_content
+
+    def _write_cached_file(self, url: str, file_content: bytes, content_hash: str) -> None:
+        cache_path = self._get_cache_path(url)
+        for suffix, content in (('.proto', file_content), ('.sha256', content_hash.encode('utf-8'))):
+            # Write to a temporary file first, so other processes never read a partially written file.
+            file_descriptor, temporary_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            try:
+                with os.fdopen(file_descriptor, 'wb') as temporary_file:
+                    temporary_file.write(content)
+                os.replace(temporary_path, f'{cache_path}{suffix}')
+            except BaseException:
+                os.unlink(temporary_path)
+                raise
+
+    def resolve(self, importable: str, import_cache: 'ImportCache') -> ResolvedImport | None:
+        url = f'{self.base_url}{importable}'
+        cached_file = import_cache.get_remote_file(url)
+
+        if cached_file is None and self.cache_dir:
+            file_content = self._read_cached_file(url)
+            if file_content is not None:
+                cached_file = import_cache.add_remote_file(url, file_content)
+
+        if cached_file is None:
+            from constants import OFFLINE
+            if OFFLINE:
+                raise Exception(f'Could not find import {importable} locally, '
+                                f'remote imports are disabled by PY_DYNAMIC_PROTOBUF_OFFLINE')
+
+            import urllib.error
+            import urllib.request
+
+            print('WARNING: Remote imports are very slow, '
+                  'consider downloading the protobuf files locally and set the imports_path variable.')
+
+            try:
+                file_content = urllib.request.urlopen(url).read()
+            except urllib.error.HTTPError as error:
+                if error.code == 404:
+                    return None
+                raise
+
+            cached_file = import_cache.add_remote_file(url, file_content)
+            if self.cache_dir:
+                self._write_cached_file(url, *cached_file)
+
+        file_content, content_hash = cached_file
+        return url, file_content, content_hash
+
+
+def get_default_resolvers(import_path: str | None) -> list[ImportResolver]:
+    """
+    Get the resolvers used when no resolvers are given: the imports path, which can be a directory or an archive,
+    the bundled well-known types and the Github Protobuf repository.
+
+    :param import_path: The path to resolve imports from.
+    :return: The resolvers, in the order they are tried.
+    """
+    resolvers = []
+    if import_path:
+        if os.path.isfile(import_path):
+            resolvers.append(ArchiveResolver(import_path))
+        else:
+            resolvers.append(DirectoryResolver(import_path))
+    resolvers.append(DirectoryResolver(bundled_imports_path))
+    resolvers.append(RemoteResolver())
+    return resolvers
@@ -0,0 +1,120 @@
+import hashlib
+import os
+import pickle
+import tempfile
+
+from imports import default_import_cache
+from parser import parse
+from protobuf_definition import ProtobufDefinition
+from type_registry import default_type_registry
+
+# Increase when the compiled representation changes, so existing cache entries are no longer used.
+SCHEMA_CACHE_VERSION = 5
+
+
+def dump_definition(proto_definition: ProtobufDefinition) -> bytes:
+    """
+    Serialize a parsed definition to its compiled representation.
+    The compiled representation holds the messages, fields, enums, options and services of the definition and of
+    all its imports, with all references resolved. Message and enum classes are not included,
+    they are created again when they are first used.
+
+    :param proto_definition: The parsed definition.
+    :return: The compiled representation.
+    """
+    return pickle.dumps(proto_definition, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_definition(compiled_definition: bytes) -> ProtobufDefinition:
+    """
+    Load a definition from its compiled representation.
+    Only load compiled representations from a trusted source, they are unpickled.
+
+    :param compiled_definition: The compiled representation, as returned by dump_definition.
+    :return: The definition, ready to use like the result of parse.
+    """
+    # The message and enum classes are created when they are first used.
+    proto_definition: ProtobufDefinition = pickle.loads(compiled_definition)
+    default_type_registry.add(proto_definition)
+    return proto_definition
+
+
+class SchemaCache:
+    """
+    A persistent cache of compiled definitions, so .proto files do not need to be parsed again on every start.
+
+    Entries are stored in the cache directory, keyed by a hash of the source and the imports path.
+    An entry is only used if the imported files it was parsed from have not changed since.
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _get_cache_path(self, definition: str, imports_path: str | None) -> str:
+        key = hashlib.sha256()
+        key.update(f'{SCHEMA_CACHE_VERSION}\0'.encode())
+        key.update(f'{os.path.abspath(imports_path) if imports_path else ""}\0'.encode())
+        key.update(definition.encode('utf-8'))
+        return os.path.join(self.cache_dir, f'{key.hexdigest()}.pickle')
+
+    def load(self, definition: str, imports_path: str | None = None) -> ProtobufDefinition | None:
+        """
+        Load a definition from the cache.
+
+        :param definition: The source of the definition.
+        :param imports_path: The path to resolve imports from.
+        :return: The cached definition, or None if it is not cached or the cached entry is outdated.
+        """
+        cache_path = self._get_cache_path(definition, imports_path)
+        try:
+            with open(cache_path, 'rb') as cache_file:
+                compiled_definition = cache_file.read()
+        except FileNotFoundError:
+            return None
+
+        try:
+            proto_definition = load_definition(compiled_definition)
+        except Exception as error:
+            print(f'Warning: Could not load cached definition {cache_path}, parsing it again: {error}')
+            return None
+
+        if not default_import_cache.dependencies_unchanged(proto_definition):
+            return None
+        return proto_definition
+
+    def store(self, definition: str, imports_path: str | None, proto_definition: ProtobufDefinition) -> None:
+        """
+        Store a parsed definition in the cache.
+
+        :param definition: The source of the definition.
+        :param imports_path: The path imports were resolved from.
+        :param proto_definition: The parsed definition.
+        """
+        cache_path = self._get_cache_path(definition, imports_path)
+
+        # Write to a temporary file first, so other processes never read a partially written entry.
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(file_descriptor, 'wb') as temporary_file:
+                temporary_file.write(dump_definition(proto_definition))
+            os.replace(temporary_path, cache_path)
+        except BaseException:
+            os.unlink(temporary_path)
+            raise
+
+    def parse(self, definition: str, imports_path: str | None = None) -> ProtobufDefinition:
+        """
+        Parse a definition, using the cache if the definition was parsed before.
+
+        :param definition: The source of the definition.
+        :param imports_path: The path to resolve imports from.
+        :return: The parsed definition.
+        """
+        proto_definition = self.load(definition, imports_path)
+        if proto_definition is not None:
+            return proto_definition
+
+        proto_definition = parse(definition, imports_path)
+        self.store(definition, imports_path, proto_definition)
+        return proto_definition
@@ -0,0 +1,260 @@
+import os
+from concurrent.futures import Executor, Future, FIRST_COMPLETED, wait
+
+from imports import ProtobufImporter, default_import_cache
+from parallel import default_executor
+from parser import parse_unlinked, link
+from protobuf_definition import ProtobufDefinition, ProtobufMessageDefinition
+from protobuf_instance import ProtobufMessageType
+
+
+def _sort_imports(parsed_files: dict[str, ProtobufDefinition]) -> list[str]:
+    # Depth first, so every file comes after the files it imports.
+    sorted_files = []
+    states: dict[str, bool] = {}
+
+    for importable in parsed_files:
+        if importable in states:
+            continue
+
+        states[importable] = False
+        stack = [(importable, iter(parsed_files[importable].imports))]
+        while stack:
+            current, imports = stack[-1]
+            for imported, _ in imports:
+                if imported not in parsed_files:
+                    continue
+                if imported not in states:
+                    states[imported] = False
+                    stack.append((imported, iter(parsed_files[imported].imports)))
+                    break
+                if not states[imported]:
+                    raise Exception(f'Import cycle between {current} and {imported}')
+            else:
+                states[current] = True
+                sorted_files.append(current)
+                stack.pop()
+    return sorted_files
+
+
+def _get_message_classes(proto_definition: ProtobufDefinition,
+                         message_classes: dict | None = None) -> dict:
+    if message_classes is None:
+        message_classes = {}
+    for message_class in proto_definition.message_classes.values():
+        if isinstance(message_class, ProtobufDefinition):
+            _get_message_classes(message_class, message_classes)
+        elif isinstance(message_class, ProtobufMessageType):
+            message_classes[message_class.definition] = message_class
+    return message_classes
+
+
+def _keep_message_classes(proto_definition: ProtobufDefinition, previous_message_classes: dict) -> None:
+    # Messages that are shared with the previous definition keep the classes that were created for them.
+    message_classes = proto_definition.message_classes
+    for message_name, message_definition in message_classes.get_message_definitions().items():
+        if isinstance(message_definition, ProtobufDefinition):
+            _keep_message_classes(message_definition, previous_message_classes)
+        elif isinstance(message_definition, ProtobufMessageDefinition) and \
+                message_definition in previous_message_classes:
+            message_classes[message_name] = previous_message_classes[message_definition]
+
+    # Nested messages hidden by other messages with the same name only have a class by their message definition.
+    for declaration in proto_definition.declarations:
+        if declaration in previous_message_classes:
+            dict.setdefault(message_classes, declaration, previous_message_classes[declaration])
+
+
+class SchemaSet(dict):
+    """
+    The definitions parsed by parse_files, by the paths of the given files.
+
+    The set keeps the definitions of all files it parsed, including the imported files, so it can be reloaded:
+    only the files that changed and the files importing them are parsed again.
+    """
+
+    def __init__(self, files: list[str], imports_path: str):
+        super().__init__()
+        self.files = list(files)
+        self.imports_path = imports_path
+
+        self._file_hashes: dict[str, tuple[str, str]] = {}
+        self._parsed_files: dict[str, ProtobufDefinition] = {}
+
+        # The messages a file exports to the files importing it: its own messages and those of its public imports.
+        self._exported_files: dict[str, ProtobufDefinition] = {}
+
+    def _parse(self, importables: list[str], executor: Executor | None) -> None:
+        submitted = set()
+        futures: dict[Future, str] = {}
+
+        def submit(importable: str) -> Future:
+            absolute_path = os.path.abspath(os.path.join(self.imports_path, importable))
+            file_content, content_hash = default_import_cache.read_file(absolute_path)
+            self._file_hashes[importable] = (absolute_path, content_hash)
+            submitted.add(importable)
+
+            if executor is None:
+                future = Future()
+                future.set_result(parse_unlinked(file_content.decode('utf-8')))
+            else:
+                future = executor.submit(parse_unlinked, file_content.decode('utf-8'))
+            futures[future] = importable
+            return future
+
+        for importable in importables:
+            if importable not in submitted:
+                submit(importable)
+
+        not_done = set(futures)
+        while not_done:
+            done, not_done = wait(not_done, return_when=FIRST_COMPLETED)
+            for future in done:
+                proto_definition = future.result()
+                self._parsed_files[futures[future]] = proto_definition
+
+                for imported, _ in proto_definition.imports:
+                    if imported in submitted or imported in self._parsed_files or \
+                            not os.path.isfile(os.path.join(self.imports_path, imported)):
+                        continue
+                    not_done.add(submit(imported))
+
+    def _link(self, previous_files: dict[str, ProtobufDefinition]) -> list[str]:
+        # Only the files that are not linked yet are linked, the other files keep their definitions.
+        linked_files = []
+        for importable in _sort_imports(self._parsed_files):
+            if importable in self._exported_files:
+                continue
+
+            proto_definition = self._parsed_files[importable]
+            absolute_path, content_hash = self._file_hashes[importable]
+
+            exported_definition = ProtobufDefinition()
+            exported_definition.messages = dict(proto_definition.messages)
+
+            proto_definition.dependencies[absolute_path] = content_hash
+            proto_definition.importer = ProtobufImporter(proto_definition, self.imports_path, 0)
+            exported_definition.importer = ProtobufImporter(exported_definition, self.imports_path, 1)
+            for imported, public_import in proto_definition.imports:
+                importers = [proto_definition.importer]
+                if public_import:
+                    importers.append(exported_definition.importer)
+
+                for importer in importers:
+                    if imported in self._exported_files:
+                        importer.add_imported_definition(imported, self._exported_files[imported])
+                    else:
+                        importer.load_import(imported, public_import)
+
+            link(proto_definition)
+            if importable in previous_files:
+                _keep_message_classes(proto_definition, _get_message_classes(previous_files[importable]))
+
+            exported_definition.dependencies = dict(proto_definition.dependencies)
+            self._exported_files[importable] = exported_definition
+            linked_files.append(importable)
+        return linked_files
+
+    def _update(self) -> None:
+        # Drop the files that are no longer imported by any of the given files.
+        reachable_files = set()
+        stack = list(self.files)
+        while stack:
+            importable = stack.pop()
+            if importable in reachable_files or importable not in self._parsed_files:
+                continue
+            reachable_files.add(importable)
+            stack.extend(imported for imported, _ in self._parsed_files[importable].imports)
+
+        for importable in list(self._parsed_files):
+            if importable not in reachable_files:
+                del self._parsed_files[importable]
+                del self._file_hashes[importable]
+                self._exported_files.pop(importable, None)
+
+        for importable in self.files:
+            self[importable] = self._parsed_files[importable]
+
+    def _load(self, executor: Executor | None) -> None:
+        self._parse(self.files, executor)
+        self._link({})
+        self._update()
+
+    def get_changed_files(self) -> list[str]:
+        """
+        Get the files that changed since they were parsed.
+        Files are only read again when their modification time or size changed.
+
+        :return: The paths of the changed files, relative to the imports path.
+        """
+        return [importable for importable, (absolute_path, content_hash) in self._file_hashes.items()
+                if default_import_cache.read_file(absolute_path)[1] != content_hash]
+
+    def reload(self, executor: Executor | None = None) -> list[str]:
+        """
+        Parse the files that changed since they were parsed again, and the files importing them.
+        The definitions of the other files are kept, as well as the message classes of the messages that did not change.
+
+        :param executor: The executor to parse the files on, the files are parsed in the current process if not given.
+        :return: The paths of the reloaded files, in the order they were linked.
+        """
+        changed_files = self.get_changed_files()
+        if not changed_files:
+            return []
+
+        importing_files: dict[str, list[str]] = {}
+        for importable, proto_definition in self._parsed_files.items():
+            for imported, _ in proto_definition.imports:
+                importing_files.setdefault(imported, []).append(importable)
+
+        affected_files = set()
+        stack = list(changed_files)
+        while stack:
+            importable = stack.pop()
+            if importable in affected_files:
+                continue
+            affected_files.add(importable)
+            stack.extend(importing_files.get(importable, []))
+
+        previous_files = {importable: self._parsed_files.pop(importable) for importable in affected_files}
+        for importable in affected_files:
+            self._exported_files.pop(importable, None)
+
+        self._parse(list(affected_files), executor)
+        reloaded_files = self._link(previous_files)
+        self._update()
+        return reloaded_files
+
+
+def parse_files(files: list[str],
+                imports_path: str,
+                executor: Executor | None = None,
+                max_workers: int | None = None) -> SchemaSet:
+    """
+    Parse a set of .proto files and the files they import, every file is parsed once.
+
+    The files are parsed without their imports on multiple cores, the imports of every parsed file are parsed as soon as
+    they are known. When all files are parsed, the import graph is complete and the files are linked in topological
+    order, so the messages of an imported file are shared by all files importing it.
+    Imports that are not found in the imports path are loaded like parse loads them.
+
+    If no executor is given, a process pool is started for the call, or a thread pool on free-threaded Python.
+    Pass max_workers=1 to parse all files in the current process.
+
+    :param files: The paths of the files to parse, relative to the imports path, like the imports in .proto files.
+    :param imports_path: The path to resolve the files and imports from.
+    :param executor: The executor to parse the files on.
+    :param max_workers: The number of workers of the default executor, the number of CPUs if not given.
+    :return: The parsed definitions, by the paths of the given files. Call reload on the result to reload changed files.
+    """
+    owns_executor = executor is None and max_workers != 1
+    if owns_executor:
+        executor, _ = default_executor(max_workers or os.cpu_count())
+
+    schema_set = SchemaSet(files, imports_path)
+    try:
+        schema_set._load(executor)
+    finally:
+        if owns_executor:
+            executor.shutdown()
+    return schema_set
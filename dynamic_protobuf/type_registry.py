@@ -0,0 +1,127 @@
+import threading
+import weakref
+
+from protobuf_definition import ProtobufDefinition, ProtobufMessageDefinition
+
+type_url_prefix = 'type.googleapis.com/'
+
+
+def get_type_url(message_definition: ProtobufMessageDefinition) -> str:
+    """
+    Get the type URL of a message, as used in Any messages.
+
+    :param message_definition: The definition of the message.
+    :return: The type URL, like type.googleapis.com/package.Message
+    """
+    return f'{type_url_prefix}{message_definition.get_fully_qualified_name()}'
+
+
+class TypeRegistry:
+    """
+    The message classes of all loaded definitions, by their fully-qualified name, to unpack Any messages by their
+    type URL.
+
+    Definitions are added when they are linked or loaded, and are only referenced weakly, so they are not kept alive
+    by the registry. When multiple definitions contain a message with the same name, the definition that was added
+    last is used. Resolved type URLs are cached, the index of the names is only built again when definitions were
+    added since it was built. The index and the cache reference messages and classes weakly as well.
+    """
+
+    def __init__(self):
+        self._definitions: weakref.WeakKeyDictionary[ProtobufDefinition, None] = weakref.WeakKeyDictionary()
+        self._message_owners: dict[str, tuple[weakref.ref, weakref.ref]] = {}
+        self._message_classes: dict[str, weakref.ref] = {}
+        self._changed = False
+        self._lock = threading.Lock()
+
+    def add(self, proto_definition: ProtobufDefinition) -> None:
+        """
+        Add the messages of a definition, including the messages it imports.
+
+        :param proto_definition: The linked definition.
+        """
+        with self._lock:
+            self._definitions.pop(proto_definition, None)
+            self._definitions[proto_definition] = None
+            self._message_classes = {}
+            self._changed = True
+
+    @staticmethod
+    def _index_messages(proto_definition: ProtobufDefinition, message_owners: dict) -> None:
+        # The message classes are created by the definition the message was found in, so extended messages resolve
+        # to the class with the extensions. Messages are indexed by their declaration, because nested messages with
+        # the same name replace each other in the messages of a definition. The declarations of the definition itself
+        # are indexed last, so they replace imported messages with the same name.
+        imported_definitions = {}
+        imported_messages = []
+        for message_definition in proto_definition.messages.values():
+            if isinstance(message_definition, ProtobufDefinition):
+                TypeRegistry._index_messages(message_definition, message_owners)
+            elif message_definition.definition is not proto_definition:
+                imported_definitions[id(message_definition.definition)] = message_definition.definition
+                imported_messages.append(message_definition)
+
+        for imported_definition in imported_definitions.values():
+            for declaration in imported_definition.declarations:
+                if isinstance(declaration, ProtobufMessageDefinition):
+                    message_owners[declaration.get_fully_qualified_name()] = (weakref.ref(imported_definition),
+                                                                              weakref.ref(declaration))
+        for message_definition in imported_messages:
+            message_owners[message_definition.get_fully_qualified_name()] = (weakref.ref(proto_definition),
+                                                                             weakref.ref(message_definition))
+        for declaration in proto_definition.declarations:
+            if isinstance(declaration, ProtobufMessageDefinition):
+                message_owners[declaration.get_fully_qualified_name()] = (weakref.ref(proto_definition),
+                                                                          weakref.ref(declaration))
+
+    def _resolve_name(self, type_name: str):
+        with self._lock:
+            class_reference = self._message_classes.get(type_name)
+            message_class = class_reference() if class_reference else None
+            if message_class is not None:
+                return message_class
+
+            if self._changed:
+                message_owners = {}
+                for proto_definition in list(self._definitions):
+                    self._index_messages(proto_definition, message_owners)
+                self._message_owners = message_owners
+                self._changed = False
+
+            owner_reference, declaration_reference = self._message_owners.get(type_name, (None, None))
+            owner = owner_reference() if owner_reference else None
+            declaration = declaration_reference() if declaration_reference else None
+            if owner is None or declaration is None:
+                return None
+            message_class = owner.message_classes[declaration]
+            self._message_classes[type_name] = weakref.ref(message_class)
+            return message_class
+
+    def resolve(self, type_url: str):
+        """
+        Get the message class of a type URL.
+
+        :param type_url: The type URL, like type.googleapis.com/package.Message
+        :return: The message class.
+        """
+        type_name = type_url.rsplit('/', 1)[-1]
+        class_reference = self._message_classes.get(type_name)
+        message_class = class_reference() if class_reference else None
+        if message_class is None:
+            message_class = self._resolve_name(type_name)
+            if message_class is None:
+                raise Exception(f'Unknown type URL {type_url}')
+        return message_class
+
+    def clear(self) -> None:
+        """
+        Remove all definitions and cached type URLs from the registry.
+        """
+        with self._lock:
+            self._definitions = weakref.WeakKeyDictionary()
+            self._message_owners = {}
+            self._message_classes = {}
+            self._changed = False
+
+
+default_type_registry = TypeRegistry()
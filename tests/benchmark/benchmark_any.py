@@ -0,0 +1,70 @@
+"""
+Benchmark of packing and unpacking values in Any messages with every packing backend, and with a message of the
+same values packed by its type URL. Prints the throughput of packing and unpacking and the size of the packed value.
+
+Run from the repository root:
+    PYTHONPATH=dynamic_protobuf:. python tests/benchmark/benchmark_any.py
+"""
+from dynamic_protobuf import parse
+from helpers import benchmark
+from packing import packing_backends
+
+proto_definition = """syntax = "proto2";
+
+import "google/protobuf/any.proto";
+
+message Example {
+    optional google.protobuf.Any example_any = 1;
+}
+
+message ExampleValue {
+    optional int32 example_int = 1;
+    optional float example_float = 2;
+    optional string example_string = 3;
+    optional bytes example_bytes = 4;
+    optional bool example_bool = 5;
+}
+"""
+
+
+class ExampleValue:
+
+    def __init__(self, example_int: int, example_float: float, example_string: str, example_bytes: bytes,
+                 example_bool: bool):
+        self.example_int = example_int
+        self.example_float = example_float
+        self.example_string = example_string
+        self.example_bytes = example_bytes
+        self.example_bool = example_bool
+
+
+if __name__ == '__main__':
+    result = parse(proto_definition)
+    any_class = result.google.protobuf.Any
+    count = 10_000
+
+    for payload_size in (16, 4_096):
+        values = [ExampleValue(index, index + 0.5, f'content {index}', bytes(payload_size), index % 2 == 0)
+                  for index in range(count)]
+        messages = [result.ExampleValue(**value.__dict__) for value in values]
+
+        print(f'{payload_size} byte payloads')
+        print(f'{"backend":>12} {"pack/s":>12} {"unpack/s":>12} {"size":>8}')
+        for backend_name in packing_backends:
+            try:
+                any_messages = [any_class.pack(value, backend=backend_name) for value in values]
+            except ImportError:
+                print(f'{backend_name:>12} {"not installed":>12}')
+                continue
+
+            pack_duration = benchmark(lambda: [any_class.pack(value, backend=backend_name) for value in values])
+            unpack_duration = benchmark(lambda: [any_message.unpack(ExampleValue, backend=backend_name)
+                                                 for any_message in any_messages])
+            size = sum(len(any_message.value) for any_message in any_messages) / count
+            print(f'{backend_name:>12} {count / pack_duration:>12,.0f} {count / unpack_duration:>12,.0f} {size:>8.0f}')
+
+        any_messages = [any_class.pack(message) for message in messages]
+        pack_duration = benchmark(lambda: [any_class.pack(message) for message in messages])
+        unpack_duration = benchmark(lambda: [any_message.unpack() for any_message in any_messages])
+        size = sum(len(any_message.value) for any_message in any_messages) / count
+        print(f'{"message":>12} {count / pack_duration:>12,.0f} {count / unpack_duration:>12,.0f} {size:>8.0f}')
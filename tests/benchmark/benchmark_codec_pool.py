@@ -0,0 +1,50 @@
+"""
+Benchmark of decoding many small messages in the current process and on a codec pool.
+
+Run from the repository root:
+    PYTHONPATH=dynamic_protobuf:. python tests/benchmark/benchmark_codec_pool.py
+"""
+import os
+import time
+
+from dynamic_protobuf import parse, decode, CodecPool
+from parallel import _message_to_row
+
+proto_definition = """syntax = "proto2";
+message Example {
+    optional int32 example_int = 1;
+    optional string example_string = 2;
+    optional ExampleSubMessage example_sub_message = 3;
+}
+
+message ExampleSubMessage {
+    optional float example_float = 1;
+    optional int64 example_long = 2;
+}
+"""
+
+if __name__ == '__main__':
+    result = parse(proto_definition)
+    byte_blobs = [result.Example(example_int=index, example_string=f'example {index}',
+                                 example_sub_message={'example_float': 0.5, 'example_long': index * 1000}).encode()
+                  for index in range(200_000)]
+
+    start = time.perf_counter()
+    proto_dicts = [decode(byte_blob) for byte_blob in byte_blobs]
+    print(f'decode serially:          {time.perf_counter() - start:.2f}s')
+
+    start = time.perf_counter()
+    rows = [_message_to_row(result.Example.decode(byte_blob)) for byte_blob in byte_blobs]
+    print(f'decode messages serially: {time.perf_counter() - start:.2f}s')
+
+    with CodecPool(result) as codec_pool:
+        # Start the workers before measuring.
+        codec_pool.decode(byte_blobs[:os.cpu_count()])
+
+        start = time.perf_counter()
+        assert codec_pool.decode(byte_blobs) == proto_dicts
+        print(f'decode on {os.cpu_count()} workers:      {time.perf_counter() - start:.2f}s')
+
+        start = time.perf_counter()
+        assert codec_pool.decode_messages(byte_blobs, 'Example') == rows
+        print(f'decode messages on {os.cpu_count()} workers: {time.perf_counter() - start:.2f}s')
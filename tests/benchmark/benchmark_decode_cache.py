@@ -0,0 +1,40 @@
+"""
+Benchmark of decoding a stream of messages in which most messages were received before, with and without a decode
+cache. Prints the duration per message and the counters of the cache.
+
+Run from the repository root:
+    PYTHONPATH=dynamic_protobuf:. python tests/benchmark/benchmark_decode_cache.py
+"""
+import random
+
+from dynamic_protobuf import parse, DecodeCache
+from helpers import benchmark, format_duration_per_item
+
+proto_definition = """syntax = "proto2";
+message Snapshot {
+    optional string service = 1;
+    optional int32 version = 2;
+    optional map<string, string> settings = 3;
+}
+"""
+
+
+if __name__ == '__main__':
+    result = parse(proto_definition)
+    count = 10_000
+
+    # The stream consists of 100 distinct snapshots.
+    snapshots = [result.Snapshot(service='content.Orders', version=version,
+                                 settings={f'key_{index}': f'content {index}' for index in range(20)}).encode()
+                 for version in range(100)]
+    random.seed(0)
+    stream = [random.choice(snapshots) for _ in range(count)]
+
+    decode_duration = benchmark(lambda: [result.Snapshot.decode(message) for message in stream])
+    decode_cache = DecodeCache(max_size=256)
+    cached_decode_duration = benchmark(lambda: [result.Snapshot.decode(message, decode_cache=decode_cache)
+                                                for message in stream])
+
+    print(f'{"decode":>14} {format_duration_per_item(decode_duration, count)}')
+    print(f'{"cached decode":>14} {format_duration_per_item(cached_decode_duration, count)}')
+    print(f'hits {decode_cache.hits}, misses {decode_cache.misses}, evictions {decode_cache.evictions}')
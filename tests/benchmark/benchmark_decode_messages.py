@@ -0,0 +1,69 @@
+"""
+Benchmark of building nested messages from a decoded proto dict, directly and through keyword arguments like decode
+used to do, in time and in allocated memory.
+
+Run from the repository root:
+    PYTHONPATH=dynamic_protobuf:. python tests/benchmark/benchmark_decode_messages.py
+"""
+import time
+import tracemalloc
+
+from dynamic_protobuf import parse, decode
+
+
+def generate_nested_messages(depth: int) -> str:
+    lines = ['syntax = "proto2";', '']
+    for level in range(depth):
+        lines.extend([
+            f'message Level{level} {{',
+            f'    optional int32 level_int = 1;',
+            f'    optional string level_string = 2;',
+        ])
+        if level + 1 < depth:
+            lines.append(f'    optional Level{level + 1} level_nested = 3;')
+        lines.extend(['}', ''])
+    return '\n'.join(lines)
+
+
+def generate_proto_dict(depth: int) -> dict:
+    proto_dict = {1: depth, 2: f'level {depth}'}
+    if depth > 1:
+        proto_dict[3] = generate_proto_dict(depth - 1)
+    return proto_dict
+
+
+def build_with_keyword_arguments(message_class, proto_dict):
+    return message_class(**message_class._proto_dict_numbers_to_names(proto_dict))
+
+
+def build_directly(message_class, proto_dict):
+    return message_class._from_proto_dict(proto_dict)
+
+
+def benchmark(build, message_class, proto_dict, repetitions: int = 10_000) -> tuple[float, int]:
+    start = time.perf_counter()
+    for _ in range(repetitions):
+        build(message_class, proto_dict)
+    duration = (time.perf_counter() - start) / repetitions
+
+    tracemalloc.start()
+    snapshot = tracemalloc.take_snapshot()
+    message = build(message_class, proto_dict)
+    allocations = sum(statistic.count_diff for statistic in
+                      tracemalloc.take_snapshot().compare_to(snapshot, 'lineno') if statistic.count_diff > 0)
+    tracemalloc.stop()
+    del message
+    return duration, allocations
+
+
+if __name__ == '__main__':
+    print(f'{"depth":>6} {"keyword arguments":>18} {"directly":>10} {"kw allocations":>15} {"allocations":>12}')
+    for depth in (1, 5, 20):
+        message_class = parse(generate_nested_messages(depth)).Level0
+        proto_dict = generate_proto_dict(depth)
+        assert decode(message_class._from_proto_dict(proto_dict).encode()) == proto_dict
+
+        keyword_duration, keyword_allocations = benchmark(build_with_keyword_arguments, message_class, proto_dict)
+        direct_duration, direct_allocations = benchmark(build_directly, message_class, proto_dict)
+        print(f'{depth:>6} {keyword_duration * 1_000_000:>16.2f}us {direct_duration * 1_000_000:>8.2f}us '
+              f'{keyword_allocations:>15} {direct_allocations:>12}')
@@ -0,0 +1,52 @@
+"""
+Benchmark of encoding the same header message repeatedly: rendering and encoding a new message every time, encoding a
+frozen message, and freezing new equal messages through an encoding cache.
+
+Run from the repository root:
+    PYTHONPATH=dynamic_protobuf:. python tests/benchmark/benchmark_frozen.py
+"""
+from dynamic_protobuf import parse, EncodingCache
+from helpers import benchmark, format_duration_per_item
+
+proto_definition = """syntax = "proto2";
+message Header {
+    optional string service = 1;
+    optional string method = 2;
+    optional int32 version = 3;
+    optional map<string, string> metadata = 4;
+    optional HeaderOrigin origin = 5;
+}
+
+message HeaderOrigin {
+    optional string host = 1;
+    optional int32 port = 2;
+}
+"""
+
+header = {
+    'service': 'content.Orders',
+    'method': 'create',
+    'version': 3,
+    'metadata': {f'key_{index}': f'content {index}' for index in range(10)},
+    'origin': {'host': 'content.local', 'port': 8080},
+}
+
+
+if __name__ == '__main__':
+    result = parse(proto_definition)
+    count = 10_000
+
+    message = result.Header(**header)
+    frozen_message = message.freeze()
+    encoding_cache = EncodingCache()
+    assert frozen_message.encode() == message.encode()
+
+    durations = {
+        'encode': benchmark(lambda: [message.encode() for _ in range(count)]),
+        'render and encode': benchmark(lambda: [result.Header(**header).encode() for _ in range(count)]),
+        'frozen encode': benchmark(lambda: [frozen_message.encode() for _ in range(count)]),
+        'cached freeze and encode': benchmark(lambda: [result.Header(**header).freeze(encoding_cache).encode()
+                                                       for _ in range(count)]),
+    }
+    for name, duration in durations.items():
+        print(f'{name:>26} {format_duration_per_item(duration, count)}')
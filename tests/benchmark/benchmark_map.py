@@ -0,0 +1,40 @@
+"""
+Benchmark of encoding and decoding messages with large maps, with scalar and with message values.
+
+Run from the repository root:
+    PYTHONPATH=dynamic_protobuf:. python tests/benchmark/benchmark_map.py
+"""
+from dynamic_protobuf import parse
+from helpers import benchmark
+
+proto_definition = """syntax = "proto2";
+message Example {
+    optional map<string, int32> example_scalar_map = 1;
+    optional map<int32, ExampleValue> example_message_map = 2;
+}
+
+message ExampleValue {
+    optional int32 example_int = 1;
+    optional string example_string = 2;
+}
+"""
+
+
+if __name__ == '__main__':
+    result = parse(proto_definition)
+
+    print(f'{"entries":>8} {"map":>8} {"encode":>10} {"decode":>10}')
+    for entries in (1_000, 50_000):
+        messages = {
+            'scalar': result.Example(example_scalar_map={f'key_{index}': index for index in range(entries)}),
+            'message': result.Example(example_message_map={
+                index: {'example_int': index, 'example_string': f'value {index}'} for index in range(entries)
+            }),
+        }
+        for map_name, message in messages.items():
+            encoded_message = message.encode()
+            assert result.Example.decode(encoded_message) == message
+
+            encode_duration = benchmark(message.encode)
+            decode_duration = benchmark(lambda: result.Example.decode(encoded_message))
+            print(f'{entries:>8} {map_name:>8} {encode_duration * 1_000:>8.1f}ms {decode_duration * 1_000:>8.1f}ms')
@@ -0,0 +1,52 @@
+"""
+Benchmark of using one message of a parsed schema, with the message and enum classes created when they are first used,
+against creating the classes of all messages and enums up front like parse used to do.
+
+Run from the repository root:
+    PYTHONPATH=dynamic_protobuf:. python tests/benchmark/benchmark_message_classes.py
+"""
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(__file__))
+
+from benchmark_parser import generate_schema
+from dynamic_protobuf import parse
+
+
+def create_all_classes(proto_definition) -> None:
+    for message_name in proto_definition.messages:
+        proto_definition.message_classes[message_name]
+    for enum_name in proto_definition.enums:
+        proto_definition.enum_classes[enum_name]
+
+
+def benchmark(schema: str, eager: bool, repetitions: int = 5) -> tuple[float, float]:
+    best_parse, best_first_use = None, None
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        proto_definition = parse(schema)
+        parse_duration = time.perf_counter() - start
+
+        start = time.perf_counter()
+        if eager:
+            create_all_classes(proto_definition)
+        proto_message = proto_definition.Message0Nested(nested_float=1.5)
+        proto_definition.Message0Nested.decode(proto_message.encode())
+        first_use_duration = time.perf_counter() - start
+
+        best_parse = parse_duration if best_parse is None else min(best_parse, parse_duration)
+        best_first_use = first_use_duration if best_first_use is None else min(best_first_use, first_use_duration)
+    return best_parse, best_first_use
+
+
+if __name__ == '__main__':
+    print(f'{"lines":>8} {"messages":>9} {"parse seconds":>14} {"lazy first use":>15} {"eager first use":>16}')
+    for line_count in (2_500, 10_000, 40_000):
+        schema = generate_schema(line_count)
+        message_count = schema.count('message ')
+        parse_duration, lazy_duration = benchmark(schema, eager=False)
+        _, eager_duration = benchmark(schema, eager=True)
+        print(f'{line_count:>8} {message_count:>9} {parse_duration:>14.4f} {lazy_duration:>15.6f} '
+              f'{eager_duration:>16.6f}')
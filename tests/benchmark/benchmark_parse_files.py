@@ -0,0 +1,64 @@
+"""
+Benchmark of parsing a generated set of .proto files that share imports, once by parsing every file on its own and once
+with parse_files, which parses every file once and parses independent files on multiple cores.
+It also measures reloading the set after one of the files changed.
+
+Run from the repository root:
+    PYTHONPATH=dynamic_protobuf:. python tests/benchmark/benchmark_parse_files.py
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(__file__))
+
+from benchmark_parser import generate_schema
+from dynamic_protobuf import parse, parse_files
+
+
+def generate_schema_set(directory: str, file_count: int, shared_file_count: int, line_count: int) -> list[str]:
+    for shared_index in range(shared_file_count):
+        schema = generate_schema(line_count).replace('message Message', f'message Shared{shared_index}Message') \
+            .replace('enum Message', f'enum Shared{shared_index}Message') \
+            .replace(' Message', f' Shared{shared_index}Message')
+        with open(os.path.join(directory, f'shared_{shared_index}.proto'), 'w') as file:
+            file.write(schema)
+
+    files = []
+    for file_index in range(file_count):
+        imports = '\n'.join([f'import "shared_{shared_index}.proto";' for shared_index in range(shared_file_count)])
+        schema = generate_schema(line_count).replace('syntax = "proto2";', f'syntax = "proto2";\n{imports}') \
+            .replace('message Message', f'message File{file_index}Message') \
+            .replace('enum Message', f'enum File{file_index}Message') \
+            .replace(' Message', f' File{file_index}Message')
+        filename = f'file_{file_index}.proto'
+        with open(os.path.join(directory, filename), 'w') as file:
+            file.write(schema)
+        files.append(filename)
+    return files
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as directory:
+        files = generate_schema_set(directory, file_count=50, shared_file_count=5, line_count=500)
+
+        start = time.perf_counter()
+        for filename in files:
+            with open(os.path.join(directory, filename)) as file:
+                parse(file.read(), directory)
+        print(f'parse per file:       {time.perf_counter() - start:.3f} seconds')
+
+        start = time.perf_counter()
+        parse_files(files, directory, max_workers=1)
+        print(f'parse_files, serial:  {time.perf_counter() - start:.3f} seconds')
+
+        start = time.perf_counter()
+        schema_set = parse_files(files, directory)
+        print(f'parse_files, {os.cpu_count()} CPUs: {time.perf_counter() - start:.3f} seconds')
+
+        with open(os.path.join(directory, files[0]), 'a') as file:
+            file.write('\nmessage ReloadedMessage {\n    optional int32 reloaded_int = 1;\n}\n')
+        start = time.perf_counter()
+        schema_set.reload()
+        print(f'reload one file:      {time.perf_counter() - start:.3f} seconds')
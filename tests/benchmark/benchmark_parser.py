@@ -0,0 +1,62 @@
+"""
+Benchmark of the .proto parser on generated schemas of increasing size.
+The time per line should stay roughly the same when the schema grows, the parser runs in a single linear pass and
+every reference is resolved in the time of the length of its name.
+
+Run from the repository root:
+    PYTHONPATH=dynamic_protobuf:. python tests/benchmark/benchmark_parser.py
+"""
+import time
+
+from dynamic_protobuf import parse
+
+
+def generate_schema(line_count: int) -> str:
+    lines = ['syntax = "proto2";', '']
+    message_index = 0
+    while len(lines) < line_count:
+        lines.extend([
+            f'// Message number {message_index}',
+            f'message Message{message_index} {{',
+            f'    optional int32 example_int = 1 [default = {message_index}];',
+            f'    optional string example_string = 2; // The name of message {message_index}',
+            f'    repeated int64 example_list = 3 [packed = true];',
+            f'    optional Message{message_index}Enum example_enum = 4 [default = VALUE_{message_index}_2];',
+            f'    optional Message{message_index}Nested example_nested = 5;',
+            f'    optional Message{message_index}.Message{message_index}Nested example_qualified = 11;',
+            f'    oneof example_oneof {{',
+            f'        int32 oneof_int = 6;',
+            f'        string oneof_string = 7;',
+            f'    }}',
+            f'    message Message{message_index}Nested {{',
+            f'        optional float nested_float = 1;',
+            f'        optional bytes nested_bytes = 2;',
+            f'    }}',
+            f'    reserved 8 to 10;',
+            f'}}',
+            f'enum Message{message_index}Enum {{',
+            f'    VALUE_{message_index}_1 = 1;',
+            f'    VALUE_{message_index}_2 = 2;',
+            f'}}',
+            '',
+        ])
+        message_index += 1
+    return '\n'.join(lines)
+
+
+def benchmark(line_count: int, repetitions: int = 3) -> float:
+    schema = generate_schema(line_count)
+    best = None
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        parse(schema)
+        duration = time.perf_counter() - start
+        best = duration if best is None else min(best, duration)
+    return best
+
+
+if __name__ == '__main__':
+    print(f'{"lines":>8} {"seconds":>10} {"microseconds per line":>24}')
+    for line_count in (1_250, 2_500, 5_000, 10_000, 20_000):
+        duration = benchmark(line_count)
+        print(f'{line_count:>8} {duration:>10.4f} {duration / line_count * 1_000_000:>24.2f}')
@@ -0,0 +1,38 @@
+"""
+Benchmark of constructing messages with three fields set, for messages with an increasing number of fields.
+Only the given fields are rendered, so the construction time should stay roughly the same when messages grow.
+
+Run from the repository root:
+    PYTHONPATH=dynamic_protobuf:. python tests/benchmark/benchmark_render.py
+"""
+import time
+
+from dynamic_protobuf import parse
+
+
+def generate_message(field_count: int) -> str:
+    lines = ['syntax = "proto2";', '', 'message Example {']
+    for field_index in range(field_count):
+        if field_index % 2:
+            lines.append(f'    optional string example_string_{field_index} = {field_index + 1};')
+        else:
+            lines.append(f'    optional int32 example_int_{field_index} = {field_index + 1} [default = 1];')
+    lines.append('}')
+    return '\n'.join(lines)
+
+
+def benchmark(field_count: int, repetitions: int = 10_000) -> float:
+    proto_definition = parse(generate_message(field_count))
+    example_class = proto_definition.Example
+
+    start = time.perf_counter()
+    for _ in range(repetitions):
+        example_class(example_int_0=2, example_string_1='example', example_int_2=3)
+    return (time.perf_counter() - start) / repetitions
+
+
+if __name__ == '__main__':
+    print(f'{"fields":>8} {"microseconds per message":>26}')
+    for field_count in (5, 25, 50, 100, 200):
+        duration = benchmark(field_count)
+        print(f'{field_count:>8} {duration * 1_000_000:>26.2f}')
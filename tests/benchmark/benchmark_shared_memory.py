@@ -0,0 +1,48 @@
+"""
+Benchmark of decoding large messages into columns on a codec pool, sending the messages and columns through pipes
+and through shared memory.
+
+Run from the repository root:
+    PYTHONPATH=dynamic_protobuf:. python tests/benchmark/benchmark_shared_memory.py
+"""
+import os
+import time
+
+from dynamic_protobuf import parse, CodecPool
+
+proto_definition = """syntax = "proto2";
+message Example {
+    optional int32 example_int = 1;
+    optional string example_text = 2;
+    optional float example_float = 3;
+}
+"""
+
+
+def benchmark(codec_pool: CodecPool, byte_blobs: list[bytes], repetitions: int = 3) -> float:
+    durations = []
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        codec_pool.decode_columns(byte_blobs, 'Example')
+        durations.append(time.perf_counter() - start)
+    return min(durations)
+
+
+if __name__ == '__main__':
+    result = parse(proto_definition)
+
+    print(f'{"messages":>9} {"message size":>13} {"pipes":>9} {"shared memory":>14}')
+    for message_count, text_size in ((10_000, 100), (200, 256 * 1024), (50, 4 * 1024 * 1024)):
+        text = ('column text ' * (text_size // 12 + 1))[:text_size]
+        byte_blobs = [result.Example(example_int=index, example_text=text, example_float=index / 4).encode()
+                      for index in range(message_count)]
+
+        durations = []
+        for shared_memory in (False, True):
+            with CodecPool(result, batch_size=max(1, message_count // (4 * os.cpu_count())),
+                           shared_memory=shared_memory) as codec_pool:
+                columns = codec_pool.decode_columns(byte_blobs[:1], 'Example')
+                assert columns['example_text'] == [text]
+                durations.append(benchmark(codec_pool, byte_blobs))
+
+        print(f'{message_count:>9} {len(byte_blobs[0]):>13} {durations[0] * 1_000:>7.1f}ms {durations[1] * 1_000:>12.1f}ms')
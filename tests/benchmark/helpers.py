@@ -0,0 +1,31 @@
+"""
+Helpers shared by the benchmarks, which import them from the directory of the benchmark scripts.
+"""
+import time
+
+
+def benchmark(function, repetitions: int = 3) -> float:
+    """
+    Measure the duration of a function.
+
+    :param function: The function to measure, called without arguments.
+    :param repetitions: The number of times to call the function.
+    :return: The shortest duration in seconds.
+    """
+    durations = []
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return min(durations)
+
+
+def format_duration_per_item(duration: float, count: int) -> str:
+    """
+    Format the duration per item of a benchmark that handled multiple items.
+
+    :param duration: The duration in seconds.
+    :param count: The number of items.
+    :return: The duration per item in microseconds, right-aligned.
+    """
+    return f'{duration / count * 1_000_000:>8.2f}us'
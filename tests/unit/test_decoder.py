@@ -2,7 +2,15 @@ import time
 
 import pytest
 
-from dynamic_protobuf import decode, DecoderFieldDefinition, WireType
+from dynamic_protobuf import DecoderFieldDefinition, WireType
+from decoder import python_decode, compiled_decode
+
+# Every test case runs against the pure Python decoder and, when the extension is built, the compiled decoder.
+decode_backends = [
+    pytest.param(python_decode, id='python'),
+    pytest.param(compiled_decode, id='compiled',
+                 marks=pytest.mark.skipif(compiled_decode is None, reason='compiled codec extension is not built')),
+]
 
 test_cases = {
     # basic cases
@@ -55,6 +63,14 @@ test_cases_with_definition = {
         1: DecoderFieldDefinition.repeated_packed(WireType.FIXED32)
     }, {1: [1.1, 2.2, 3.3]}),
 
+    # map cases, the entries are not decoded
+    'map_case': (b'\n\t\n\x05key_1\x10\x00\n\t\n\x05key_2\x10\x01', {
+        1: DecoderFieldDefinition.map()
+    }, {1: [b'\n\x05key_1\x10\x00', b'\n\x05key_2\x10\x01']}),
+    'bytes_case': (b'\n\x04\x08\x96\x01\xff\x12\x02ab', {
+        1: DecoderFieldDefinition.bytes()
+    }, {1: b'\x08\x96\x01\xff', 2: 'ab'}),
+
     # basic definition cases
     'basic_definition_case_1': (b'\x08\x96\x01', {
         1: DecoderFieldDefinition.optional()
@@ -69,8 +85,9 @@ test_cases_with_definition = {
 }
 
 
+@pytest.mark.parametrize('decode', decode_backends)
 @pytest.mark.parametrize('test_case, expected_result', test_cases.items())
-def test_deserialize(test_case: bytes, expected_result: dict):
+def test_deserialize(decode, test_case: bytes, expected_result: dict):
     print(f'testing use case {test_case}')
     start = time.time()
     result = decode(test_case)
@@ -95,8 +112,9 @@ def test_deserialize(test_case: bytes, expected_result: dict):
     print(f'test case {test_case} is valid!')
 
 
+@pytest.mark.parametrize('decode', decode_backends)
 @pytest.mark.parametrize('test_case_name, expected_result', test_cases_with_definition.items())
-def test_deserialize_with_definition(test_case_name: str, expected_result: tuple[bytes, dict, dict]):
+def test_deserialize_with_definition(decode, test_case_name: str, expected_result: tuple[bytes, dict, dict]):
     test_case, definition, expected_result = expected_result
     print(f'testing use case {test_case}')
     start = time.time()
@@ -2,7 +2,15 @@ import time
 
 import pytest
 
-from dynamic_protobuf import encode, WireType
+from dynamic_protobuf import WireType
+from encoder import python_encode, compiled_encode
+
+# Every test case runs against the pure Python encoder and, when the extension is built, the compiled encoder.
+encode_backends = [
+    pytest.param(python_encode, id='python'),
+    pytest.param(compiled_encode, id='compiled',
+                 marks=pytest.mark.skipif(compiled_encode is None, reason='compiled codec extension is not built')),
+]
 
 test_cases = {
     # basic cases
@@ -193,8 +201,9 @@ dynamic_wire_type_test_cases = {
 }
 
 
+@pytest.mark.parametrize('encode', encode_backends)
 @pytest.mark.parametrize('test_case_name, test_case', test_cases.items())
-def test_encode(test_case_name, test_case):
+def test_encode(encode, test_case_name, test_case):
     test_case, expected_result = test_case
     print(f'testing use case {test_case}')
     start = time.time()
@@ -206,8 +215,9 @@ def test_encode(test_case_name, test_case):
     print(f'test case {test_case} is valid!')
 
 
+@pytest.mark.parametrize('encode', encode_backends)
 @pytest.mark.parametrize('test_case_name, test_case', dynamic_wire_type_test_cases.items())
-def test_encode_dynamic_wire_type(test_case_name, test_case):
+def test_encode_dynamic_wire_type(encode, test_case_name, test_case):
     test_case, expected_result = test_case
     print(f'testing use case {test_case}')
     start = time.time()
@@ -217,3 +227,23 @@ def test_encode_dynamic_wire_type(test_case_name, test_case):
     assert result == expected_result
 
     print(f'test case {test_case} is valid!')
+
+
+@pytest.mark.parametrize('encode', encode_backends)
+def test_encode_deterministic(encode):
+    proto_dict = {
+        3: (WireType.LENGTH_DELIMITED, {2: (WireType.VARINT, 1), 1: (WireType.LENGTH_DELIMITED, 'content')}),
+        1: (WireType.VARINT, [1, 2]),
+        2: (WireType.LENGTH_DELIMITED, (WireType.VARINT, [3, 4])),
+    }
+    ordered_proto_dict = {
+        1: (WireType.VARINT, [1, 2]),
+        2: (WireType.LENGTH_DELIMITED, (WireType.VARINT, [3, 4])),
+        3: (WireType.LENGTH_DELIMITED, {1: (WireType.LENGTH_DELIMITED, 'content'), 2: (WireType.VARINT, 1)}),
+    }
+
+    # Without deterministic the fields are encoded in the order of the dictionary, with it in the order of their numbers.
+    assert encode(proto_dict) != encode(ordered_proto_dict)
+    assert encode(proto_dict, deterministic=True) == encode(ordered_proto_dict) == \
+           b'\x08\x01\x08\x02\x12\x02\x03\x04\x1a\x0b\n\x07content\x10\x01'
+    assert encode({2: 'b', 1: 'a'}, determine_wire_types=True, deterministic=True) == b'\n\x01a\x12\x01b'
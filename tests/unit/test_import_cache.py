@@ -0,0 +1,87 @@
+from dynamic_protobuf import parse, ImportCache
+
+proto_definition = """syntax = "proto2";
+import "left.proto";
+import "right.proto";
+
+message Example {
+    optional LeftMessage left_message = 1;
+    optional RightMessage right_message = 2;
+    optional SharedMessage shared_message = 3;
+}
+"""
+
+import_files = {
+    'left.proto': 'syntax = "proto2";\nimport public "shared.proto";\n'
+                  'message LeftMessage {\n    optional SharedMessage shared_message = 1;\n}\n',
+    'right.proto': 'syntax = "proto2";\nimport public "shared.proto";\n'
+                   'message RightMessage {\n    optional SharedMessage shared_message = 1;\n}\n',
+    'shared.proto': 'syntax = "proto2";\nmessage SharedMessage {\n    optional int32 shared_int = 1;\n}\n',
+}
+
+
+def _write_imports(imports_path):
+    for filename, content in import_files.items():
+        (imports_path / filename).write_text(content)
+
+
+def test_import_cache_diamond(tmp_path):
+    _write_imports(tmp_path)
+    import_cache = ImportCache()
+
+    result = parse(proto_definition, imports_path=str(tmp_path), import_cache=import_cache)
+    shared_message = result.messages['SharedMessage']
+    assert result.messages['LeftMessage'].fields_by_name['shared_message'].type is shared_message
+    assert result.messages['RightMessage'].fields_by_name['shared_message'].type is shared_message
+    assert result.messages['Example'].fields_by_name['shared_message'].type is shared_message
+
+    # Imports are shared across calls to parse.
+    other_result = parse(proto_definition, imports_path=str(tmp_path), import_cache=import_cache)
+    assert other_result.messages['LeftMessage'] is result.messages['LeftMessage']
+    assert other_result.messages['SharedMessage'] is shared_message
+
+    # Without a shared cache, the imports are parsed again.
+    assert parse(proto_definition, imports_path=str(tmp_path), import_cache=ImportCache()).messages[
+               'SharedMessage'] is not shared_message
+
+    print('test_import_cache_diamond is valid!')
+
+
+def test_import_cache_invalidation(tmp_path):
+    _write_imports(tmp_path)
+    import_cache = ImportCache()
+
+    result = parse(proto_definition, imports_path=str(tmp_path), import_cache=import_cache)
+    assert 'added_int' not in result.messages['SharedMessage'].fields_by_name
+
+    # A change in a nested import invalidates the files importing it.
+    (tmp_path / 'shared.proto').write_text(import_files['shared.proto'].replace(
+        '}\n', '    optional int32 added_int = 2;\n}\n'))
+    changed_result = parse(proto_definition, imports_path=str(tmp_path), import_cache=import_cache)
+    assert 'added_int' in changed_result.messages['SharedMessage'].fields_by_name
+    assert changed_result.messages['LeftMessage'].fields_by_name['shared_message'].type is \
+           changed_result.messages['SharedMessage']
+
+    import_cache.clear()
+    assert parse(proto_definition, imports_path=str(tmp_path), import_cache=import_cache).messages[
+               'SharedMessage'] is not changed_result.messages['SharedMessage']
+
+    print('test_import_cache_invalidation is valid!')
+
+
+def test_import_cache_extension_isolation():
+    extending_definition = """syntax = "proto2";
+import extension.proto;
+
+extend ExtendableMessage {
+    optional float example_float = 2;
+}
+"""
+    import_cache = ImportCache()
+    extending_result = parse(extending_definition, imports_path='imports', import_cache=import_cache)
+    result = parse('syntax = "proto2";\nimport "extension.proto";\n', imports_path='imports', import_cache=import_cache)
+
+    assert 'example_float' in extending_result.messages['ExtendableMessage'].fields_by_name
+    assert 'example_float' not in result.messages['ExtendableMessage'].fields_by_name
+
+    print('test_import_cache_extension_isolation is valid!')
@@ -0,0 +1,170 @@
+import functools
+import http.server
+import os
+import tarfile
+import threading
+import time
+import urllib.error
+import zipfile
+
+import pytest
+
+import constants
+from dynamic_protobuf import parse, ImportCache, ImportResolver, DirectoryResolver, ArchiveResolver, RemoteResolver
+
+
+def test_bundled_well_known_types():
+    proto_definition = """syntax = "proto2";
+import "google/protobuf/duration.proto";
+import "google/protobuf/empty.proto";
+
+message Example {
+    optional google.protobuf.Duration example_duration = 1;
+    optional google.protobuf.Empty example_empty = 2;
+}
+"""
+
+    start = time.time()
+    result = parse(proto_definition)
+    print(f'Parsed in {(time.time() - start) * 1_000_000:.6f} microseconds')
+
+    assert result.messages['Example'].fields_by_name['example_duration'].type == result.messages[
+        'google.protobuf.Duration']
+    assert all(os.path.join('well_known_types', 'google', 'protobuf') in dependency
+               for dependency in result.dependencies)
+
+    proto_message = result.Example(example_duration=result.google.protobuf.Duration(seconds=1, nanos=2))
+    assert result.Example.decode(proto_message.encode()) == proto_message
+
+    print('test_bundled_well_known_types is valid!')
+
+
+def test_offline_mode(monkeypatch):
+    monkeypatch.setattr(constants, 'OFFLINE', True)
+
+    # Bundled and local imports are still available.
+    parse('syntax = "proto2";\nimport "google/protobuf/timestamp.proto";\n')
+    parse('syntax = "proto2";\nimport "custom_import.proto";\n', imports_path='imports')
+
+    start = time.time()
+    with pytest.raises(Exception, match='remote imports are disabled'):
+        parse('syntax = "proto2";\nimport "google/protobuf/descriptor.proto";\n', imports_path='imports')
+    assert time.time() - start < 1
+
+    print('test_offline_mode is valid!')
+
+
+example_import = """syntax = "proto2";
+import "example_import.proto";
+
+message Example {
+    optional ExampleImported example_imported = 1;
+}
+"""
+
+
+def write_import(root, example_int_name):
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, 'example_import.proto'), 'w') as file:
+        file.write(f'syntax = "proto2";\n\nmessage ExampleImported {{\n    optional int32 {example_int_name} = 1;\n}}\n')
+
+
+def test_directory_resolvers(tmp_path):
+    write_import(tmp_path / 'first', 'first_int')
+    write_import(tmp_path / 'second', 'second_int')
+
+    resolvers = [DirectoryResolver(str(tmp_path / 'first')), DirectoryResolver(str(tmp_path / 'second'))]
+    result = parse(example_import, import_cache=ImportCache(), resolvers=resolvers)
+    assert 'first_int' in result.messages['ExampleImported'].fields_by_name
+
+    resolvers = [DirectoryResolver(str(tmp_path / 'missing')), DirectoryResolver(str(tmp_path / 'second'))]
+    result = parse(example_import, import_cache=ImportCache(), resolvers=resolvers)
+    assert 'second_int' in result.messages['ExampleImported'].fields_by_name
+
+    with pytest.raises(Exception, match='Could not resolve import example_import.proto'):
+        parse(example_import, resolvers=[DirectoryResolver(str(tmp_path / 'missing'))])
+
+    print('test_directory_resolvers is valid!')
+
+
+class IncompleteResolver(ImportResolver):
+    key = 'incomplete'
+
+
+def test_incomplete_resolver():
+    # Resolvers that do not implement resolve can not be created.
+    with pytest.raises(TypeError, match='resolve'):
+        IncompleteResolver()
+
+    print('test_incomplete_resolver is valid!')
+
+
+def test_archive_resolvers(tmp_path):
+    write_import(tmp_path / 'protos', 'archived_int')
+
+    with zipfile.ZipFile(tmp_path / 'protos.zip', 'w') as archive:
+        archive.write(tmp_path / 'protos' / 'example_import.proto', 'protos/example_import.proto')
+    with tarfile.open(tmp_path / 'protos.tar.gz', 'w:gz') as archive:
+        archive.add(tmp_path / 'protos' / 'example_import.proto', 'example_import.proto')
+
+    import_cache = ImportCache()
+    result = parse(example_import, import_cache=import_cache,
+                   resolvers=[ArchiveResolver(str(tmp_path / 'protos.zip'), 'protos')])
+    assert 'archived_int' in result.messages['ExampleImported'].fields_by_name
+    assert f'{tmp_path / "protos.zip"}!/protos/example_import.proto' in result.dependencies
+    assert import_cache.dependencies_unchanged(result)
+
+    # The archive path can be passed as imports path as well.
+    result = parse(example_import, imports_path=str(tmp_path / 'protos.tar.gz'), import_cache=import_cache)
+    assert 'archived_int' in result.messages['ExampleImported'].fields_by_name
+
+    print('test_archive_resolvers is valid!')
+
+
+def test_remote_resolver_cache(tmp_path, capsys):
+    write_import(tmp_path / 'served', 'remote_int')
+
+    requests = []
+
+    class RequestHandler(http.server.SimpleHTTPRequestHandler):
+        def log_message(self, *args):
+            requests.append(self.path)
+
+    handler = functools.partial(RequestHandler, directory=str(tmp_path / 'served'))
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_address[1]}/'
+    cache_dir = str(tmp_path / 'cache')
+
+    try:
+        import_cache = ImportCache()
+        resolvers = [RemoteResolver(base_url, cache_dir)]
+        result = parse(example_import, import_cache=import_cache, resolvers=resolvers)
+        assert 'remote_int' in result.messages['ExampleImported'].fields_by_name
+        assert f'{base_url}example_import.proto' in result.dependencies
+
+        parse(example_import, import_cache=import_cache, resolvers=resolvers)
+        assert len(requests) == 1
+
+        # Files that are not served are not resolved.
+        with pytest.raises(Exception, match='Could not resolve import missing.proto'):
+            parse('syntax = "proto2";\nimport "missing.proto";\n', import_cache=import_cache, resolvers=resolvers)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    # A new process reads the file from the cache directory, without the server.
+    result = parse(example_import, import_cache=ImportCache(), resolvers=[RemoteResolver(base_url, cache_dir)])
+    assert 'remote_int' in result.messages['ExampleImported'].fields_by_name
+
+    # Corrupt files in the cache directory are not used, the file is retrieved again, but the server is stopped.
+    for file_name in os.listdir(cache_dir):
+        if file_name.endswith('.proto'):
+            with open(os.path.join(cache_dir, file_name), 'a') as file:
+                file.write('corrupt')
+    capsys.readouterr()
+    with pytest.raises(urllib.error.URLError, match='Connection refused'):
+        parse(example_import, import_cache=ImportCache(), resolvers=[RemoteResolver(base_url, cache_dir)])
+    assert 'is corrupt, retrieving it again' in capsys.readouterr().out
+
+    print('test_remote_resolver_cache is valid!')
@@ -0,0 +1,152 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import pytest
+
+from dynamic_protobuf import encode, decode, parallel_decode, parse, CodecPool, DecoderFieldDefinition, WireType
+from parallel import _write_shared_columns, _read_shared_columns
+from schema_cache import dump_definition
+
+# A message with a large repeated sub-message field, surrounded by other fields.
+large_message = {
+    1: 'header',
+    2: [{1: index, 2: f'name_{index}', 3: index / 4, 4: {1: index % 7}} for index in range(20_000)],
+    3: (WireType.LENGTH_DELIMITED, (WireType.VARINT, list(range(100)))),
+    4: 0.5,
+}
+
+
+@pytest.mark.parametrize('executor_class', [ThreadPoolExecutor, ProcessPoolExecutor])
+def test_parallel_decode(executor_class):
+    byte_blob = encode(large_message, determine_wire_types=True)
+    definition = {3: DecoderFieldDefinition.repeated_packed(WireType.VARINT)}
+
+    start = time.time()
+    expected_result = decode(byte_blob, definition)
+    print(f'Decoded serially in {(time.time() - start) * 1_000_000:.6f} microseconds')
+
+    with executor_class(max_workers=4) as executor:
+        start = time.time()
+        result = parallel_decode(byte_blob, definition, executor=executor, chunk_size=16 * 1024, min_parallel_size=0)
+        print(f'Decoded in parallel in {(time.time() - start) * 1_000_000:.6f} microseconds')
+
+    assert result == expected_result
+    assert len(result[2]) == 20_000
+
+    print(f'test_parallel_decode with {executor_class.__name__} is valid!')
+
+
+def test_parallel_decode_small_message():
+    byte_blob = b'\r\xa6\x9bD;\x12\x04h\x03p\x01'
+    assert parallel_decode(byte_blob) == decode(byte_blob)
+
+
+def test_parallel_decode_invalid_message():
+    # Invalid messages raise the same error as the serial decoder.
+    byte_blob = b'\x08\x96\x01\x0b\x01'
+    with pytest.raises(KeyError):
+        decode(byte_blob)
+    with pytest.raises(KeyError):
+        parallel_decode(byte_blob, min_parallel_size=0)
+
+
+
+def test_parallel_decode_invalid_trailing_tag():
+    # A tag with an invalid wire type at the end of the message raises like the serial decoder, also when the
+    # message is large enough to be decoded in parallel.
+    byte_blob = b'\x08\x05\x10\x07' * 64 + b'\x0b'
+    with pytest.raises(KeyError):
+        decode(byte_blob)
+    with pytest.raises(KeyError):
+        parallel_decode(byte_blob, chunk_size=16, min_parallel_size=0)
+
+codec_pool_definition = """syntax = "proto2";
+message Example {
+    optional int32 example_int = 1;
+    optional string example_string = 2;
+    optional ExampleSubMessage example_sub_message = 3;
+    optional map<string, int32> example_map = 4;
+}
+
+message ExampleSubMessage {
+    optional float example_float = 1;
+}
+"""
+
+
+@pytest.mark.parametrize('shared_memory', [False, True])
+def test_codec_pool(shared_memory):
+    result = parse(codec_pool_definition)
+    rows = [{'example_int': index, 'example_string': f'example {index}',
+             'example_sub_message': {'example_float': index + 0.5}, 'example_map': {f'key_{index}': index}}
+            for index in range(1, 101)]
+    byte_blobs = [result.Example(**row).encode() for row in rows]
+
+    with CodecPool(result, max_workers=2, batch_size=16, shared_memory=shared_memory) as codec_pool:
+        assert codec_pool.decode(byte_blobs) == [decode(byte_blob) for byte_blob in byte_blobs]
+
+        decoded_rows = codec_pool.decode_messages(byte_blobs, 'Example')
+        assert decoded_rows == rows
+        assert [result.Example(**row) for row in decoded_rows] == [result.Example.decode(byte_blob)
+                                                                   for byte_blob in byte_blobs]
+
+        columns = codec_pool.decode_columns(byte_blobs + [result.Example(example_int=7).encode()], 'Example')
+        assert columns['example_int'] == list(range(1, 101)) + [7]
+        assert columns['example_map'][:2] == [{'key_1': 1}, {'key_2': 2}]
+        assert columns['example_string'][-1] is None
+
+        assert codec_pool.encode(rows, 'Example') == byte_blobs
+        assert codec_pool.encode([{1: 150}]) == [b'\x08\x96\x01']
+
+        with pytest.raises(Exception, match='No message with name Unknown'):
+            codec_pool.decode_messages(byte_blobs[:1], 'Unknown')
+
+    # The compiled representation of a definition can be given instead.
+    with CodecPool(dump_definition(result), max_workers=1, shared_memory=shared_memory) as codec_pool:
+        assert codec_pool.decode_messages(byte_blobs[:3], 'Example') == rows[:3]
+        assert codec_pool.decode_columns([], 'Example') == {}
+
+    print(f'test_codec_pool with shared_memory={shared_memory} is valid!')
+
+
+def test_shared_columns():
+    columns = {
+        'ints': [1, None, -(1 << 63), (1 << 63) - 1],
+        'large_ints': [1, 1 << 64, None, 3],
+        'floats': [0.5, None, 1.25, None],
+        'bools': [True, False, None, True],
+        'strings': ['example', None, '', 'ëxample'],
+        'bytes': [b'\x00\xff', b'', None, b'example'],
+        'messages': [{'example_float': 0.5}, None, {}, {'example_float': 1.5}],
+        'mixed': [1, 'example', None, 0.5],
+        'empty': [None, None, None, None],
+    }
+    segment_name, layout = _write_shared_columns(columns)
+    assert dict((field_name, kind) for field_name, kind, *_ in layout) == {
+        'ints': 'q', 'large_ints': 'pickle', 'floats': 'd', 'bools': 'b', 'strings': 's', 'bytes': 'y',
+        'messages': 'pickle', 'mixed': 'pickle', 'empty': 'b',
+    }
+    assert _read_shared_columns(segment_name, layout) == columns
+
+    print('test_shared_columns is valid!')
+
+
+@pytest.mark.skipif(not os.path.isdir('/dev/shm'), reason='shared memory segments are not listed in /dev/shm')
+def test_codec_pool_shared_memory_error():
+    result = parse(codec_pool_definition)
+    byte_blobs = [result.Example(example_int=index, example_string=f'example {index}').encode()
+                  for index in range(1, 65)]
+    # The invalid message is in the last batch, the other batches return their columns in shared memory.
+    invalid_byte_blob = b'\x08\x96\x01\x0b\x01'
+
+    with CodecPool(result, max_workers=2, batch_size=16, shared_memory=True) as codec_pool:
+        segments = set(os.listdir('/dev/shm'))
+        with pytest.raises(KeyError):
+            codec_pool.decode_columns(byte_blobs + [invalid_byte_blob], 'Example')
+        assert set(os.listdir('/dev/shm')) == segments
+
+        assert codec_pool.decode_columns(byte_blobs, 'Example')['example_int'] == list(range(1, 65))
+        assert set(os.listdir('/dev/shm')) == segments
+
+    print('test_codec_pool_shared_memory_error is valid!')
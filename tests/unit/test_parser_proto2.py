@@ -1,9 +1,13 @@
+import gc
 import os
 import time
+import weakref
 
-from dynamic_protobuf import parse, DecoderFieldDefinition, WireType
+from dynamic_protobuf import parse, DecoderFieldDefinition, WireType, TypeRegistry, PackingBackend, \
+    register_packing_backend, set_packing_backend, EncodingCache, DecodeCache
 from parser import ProtobufMessageDefinition
 from protobuf_definition_types import ProtobufLabel, ProtobufType
+from protobuf_instance import ProtobufClasses
 
 
 def test_parser_basic_case():
@@ -773,13 +777,11 @@ message Example {
         example_any=result.google.protobuf.Any.pack(packable_value)
     )
 
-    assert proto_message.example_any.type_url == 'type.googleapis.com/Example'
-    assert proto_message.example_any.value == (b'\n\x12\n\x05value\x12\t3int\x80\x04K\x01.\n&\n\x07value_2\x12'
-                                               b'\x1b5float\x80\x04\x95\n\x00\x00\x00\x00\x00\x00\x00G@\x00\x00'
-                                               b'\x00\x00\x00\x00\x00.\n"\n\x07value_3\x12\x173str\x80\x04\x95'
-                                               b'\x08\x00\x00\x00\x00\x00\x00\x00\x8c\x04test\x94.\n$\n\x07value_4'
-                                               b'\x12\x195bytes\x80\x04\x95\x08\x00\x00\x00\x00\x00\x00\x00C'
-                                               b'\x04test\x94.\n\x14\n\x07value_5\x12\t4bool\x80\x04\x88.')
+    # Objects packed by a backend have the type URL of the backend and their class, not of the message they are in.
+    assert proto_message.example_any.type_url == \
+        'type.py-dynamic-protobuf/packing/pickle/unit.test_parser_proto2.PackableValue'
+    assert proto_message.example_any.value.startswith(b'\x05value\x03int')
+    assert proto_message.example_any.unpack(PackableValue) == packable_value
 
     encoded_message = proto_message.encode()
     decoded_message = result.Example.decode(encoded_message)
@@ -788,6 +790,21 @@ message Example {
     decoded_packable_value = decoded_message.example_any.unpack(PackableValue)
     assert packable_value == decoded_packable_value
 
+    # The pickle backend of the type URL needs the class, the value is not unpacked as a message.
+    try:
+        decoded_message.example_any.unpack()
+        assert False
+    except ValueError as e:
+        assert str(e) == 'The pickle packing backend needs the class to unpack.'
+
+    # The value is decoded as bytes, also when it contains bytes that are not valid UTF-8.
+    packable_value = PackableValue(value=bytes(range(256)) * 4096, value_2=0.5, value_3='ëxample', value_4=b'\xff',
+                                   value_5=False)
+    proto_message = result.Example(example_any=result.google.protobuf.Any.pack(packable_value))
+    decoded_message = result.Example.decode(proto_message.encode())
+    assert decoded_message.example_any.value == proto_message.example_any.value
+    assert decoded_message.example_any.unpack(PackableValue) == packable_value
+
     print('test_any_pickle is valid!')
 
 
@@ -824,7 +841,8 @@ message Example {
         example_any=result.google.protobuf.Any.pack(packable_value)
     )
 
-    assert proto_message.example_any.type_url == 'type.googleapis.com/Example'
+    assert proto_message.example_any.type_url == \
+        'type.py-dynamic-protobuf/packing/jsonpickle/unit.test_parser_proto2.PackableValue'
     assert proto_message.example_any.value == (b'{"py/object": "unit.test_parser_proto2.PackableValue", "value": 1, '
                                                b'"value_2": 2.0, "value_3": "test", "value_4": {"py/b64": "dGVzdA=="}, '
                                                b'"value_5": true}')
@@ -836,9 +854,228 @@ message Example {
     decoded_packable_value = decoded_message.example_any.unpack(PackableValue)
     assert packable_value == decoded_packable_value
 
+    # The value is unpacked by the jsonpickle backend of its type URL, which does not need the class.
+    constants.PACKING_BACKEND = 'pickle'
+    assert decoded_message.example_any.unpack() == packable_value
+
     print('test_any_jsonpickle is valid!')
 
 
+def test_any_message():
+    proto_definition = """syntax = "proto2";
+
+import "google/protobuf/any.proto";
+
+message Example {
+    optional google.protobuf.Any example_any = 1;
+}
+"""
+    packed_definition = """syntax = "proto2";
+package example.packed;
+
+message ExamplePacked {
+    optional int32 example_int = 1;
+    optional string example_string = 2;
+
+    message ExampleNested {
+        optional int32 example_nested_int = 1;
+    }
+}
+
+message ExampleOther {
+    message ExampleNested {
+        optional string example_other_string = 1;
+    }
+}
+"""
+    result = parse(proto_definition, imports_path='imports')
+    packed_result = parse(packed_definition)
+
+    packed_message = packed_result.ExamplePacked(example_int=3, example_string='content')
+    proto_message = result.Example(example_any=result.google.protobuf.Any.pack(packed_message))
+
+    assert proto_message.example_any.type_url == 'type.googleapis.com/example.packed.ExamplePacked'
+    assert proto_message.example_any.value == b'\x08\x03\x12\x07content'
+
+    decoded_message = result.Example.decode(proto_message.encode())
+    assert decoded_message == proto_message
+    assert decoded_message.example_any.type_url == 'type.googleapis.com/example.packed.ExamplePacked'
+
+    # The message class is found by the type URL, or can be given.
+    unpacked_message = decoded_message.example_any.unpack()
+    assert type(unpacked_message) is packed_result.ExamplePacked
+    assert unpacked_message == packed_message
+    assert decoded_message.example_any.unpack(packed_result.ExamplePacked) == packed_message
+
+    # Nested messages with the same name are unpacked as the message of their own type URL.
+    nested_class = packed_result['ExamplePacked.ExampleNested']
+    any_message = result.google.protobuf.Any.pack(nested_class(example_nested_int=5))
+    assert any_message.type_url == 'type.googleapis.com/example.packed.ExamplePacked.ExampleNested'
+    assert nested_class.definition.get_fully_qualified_name() == 'example.packed.ExamplePacked.ExampleNested'
+    assert type(any_message.unpack()) is nested_class
+    assert any_message.unpack() == nested_class(example_nested_int=5)
+
+    other_nested_class = packed_result['ExampleOther.ExampleNested']
+    any_message = result.google.protobuf.Any.pack(other_nested_class(example_other_string='content'))
+    assert any_message.type_url == 'type.googleapis.com/example.packed.ExampleOther.ExampleNested'
+    assert type(any_message.unpack()) is other_nested_class
+    assert any_message.unpack().example_other_string == 'content'
+
+    type_registry = TypeRegistry()
+    try:
+        decoded_message.example_any.unpack(type_registry=type_registry)
+        assert False
+    except Exception as e:
+        assert str(e) == 'Unknown type URL type.googleapis.com/example.packed.ExamplePacked'
+
+    type_registry.add(packed_result)
+    assert type(decoded_message.example_any.unpack(type_registry=type_registry)) is packed_result.ExamplePacked
+
+    print('test_any_message is valid!')
+
+
+def test_type_registry_weak_references():
+    packed_definition = """syntax = "proto2";
+package example.weak;
+
+message ExampleWeak {
+    optional int32 example_int = 1;
+}
+"""
+    packed_result = parse(packed_definition)
+    type_registry = TypeRegistry()
+    type_registry.add(packed_result)
+    assert type_registry.resolve('type.googleapis.com/example.weak.ExampleWeak') is packed_result.ExampleWeak
+
+    # The registry and its resolved type URLs do not keep the definition alive.
+    definition_reference = weakref.ref(packed_result)
+    del packed_result
+    gc.collect()
+    assert definition_reference() is None
+    try:
+        type_registry.resolve('type.googleapis.com/example.weak.ExampleWeak')
+        assert False
+    except Exception as e:
+        assert str(e) == 'Unknown type URL type.googleapis.com/example.weak.ExampleWeak'
+
+    print('test_type_registry_weak_references is valid!')
+
+
+def test_packed_fields():
+    proto_definition = """syntax = "proto2";
+
+import "google/protobuf/any.proto";
+
+message Example {
+    repeated int32 example_ints = 1 [packed = true];
+    optional ExamplePacked example_packed = 2;
+    optional google.protobuf.Any example_any = 3;
+}
+
+message ExamplePacked {
+    repeated float example_floats = 1 [packed = true];
+    repeated ExampleEnum example_enums = 2 [packed = true];
+    repeated int64 example_int64s = 3 [packed = true];
+}
+
+enum ExampleEnum {
+    EXAMPLE_A = 0;
+    EXAMPLE_B = 1;
+}
+"""
+    result = parse(proto_definition, imports_path='imports')
+
+    packed_message = result.ExamplePacked(example_floats=[0.5, 1.5], example_enums=[1, 0, 1], example_int64s=[7])
+    proto_message = result.Example(
+        example_ints=[1, 2, 300],
+        example_packed=packed_message,
+        example_any=result.google.protobuf.Any.pack(packed_message),
+    )
+
+    # Packed fields are decoded with the wire type of their field type, also in sub-messages and packed messages.
+    decoded_message = result.Example.decode(proto_message.encode())
+    assert decoded_message == proto_message
+    assert decoded_message.example_ints == [1, 2, 300]
+    assert decoded_message.example_packed.example_floats == [0.5, 1.5]
+    assert decoded_message.example_packed.example_int64s == [7]
+    assert decoded_message.example_any.unpack() == packed_message
+
+    print('test_packed_fields is valid!')
+
+
+class ReprPackingBackend(PackingBackend):
+    name = 'repr'
+
+    def pack(self, obj) -> bytes:
+        return repr(obj.__dict__).encode()
+
+    def unpack(self, value: bytes, clazz: type | None):
+        import ast
+        instance = clazz.__new__(clazz)
+        instance.__dict__.update(ast.literal_eval(value.decode()))
+        return instance
+
+
+class PackOnlyPackingBackend(PackingBackend):
+    name = 'pack_only'
+
+    def pack(self, obj) -> bytes:
+        return b''
+
+
+class OtherPackableValue(PackableValue):
+    pass
+
+
+def test_any_packing_backends():
+    proto_definition = """syntax = "proto2";
+
+import "google/protobuf/any.proto";
+
+message Example {
+    optional google.protobuf.Any example_any = 1;
+}
+"""
+    result = parse(proto_definition, imports_path='imports')
+    packable_value = PackableValue(value=1, value_2=2.0, value_3='test', value_4=b'test', value_5=True)
+    register_packing_backend(ReprPackingBackend())
+
+    try:
+        # The backend is selected per call.
+        any_message = result.google.protobuf.Any.pack(packable_value, backend='repr')
+        assert any_message.value == (b"{'value': 1, 'value_2': 2.0, 'value_3': 'test', 'value_4': b'test', "
+                                     b"'value_5': True}")
+        decoded_message = result.Example.decode(result.Example(example_any=any_message).encode())
+        assert decoded_message.example_any.unpack(PackableValue, backend='repr') == packable_value
+
+        any_message = result.google.protobuf.Any.pack(packable_value, backend='pickle')
+        assert any_message.unpack(PackableValue, backend='pickle') == packable_value
+
+        # Or per class, including subclasses.
+        set_packing_backend(PackableValue, 'repr')
+        other_packable_value = OtherPackableValue(value=2, value_2=3.0, value_3='other', value_4=b'', value_5=False)
+        any_message = result.google.protobuf.Any.pack(other_packable_value)
+        assert any_message.value.startswith(b"{'value': 2")
+        assert any_message.unpack(OtherPackableValue) == other_packable_value
+
+        try:
+            result.google.protobuf.Any.pack(packable_value, backend='unknown')
+            assert False
+        except ValueError as e:
+            assert str(e) == 'Packing backend unknown not supported.'
+    finally:
+        set_packing_backend(PackableValue, None)
+
+    # Backends that only implement half of the interface can not be created, so they can not be registered.
+    try:
+        PackOnlyPackingBackend()
+        assert False
+    except TypeError as e:
+        assert 'unpack' in str(e)
+
+    print('test_any_packing_backends is valid!')
+
+
 def test_parser_oneof():
     proto_definition = """syntax = "proto2";
 message Example {
@@ -979,6 +1216,226 @@ message ExampleSubMessage {
     print('test_parser_map is valid!')
 
 
+def test_parser_map_entries():
+    proto_definition = """syntax = "proto2";
+message Example {
+    optional map<string, int32> example_map = 1;
+    optional ExampleSubMessage example_sub_message = 2;
+}
+
+message ExampleSubMessage {
+    optional map<int32, string> example_map = 1;
+}
+"""
+
+    result = parse(proto_definition)
+
+    # Entries are encoded as key/value messages, like the standard Protobuf encoding of maps.
+    proto_message = result.ExampleSubMessage(example_map={1: 'a'})
+    assert proto_message.encode() == b'\n\x05\x08\x01\x12\x01a'
+
+    proto_message = result.Example(
+        example_map={'key_1': 1, 'key_2': 0, '': 3},
+        example_sub_message={'example_map': {1: 'value_1', 2: ''}}
+    )
+    assert proto_message.example_map == {'key_1': 1, 'key_2': 0, '': 3}
+
+    decoded_message = result.Example.decode(proto_message.encode())
+    assert decoded_message == proto_message
+    assert decoded_message.example_map['key_2'] == 0
+    assert decoded_message.example_sub_message.example_map == {1: 'value_1', 2: ''}
+
+    # Every map field has its own map type, with the codecs of its key and value type.
+    assert type(decoded_message.example_map) is not type(decoded_message.example_sub_message.example_map)
+
+    print('test_parser_map_entries is valid!')
+
+
+def test_parser_map_unset_proto3():
+    proto_definition = """syntax = "proto3";
+message Example {
+    map<int32, string> example_map = 1;
+    int32 example_int = 2;
+}
+"""
+
+    result = parse(proto_definition)
+
+    # An unset map is not encoded, so it is decoded as an empty map.
+    proto_message = result.Example(example_int=1)
+    assert proto_message.encode() == b'\x10\x01'
+
+    decoded_message = result.Example.decode(proto_message.encode())
+    assert decoded_message.example_map == {}
+    assert decoded_message.example_int == 1
+
+    print('test_parser_map_unset_proto3 is valid!')
+
+
+def test_deterministic_encoding():
+    proto_definition = """syntax = "proto2";
+message Example {
+    optional int32 example_int = 2;
+    optional map<string, ExampleValue> example_map = 3;
+    optional string example_string = 1;
+}
+
+message ExampleValue {
+    optional map<int32, int32> example_value_map = 2;
+    optional int32 example_value_int = 1;
+}
+"""
+
+    result = parse(proto_definition)
+
+    proto_message = result.Example(
+        example_int=5,
+        example_string='content',
+        example_map={'b': {'example_value_map': {2: 2, 1: 1}, 'example_value_int': 3}, 'a': {}},
+    )
+    reordered_message = result.Example(
+        example_map={'a': {}, 'b': {'example_value_int': 3, 'example_value_map': {1: 1, 2: 2}}},
+        example_string='content',
+        example_int=5,
+    )
+    assert proto_message == reordered_message
+    assert proto_message.encode() != reordered_message.encode()
+
+    # Fields are ordered by number and map entries by key, also in the values of maps.
+    encoded_message = proto_message.encode(deterministic=True)
+    assert encoded_message == reordered_message.encode(deterministic=True)
+    assert encoded_message == (b'\n\x07content\x10\x05\x1a\x05\n\x01a\x12\x00\x1a\x13\n\x01b\x12\x0e\x08\x03'
+                               b'\x12\x04\x08\x01\x10\x01\x12\x04\x08\x02\x10\x02')
+    assert result.Example.decode(encoded_message) == proto_message
+
+    assert proto_message.fingerprint() == reordered_message.fingerprint()
+    assert len(proto_message.fingerprint()) == 16
+    assert proto_message.fingerprint() != result.Example(example_int=6).fingerprint()
+
+    print('test_deterministic_encoding is valid!')
+
+
+def test_frozen_message():
+    proto_definition = """syntax = "proto2";
+message Example {
+    optional int32 example_int = 1;
+    optional string example_string = 2;
+    repeated int32 example_repeated = 3;
+    optional map<string, ExampleValue> example_map = 4;
+    optional ExampleValue example_value = 5;
+}
+
+message ExampleValue {
+    optional int32 example_value_int = 1;
+}
+"""
+
+    result = parse(proto_definition)
+
+    proto_message = result.Example(
+        example_int=1,
+        example_string='content',
+        example_repeated=[1, 2],
+        example_map={'a': {'example_value_int': 2}},
+        example_value={'example_value_int': 3},
+    )
+    frozen_message = proto_message.freeze()
+
+    assert isinstance(frozen_message, result.Example)
+    assert frozen_message == proto_message
+    assert frozen_message.encode() == proto_message.encode()
+    assert frozen_message.encode() is frozen_message.encode()
+    assert frozen_message.encode(deterministic=True) == proto_message.encode(deterministic=True)
+    assert frozen_message.fingerprint() == proto_message.fingerprint()
+    assert result.Example.decode(frozen_message.encode()) == proto_message
+
+    # The message, its sub-messages, maps and repeated fields can not be changed.
+    changes = [
+        lambda: setattr(frozen_message, 'example_int', 2),
+        lambda: delattr(frozen_message, 'example_string'),
+        lambda: setattr(frozen_message.example_value, 'example_value_int', 4),
+        lambda: frozen_message.example_map.update({'b': {}}),
+        lambda: frozen_message.example_map['a'].__setattr__('example_value_int', 4),
+        lambda: frozen_message.example_repeated.append(3),
+    ]
+    for change in changes:
+        try:
+            change()
+            assert False
+        except Exception as e:
+            assert 'is frozen and can not be changed' in str(e)
+    assert proto_message.freeze() == frozen_message
+
+    # Frozen sub-messages are encoded with their cached encoding, also in messages that are not frozen.
+    frozen_value = result.ExampleValue(example_value_int=3).freeze()
+    assert result.Example(example_value=frozen_value).encode() == result.Example(example_value={
+        'example_value_int': 3}).encode()
+
+    # Equal messages share one frozen message in an encoding cache.
+    encoding_cache = EncodingCache(max_size=2)
+    cached_message = proto_message.freeze(encoding_cache)
+    assert result.Example(
+        example_value={'example_value_int': 3},
+        example_map={'a': {'example_value_int': 2}},
+        example_repeated=[1, 2],
+        example_string='content',
+        example_int=1,
+    ).freeze(encoding_cache) is cached_message
+    assert frozen_message.freeze(encoding_cache) is cached_message
+    assert hash(frozen_message) == hash(cached_message)
+
+    encoding_cache.get(result.Example(example_int=2))
+    encoding_cache.get(result.Example(example_int=3))
+    assert len(encoding_cache) == 2
+    assert proto_message.freeze(encoding_cache) is not cached_message
+
+    print('test_frozen_message is valid!')
+
+
+def test_decode_cache():
+    proto_definition = """syntax = "proto2";
+message Example {
+    optional int32 example_int = 1;
+    optional map<string, int32> example_map = 2;
+}
+
+message ExampleOther {
+    optional int32 example_other_int = 1;
+}
+"""
+
+    result = parse(proto_definition)
+    decode_cache = DecodeCache(max_size=2)
+
+    encoded_message = result.Example(example_int=1, example_map={'a': 1}).encode()
+    decoded_message = result.Example.decode(encoded_message, decode_cache=decode_cache)
+    assert decoded_message == result.Example.decode(encoded_message)
+    assert isinstance(decoded_message, result.Example)
+    try:
+        decoded_message.example_int = 2
+        assert False
+    except Exception as e:
+        assert str(e) == 'Message Example is frozen and can not be changed'
+
+    # Messages decoded from the same bytes are returned from the cache, also for other byte buffers.
+    assert result.Example.decode(bytearray(encoded_message), decode_cache=decode_cache) is decoded_message
+    assert (decode_cache.hits, decode_cache.misses, decode_cache.evictions) == (1, 1, 0)
+
+    # Messages of other classes are cached separately.
+    other_message = result.ExampleOther.decode(encoded_message[:2], decode_cache=decode_cache)
+    assert type(other_message) is not type(decoded_message)
+    assert other_message.example_other_int == 1
+    result.Example.decode(encoded_message[:2], decode_cache=decode_cache)
+    assert (decode_cache.hits, decode_cache.misses, decode_cache.evictions) == (1, 3, 1)
+    assert len(decode_cache) == 2
+
+    assert result.Example.decode(encoded_message, decode_cache=decode_cache) is not decoded_message
+    decode_cache.clear()
+    assert len(decode_cache) == 0
+
+    print('test_decode_cache is valid!')
+
+
 def test_parser_service():
     proto_definition = """syntax = "proto2";
 service Example {
@@ -1006,3 +1463,339 @@ message ExampleResponse {
     assert result.services['Example'].methods['ExampleMethod'].output_type == result.messages['ExampleResponse']
 
     print('test_parser_service is valid!')
+
+
+def test_parser_nested_enum():
+    proto_definition = """syntax = "proto2";
+message Example {
+    enum ExampleEnum {
+        option allow_alias = true;
+        EXAMPLE_ENUM_1 = 1;
+        EXAMPLE_ENUM_2 = 2 [deprecated = true];
+    }
+    optional ExampleEnum example_enum = 1 [default = EXAMPLE_ENUM_2];
+}
+enum OtherEnum { OTHER_ENUM_NEGATIVE = -1; OTHER_ENUM_HEX = 0x10; }
+message ExampleAfterEnum {
+    optional OtherEnum other_enum = 1;
+}
+"""
+
+    start = time.time()
+    result = parse(proto_definition)
+    print(f'Parsed in {(time.time() - start) * 1_000_000:.6f} microseconds')
+
+    assert result.enums['ExampleEnum'].values_by_name == {'EXAMPLE_ENUM_1': 1, 'EXAMPLE_ENUM_2': 2}
+    assert result.messages['Example'].fields_by_name['example_enum'].type == result.enums['ExampleEnum']
+    assert result.messages['Example'].fields_by_name['example_enum'].options['default'] == 2
+    assert result.enums['OtherEnum'].values_by_name == {'OTHER_ENUM_NEGATIVE': -1, 'OTHER_ENUM_HEX': 16}
+    assert result.messages['ExampleAfterEnum'].fields_by_name['other_enum'].type == result.enums['OtherEnum']
+
+    print('test_parser_nested_enum is valid!')
+
+
+def test_parser_syntax_variations():
+    proto_definition = """/* A multiline comment
+ * before the syntax */
+syntax = 'proto2';
+package example.package;
+option java_package = "com.example";
+option (custom_option) = { value: 1 };
+
+message Example {
+    optional int32 example_int = 1 [default = -5, deprecated = true, json_name = "exampleInt", (custom) = 1];
+    optional string example_string = 2 [default = "with, comma"]; // Trailing comment
+    // A comment on its own line
+    optional int32 example_next = 3;
+    reserved 5 to 7, "old_field";
+    extensions 100 to 199;
+}
+
+service ExampleService {
+    option deprecated = true;
+    rpc StreamMethod (stream Example) returns (stream Example) {
+        option deprecated = true;
+    }
+    rpc Method (Example) returns (Example);
+}
+"""
+
+    start = time.time()
+    result = parse(proto_definition)
+    print(f'Parsed in {(time.time() - start) * 1_000_000:.6f} microseconds')
+
+    assert result.syntax == 'proto2'
+    assert result.package == 'example.package'
+    assert result.comments == ['A multiline comment before the syntax']
+
+    fields = result.messages['Example'].fields_by_name
+    assert fields['example_int'].options == {'default': -5, 'deprecated': True, 'json_name': 'exampleInt',
+                                             '(custom)': 1}
+    assert fields['example_string'].options == {'default': 'with, comma'}
+    assert fields['example_string'].comment == 'Trailing comment'
+    assert fields['example_next'].comment is None
+    assert result.messages['Example'].reserved_field_numbers == {5, 6, 7}
+
+    methods = result.services['ExampleService'].methods
+    assert methods['StreamMethod'].input_type == result.messages['Example']
+    assert methods['Method'].output_type == result.messages['Example']
+
+    print('test_parser_syntax_variations is valid!')
+
+
+def test_parser_invalid_definition():
+    try:
+        parse('syntax = "proto2";\nmessage Example {\n    optional int32 example_int = ;\n}\n')
+    except Exception as error:
+        assert str(error) == 'Expected number but found ";" on line 3'
+    else:
+        raise AssertionError('Expected an exception for an invalid definition')
+
+    print('test_parser_invalid_definition is valid!')
+
+
+def test_parser_lazy_message_classes():
+    proto_definition = """syntax = "proto2";
+import "google/protobuf/timestamp.proto";
+
+message Example {
+    optional ExampleSubMessage example_sub_message = 1;
+    optional google.protobuf.Timestamp example_timestamp = 2;
+    optional ExampleEnum example_enum = 3;
+}
+
+message ExampleSubMessage {
+    optional int32 example_int = 1;
+}
+
+enum ExampleEnum {
+    EXAMPLE_ENUM_VALUE = 1;
+}
+"""
+
+    result = parse(proto_definition)
+
+    # Classes are only created when they are used.
+    assert len(result.message_classes) == 0
+    assert len(result.enum_classes) == 0
+
+    example_class = result.Example
+    assert result.Example is example_class
+    assert list(result.message_classes) == ['Example']
+    assert 'ExampleSubMessage' in result.message_classes
+    assert 'Missing' not in result.message_classes
+    assert result.message_classes.get('Missing') is None
+    assert result.ExampleEnum.EXAMPLE_ENUM_VALUE == 1
+
+    proto_message = result.Example(example_sub_message={'example_int': 1},
+                                   example_timestamp=result.google.protobuf.Timestamp(seconds=1),
+                                   example_enum=result.ExampleEnum.EXAMPLE_ENUM_VALUE)
+    assert result.Example.decode(proto_message.encode()) == proto_message
+
+    # The classes are created by the subclasses, which can not be created without doing so.
+    class IncompleteClasses(ProtobufClasses):
+        pass
+
+    try:
+        IncompleteClasses(result)
+        assert False
+    except TypeError as e:
+        assert '_create' in str(e)
+
+    print('test_parser_lazy_message_classes is valid!')
+
+
+def test_parser_symbol_index():
+    proto_definition = """syntax = "proto2";
+package example.package;
+
+message Example {
+    optional ExampleNested example_nested = 1;
+
+    message ExampleNested {
+        optional ExampleNestedEnum example_enum = 1;
+
+        enum ExampleNestedEnum {
+            EXAMPLE_ENUM_VALUE = 1;
+        }
+    }
+}
+
+message Other {
+    optional ExampleNested other_nested = 1;
+
+    message ExampleNested {
+        optional string other_string = 1;
+    }
+
+    enum ExampleNestedEnum {
+        OTHER_ENUM_VALUE = 2;
+    }
+}
+"""
+
+    result = parse(proto_definition)
+
+    # The short names refer to the last nested messages and enums with those names, the other names to their own.
+    other_nested_class = result['Other.ExampleNested']
+    assert result.ExampleNested is other_nested_class
+    assert result['example.package.Other.ExampleNested'] is other_nested_class
+    assert result.ExampleNestedEnum.OTHER_ENUM_VALUE == 2
+    assert result['Other.ExampleNestedEnum'].OTHER_ENUM_VALUE == 2
+
+    nested_class = result['Example.ExampleNested']
+    assert nested_class.definition is result.messages['Example'].fields_by_name['example_nested'].type
+    assert result.get('Example.ExampleNested') is nested_class
+    assert result['example.package.Example.ExampleNested'] is nested_class
+    assert result['example.package.Example'] is result.Example
+    assert result['Example.ExampleNested.ExampleNestedEnum'].EXAMPLE_ENUM_VALUE == 1
+    assert result.get('example.package.Example.ExampleNested.ExampleNestedEnum').EXAMPLE_ENUM_VALUE == 1
+    assert isinstance(result['Missing'], ValueError)
+    assert result.messages['ExampleNested'].scope == 'Other'
+    assert result.enums['ExampleNestedEnum'].scope == 'Other'
+    assert result['Example.ExampleNested.ExampleNestedEnum'].definition.scope == 'Example.ExampleNested'
+
+    proto_message = result.Example(example_nested={'example_enum': 1})
+    assert result.Example.decode(proto_message.encode()) == proto_message
+
+    print('test_parser_symbol_index is valid!')
+
+
+def test_parser_scoped_references():
+    proto_definition = """syntax = "proto2";
+package example.package;
+
+message First {
+    optional Nested first_nested = 1;
+    optional Second.Nested second_nested = 2;
+    optional .example.package.Second second = 3;
+    optional example.package.First.Nested qualified_nested = 4;
+    optional map<int32, Nested> nested_map = 5;
+
+    message Nested {
+        optional int32 first_int = 1;
+    }
+}
+
+message Second {
+    optional Nested second_nested = 1;
+    optional Kind second_kind = 2 [default = SECOND_KIND];
+
+    message Nested {
+        optional string second_string = 1;
+    }
+
+    enum Kind {
+        SECOND_KIND = 2;
+    }
+}
+
+service ExampleService {
+    rpc Method (example.package.First) returns (.example.package.Second.Nested);
+}
+"""
+
+    result = parse(proto_definition)
+
+    first_nested, second_nested = [declaration for declaration in result.declarations
+                                   if declaration.name == 'Nested']
+    first_fields = result.messages['First'].fields_by_name
+    assert first_fields['first_nested'].type is first_nested
+    assert first_fields['second_nested'].type is second_nested
+    assert first_fields['second'].type is result.messages['Second']
+    assert first_fields['qualified_nested'].type is first_nested
+
+    second_fields = result.messages['Second'].fields_by_name
+    assert second_fields['second_nested'].type is second_nested
+    assert second_fields['second_kind'].options['default'] == 2
+
+    method = result.services['ExampleService'].methods['Method']
+    assert method.input_type is result.messages['First']
+    assert method.output_type is second_nested
+
+    # Nested messages with the same name have their own classes, so their values are encoded and decoded by their own
+    # fields.
+    proto_message = result.First(
+        first_nested={'first_int': 5},
+        second_nested={'second_string': 'content'},
+        nested_map={1: {'first_int': 6}},
+    )
+    assert type(proto_message.first_nested).definition is first_nested
+    assert type(proto_message.second_nested).definition is second_nested
+    encoded_message = proto_message.encode()
+    assert encoded_message == (
+        b'\n\x02\x08\x05\x12\t\n\x07content\x1a\x04\n\x00\x10\x02"\x00*\x06\x08\x01\x12\x02\x08\x06'
+    )
+
+    decoded_message = result.First.decode(encoded_message)
+    assert decoded_message == proto_message
+    assert type(decoded_message.first_nested).definition is first_nested
+    assert decoded_message.first_nested.first_int == 5
+    assert decoded_message.second_nested.second_string == 'content'
+    assert type(decoded_message.nested_map[1]).definition is first_nested
+    assert decoded_message.nested_map[1].first_int == 6
+
+    decoded_message = result.Second.decode(result.Second(second_nested={'second_string': 'content'}).encode())
+    assert decoded_message.second_nested.second_string == 'content'
+
+    print('test_parser_scoped_references is valid!')
+
+
+def test_parser_render_fields():
+    proto_definition = """syntax = "proto2";
+message Example {
+    optional int32 example_int = 1 [default = 5];
+    optional bytes example_bytes = 2;
+    oneof example_oneof {
+        int32 example_oneof_1 = 13;
+        int32 example_oneof_2 = 14;
+    }
+}
+"""
+
+    result = parse(proto_definition)
+    example = result.messages['Example']
+
+    # Only the given fields are rendered, unknown fields and default values are left out.
+    assert example.render(example_bytes='bytes', unknown=1, example_int=5) == {'example_bytes': b'bytes'}
+
+    # The last declared field of a oneof wins, regardless of the order of the arguments.
+    assert example.render(example_oneof_2=2, example_oneof_1=1) == {'example_oneof_2': 2}
+    assert example.render(example_oneof_1=1, example_oneof_2=2) == {'example_oneof_2': 2}
+
+    print('test_parser_render_fields is valid!')
+
+
+def test_parser_decode_nested_messages():
+    proto_definition = """syntax = "proto2";
+message Example {
+    optional int32 example_int = 1 [default = 5];
+    optional ExampleSubMessage example_sub_message = 2;
+}
+
+message ExampleSubMessage {
+    optional bytes example_bytes = 1;
+    optional ExampleSubSubMessage example_sub_sub_message = 2;
+}
+
+message ExampleSubSubMessage {
+    optional float example_float = 1;
+}
+"""
+
+    result = parse(proto_definition)
+
+    proto_message = result.Example(
+        example_int=3,
+        example_sub_message={'example_bytes': b'example bytes', 'example_sub_sub_message': {'example_float': 1.5}},
+    )
+    decoded_message = result.Example.decode(proto_message.encode())
+    assert decoded_message == proto_message
+    assert decoded_message == result.Example(**result.Example._proto_dict_numbers_to_names(
+        {1: 3, 2: {1: 'example bytes', 2: {1: 1.5}}}))
+    assert isinstance(decoded_message.example_sub_message.example_sub_sub_message, result.ExampleSubSubMessage)
+
+    # Default values are not set, like when the message is constructed.
+    assert 'example_int' not in result.Example.decode(result.Example(example_int=5).encode()).__dict__
+
+    print('test_parser_decode_nested_messages is valid!')
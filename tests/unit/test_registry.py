@@ -0,0 +1,118 @@
+import shutil
+
+from dynamic_protobuf import SchemaRegistry
+
+proto_definition = """syntax = "proto2";
+import "google/protobuf/timestamp.proto";
+import "custom_import.proto";
+
+message Example {
+    optional google.protobuf.Timestamp example_timestamp = 1;
+    optional ExampleSubMessage example_sub_message = 2;
+}
+"""
+
+other_proto_definition = """syntax = "proto2";
+import "google/protobuf/timestamp.proto";
+
+message OtherExample {
+    optional google.protobuf.Timestamp other_timestamp = 1;
+}
+"""
+
+
+def test_registry_memoizes_definitions():
+    registry = SchemaRegistry()
+
+    result = registry.parse(proto_definition, imports_path='imports')
+    assert registry.parse(proto_definition, imports_path='imports') is result
+    assert registry.parse(proto_definition + '\n', imports_path='imports') is not result
+
+    # Messages decoded with either definition are the same type.
+    proto_message = result.Example(example_timestamp=result.google.protobuf.Timestamp(seconds=1, nanos=2))
+    same_result = registry.parse(proto_definition, imports_path='imports')
+    assert same_result.Example.decode(proto_message.encode()) == proto_message
+
+    print('test_registry_memoizes_definitions is valid!')
+
+
+def test_registry_shares_imports():
+    registry = SchemaRegistry()
+
+    result = registry.parse(proto_definition, imports_path='imports')
+    other_result = registry.parse(other_proto_definition, imports_path='imports')
+    timestamp = result.messages['google.protobuf.Timestamp']
+    assert other_result.messages['google.protobuf.Timestamp'] is timestamp
+    assert other_result.messages['OtherExample'].fields_by_name['other_timestamp'].type is timestamp
+
+    proto_message = result.google.protobuf.Timestamp(seconds=1, nanos=2)
+    assert other_result.google.protobuf.Timestamp.decode(proto_message.encode()) == proto_message
+
+    print('test_registry_shares_imports is valid!')
+
+
+def test_registry_eviction(tmp_path):
+    registry = SchemaRegistry()
+
+    result = registry.parse(proto_definition, imports_path='imports')
+    assert registry.evict(proto_definition, imports_path='imports')
+    assert not registry.evict(proto_definition, imports_path='imports')
+    reparsed_result = registry.parse(proto_definition, imports_path='imports')
+    assert reparsed_result is not result
+    assert reparsed_result.messages['google.protobuf.Timestamp'] is result.messages['google.protobuf.Timestamp']
+
+    imports_path = tmp_path / 'imports'
+    shutil.copytree('imports', imports_path)
+    proto_file = imports_path / 'example.proto'
+    proto_file.write_text(proto_definition)
+    file_result = registry.parse_file(str(proto_file))
+    assert registry.parse_file(str(proto_file)) is file_result
+    assert registry.evict_file(str(proto_file))
+    assert not registry.evict_file(str(proto_file))
+    assert registry.parse_file(str(proto_file)) is not file_result
+
+    registry.clear()
+    assert len(registry) == 0
+    assert registry.parse(proto_definition, imports_path='imports') is not reparsed_result
+
+    print('test_registry_eviction is valid!')
+
+
+def test_registry_shares_imports_at_all_import_levels(tmp_path):
+    registry = SchemaRegistry()
+
+    # The shared file is imported by the definition itself and publicly by the file it imports.
+    (tmp_path / 'shared.proto').write_text("""syntax = "proto2";
+message SharedMessage {
+    optional int32 shared_int = 1;
+}
+""")
+    (tmp_path / 'left.proto').write_text("""syntax = "proto2";
+import public "shared.proto";
+
+message LeftMessage {
+    optional SharedMessage shared_message = 1;
+}
+""")
+    diamond_definition = """syntax = "proto2";
+import "left.proto";
+import "shared.proto";
+
+message Example {
+    optional LeftMessage left_message = 1;
+    optional SharedMessage shared_message = 2;
+}
+"""
+
+    result = registry.parse(diamond_definition, imports_path=str(tmp_path))
+    shared_message = result.messages['SharedMessage']
+    assert result.messages['LeftMessage'].fields_by_name['shared_message'].type is shared_message
+    assert result.messages['Example'].fields_by_name['shared_message'].type is shared_message
+    assert len(registry) == 3
+
+    proto_message = result.Example(left_message={'shared_message': {'shared_int': 1}}, shared_message={'shared_int': 2})
+    assert type(proto_message.left_message.shared_message) is type(proto_message.shared_message)
+    assert type(proto_message.shared_message) is result.SharedMessage
+    assert result.Example.decode(proto_message.encode()) == proto_message
+
+    print('test_registry_shares_imports_at_all_import_levels is valid!')
@@ -0,0 +1,81 @@
+import os
+import shutil
+import time
+
+from dynamic_protobuf import SchemaCache
+from schema_cache import dump_definition, load_definition
+from parser import parse
+
+proto_definition = """syntax = "proto2";
+import "google/protobuf/timestamp.proto";
+import "custom_import.proto";
+
+message Example {
+    optional google.protobuf.Timestamp example_timestamp = 1;
+    optional ExampleSubMessage example_sub_message = 2;
+    optional ExampleEnum example_enum = 3 [default = EXAMPLE_ENUM_2];
+}
+
+service ExampleService {
+    rpc ExampleMethod (Example) returns (ExampleSubMessage);
+}
+
+enum ExampleEnum {
+    EXAMPLE_ENUM_1 = 1;
+    EXAMPLE_ENUM_2 = 2;
+}
+"""
+
+
+def _assert_usable(result):
+    assert result.messages['Example'].fields_by_name['example_timestamp'].type == result.messages[
+        'google.protobuf.Timestamp']
+    assert result.messages['Example'].fields_by_name['example_sub_message'].type == result.messages['ExampleSubMessage']
+    assert result.messages['Example'].fields_by_name['example_enum'].type == result.enums['ExampleEnum']
+    assert result.messages['Example'].fields_by_name['example_enum'].options['default'] == 2
+    assert result.services['ExampleService'].methods['ExampleMethod'].input_type == result.messages['Example']
+
+    proto_message = result.Example(
+        example_timestamp=result.google.protobuf.Timestamp(seconds=1, nanos=2),
+        example_sub_message=result.ExampleSubMessage(example_int_1=1, example_int_2=2),
+    )
+    decoded_message = result.Example.decode(proto_message.encode())
+    assert proto_message == decoded_message
+    assert decoded_message.example_enum == 2
+
+
+def test_dump_and_load_definition():
+    result = load_definition(dump_definition(parse(proto_definition, imports_path='imports')))
+    _assert_usable(result)
+
+    print('test_dump_and_load_definition is valid!')
+
+
+def test_schema_cache(tmp_path):
+    imports_path = str(tmp_path / 'imports')
+    shutil.copytree('imports', imports_path)
+    schema_cache = SchemaCache(str(tmp_path / 'cache'))
+
+    start = time.time()
+    parsed_result = schema_cache.parse(proto_definition, imports_path)
+    print(f'Parsed in {(time.time() - start) * 1_000_000:.6f} microseconds')
+    _assert_usable(parsed_result)
+    assert len(os.listdir(tmp_path / 'cache')) == 1
+
+    start = time.time()
+    cached_result = schema_cache.parse(proto_definition, imports_path)
+    print(f'Loaded from cache in {(time.time() - start) * 1_000_000:.6f} microseconds')
+    assert cached_result is not parsed_result
+    assert schema_cache.load(proto_definition, imports_path) is not None
+    _assert_usable(cached_result)
+
+    # A changed import invalidates the cache entry.
+    with open(os.path.join(imports_path, 'custom_import.proto'), 'a') as custom_import:
+        custom_import.write('\nmessage AddedMessage {\n    optional int32 added_int = 1;\n}\n')
+    assert schema_cache.load(proto_definition, imports_path) is None
+
+    reparsed_result = schema_cache.parse(proto_definition, imports_path)
+    assert 'AddedMessage' in reparsed_result.messages
+    assert 'AddedMessage' in schema_cache.parse(proto_definition, imports_path).messages
+
+    print('test_schema_cache is valid!')
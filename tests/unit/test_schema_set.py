@@ -0,0 +1,147 @@
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pytest
+
+from dynamic_protobuf import parse_files
+from protobuf_definition_types import ProtobufType
+
+schema_files = {
+    'example.proto': """syntax = "proto2";
+import "shared.proto";
+import "google/protobuf/timestamp.proto";
+
+message Example {
+    optional SharedMessage shared_message = 1;
+    optional other.OtherSharedMessage other_shared_message = 2;
+    optional google.protobuf.Timestamp example_timestamp = 3;
+}
+""",
+    'other_example.proto': """syntax = "proto2";
+import "shared.proto";
+
+message OtherExample {
+    optional SharedMessage shared_message = 1;
+}
+""",
+    'extending.proto': """syntax = "proto2";
+import "shared.proto";
+
+extend SharedMessage {
+    optional float extension_float = 100;
+}
+""",
+    'shared.proto': """syntax = "proto2";
+import public "other/other_shared.proto";
+
+message SharedMessage {
+    optional int32 shared_int = 1;
+    extensions 100 to 199;
+}
+""",
+    'other/other_shared.proto': """syntax = "proto2";
+
+message OtherSharedMessage {
+    optional string other_shared_string = 1;
+}
+""",
+}
+
+
+@pytest.fixture
+def imports_path(tmp_path):
+    shutil.copytree('imports/google', tmp_path / 'google')
+    for filename, content in schema_files.items():
+        os.makedirs(os.path.dirname(tmp_path / filename), exist_ok=True)
+        (tmp_path / filename).write_text(content)
+    return str(tmp_path)
+
+
+@pytest.mark.parametrize('executor_class', [None, ThreadPoolExecutor, ProcessPoolExecutor])
+def test_parse_files(imports_path, executor_class):
+    files = ['example.proto', 'other_example.proto', 'extending.proto']
+    if executor_class:
+        with executor_class(max_workers=2) as executor:
+            result = parse_files(files, imports_path, executor=executor)
+    else:
+        result = parse_files(files, imports_path, max_workers=1)
+
+    assert list(result) == files
+    example = result['example.proto']
+    other_example = result['other_example.proto']
+
+    # Shared imports are parsed once.
+    shared_message = example.messages['SharedMessage']
+    assert other_example.messages['SharedMessage'] is shared_message
+    assert example.messages['Example'].fields_by_name['shared_message'].type is shared_message
+    assert other_example.messages['OtherExample'].fields_by_name['shared_message'].type is shared_message
+
+    # Public imports are available to the files importing the file with the public import.
+    assert example.messages['Example'].fields_by_name['other_shared_message'].type is \
+           example.messages['other.OtherSharedMessage']
+    assert example.messages['Example'].fields_by_name['example_timestamp'].type is \
+           example.messages['google.protobuf.Timestamp']
+
+    # Extensions are only added to the definition of the extending file.
+    extended_message = result['extending.proto'].messages['SharedMessage']
+    assert extended_message.fields_by_name['extension_float'].type == ProtobufType.FLOAT
+    assert 'extension_float' not in shared_message.fields_by_name
+    assert os.path.join(imports_path, 'shared.proto') in example.dependencies
+
+    proto_message = example.Example(
+        shared_message=example.SharedMessage(shared_int=1),
+        example_timestamp=example.google.protobuf.Timestamp(seconds=1, nanos=2),
+    )
+    assert example.Example.decode(proto_message.encode()) == proto_message
+
+    print('test_parse_files is valid!')
+
+
+def test_parse_files_import_cycle(tmp_path):
+    (tmp_path / 'a.proto').write_text('syntax = "proto2";\nimport "b.proto";\n')
+    (tmp_path / 'b.proto').write_text('syntax = "proto2";\nimport "a.proto";\n')
+
+    with pytest.raises(Exception, match='Import cycle'):
+        parse_files(['a.proto'], str(tmp_path), max_workers=1)
+
+    print('test_parse_files_import_cycle is valid!')
+
+
+def test_parse_files_reload(imports_path):
+    files = ['example.proto', 'other_example.proto', 'extending.proto']
+    result = parse_files(files, imports_path, max_workers=1)
+    assert result.reload() == []
+
+    example = result['example.proto']
+    other_example = result['other_example.proto']
+    extending = result['extending.proto']
+    shared_message_class = other_example.SharedMessage
+    example_shared_message_class = example.SharedMessage
+    other_shared_message_class = example.message_classes['other.OtherSharedMessage']
+    timestamp_class = example.message_classes['google.protobuf.Timestamp']
+
+    with open(os.path.join(imports_path, 'example.proto'), 'a') as file:
+        file.write('\nmessage AddedMessage {\n    optional int32 added_int = 1;\n}\n')
+
+    assert result.reload() == ['example.proto']
+    assert result['example.proto'] is not example
+    assert 'AddedMessage' in result['example.proto'].messages
+    assert result['other_example.proto'] is other_example
+    assert result['extending.proto'] is extending
+
+    # Message classes of messages that did not change keep their identity.
+    assert result['example.proto'].SharedMessage is example_shared_message_class
+    assert result['example.proto'].message_classes['other.OtherSharedMessage'] is other_shared_message_class
+    assert result['example.proto'].message_classes['google.protobuf.Timestamp'] is timestamp_class
+
+    # Files importing a changed file are reloaded as well.
+    with open(os.path.join(imports_path, 'shared.proto'), 'a') as file:
+        file.write('\nmessage AddedSharedMessage {\n    optional int32 added_int = 1;\n}\n')
+
+    assert sorted(result.reload()) == ['example.proto', 'extending.proto', 'other_example.proto', 'shared.proto']
+    assert result['other_example.proto'].SharedMessage is not shared_message_class
+    assert 'AddedSharedMessage' in result['other_example.proto'].messages
+    assert result['example.proto'].message_classes['other.OtherSharedMessage'] is other_shared_message_class
+
+    print('test_parse_files_reload is valid!')
@@ -0,0 +1,90 @@
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from dynamic_protobuf import parse, encode, decode
+
+# Every schema has maps with other key and value types, so concurrent threads use different map types.
+map_types = [
+    ('int32', 'int32'),
+    ('string', 'int32'),
+    ('int32', 'string'),
+    ('string', 'float'),
+    ('int64', 'bool'),
+    ('string', 'string'),
+    ('int32', 'ExampleValue'),
+    ('string', 'ExampleValue'),
+]
+
+values_by_type = {
+    'int32': lambda index: index,
+    'int64': lambda index: index * 1_000_000,
+    'string': lambda index: f'value_{index}',
+    'float': lambda index: index + 0.5,
+    'bool': lambda index: index % 2 == 1,
+    'ExampleValue': lambda index: {'example_int': index, 'example_string': f'nested_{index}'},
+}
+
+
+def create_schema(key_type: str, value_type: str) -> str:
+    return f"""syntax = "proto2";
+message Example {{
+    optional map<{key_type}, {value_type}> example_map = 1;
+    optional ExampleNested example_nested = 2;
+}}
+
+message ExampleNested {{
+    optional map<{value_type if value_type != 'ExampleValue' else 'int32'}, int32> example_nested_map = 1;
+}}
+
+message ExampleValue {{
+    optional int32 example_int = 1;
+    optional string example_string = 2;
+}}
+"""
+
+
+def test_concurrent_encode_decode():
+    schemas = [(parse(create_schema(key_type, value_type)), key_type, value_type)
+               for key_type, value_type in map_types]
+    thread_count = 16
+    barrier = threading.Barrier(thread_count)
+
+    def run(thread_index: int) -> int:
+        # All threads start at the same time, so the classes, render plans and map types of the schemas are
+        # created concurrently.
+        barrier.wait()
+        checked = 0
+        for repetition in range(20):
+            result, key_type, value_type = schemas[(thread_index + repetition) % len(schemas)]
+            nested_key_type = value_type if value_type != 'ExampleValue' else 'int32'
+
+            example_map = {values_by_type[key_type](index): values_by_type[value_type](index)
+                           for index in range(thread_index, thread_index + 20)}
+            nested_map = {values_by_type[nested_key_type](index): index for index in range(thread_index + 1)}
+            proto_message = result.Example(
+                example_map=example_map,
+                example_nested={'example_nested_map': nested_map},
+            )
+
+            decoded_message = result.Example.decode(proto_message.encode())
+            assert type(decoded_message) is result.Example
+            assert decoded_message == proto_message
+            assert decoded_message.example_nested.example_nested_map == nested_map
+
+            proto_dict = {1: thread_index, 2: {1: f'thread_{thread_index}', 2: repetition}}
+            assert decode(encode(proto_dict, determine_wire_types=True)) == proto_dict
+            checked += 1
+        return checked
+
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        with ThreadPoolExecutor(max_workers=thread_count) as executor:
+            results = list(executor.map(run, range(thread_count)))
+    finally:
+        sys.setswitchinterval(switch_interval)
+
+    assert results == [20] * thread_count
+
+    print('test_concurrent_encode_decode is valid!')